@@ -0,0 +1,100 @@
+"""
+In-process stand-ins for the S3 client and SQS queues used by the nodes.
+
+`install()` replaces boto3.client and boto3.resource, so it has to be
+called before the node's worker module is imported.
+"""
+import io
+import threading
+
+import boto3
+from botocore.exceptions import ClientError
+
+
+class StubS3Client(object):
+    def __init__(self):
+        self.objects = {}
+        self.lock = threading.Lock()
+        self.stats = {'put': 0, 'head': 0, 'get': 0, 'bytes': 0}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self.stats['head'] += 1
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({'Error': {'Code': '404'}}, 'HeadObject')
+        return {'ContentLength': len(self.objects[(Bucket, Key)])}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        if isinstance(Body, str):
+            Body = Body.encode('utf-8')
+        with self.lock:
+            self.objects[(Bucket, Key)] = Body
+            self.stats['put'] += 1
+            self.stats['bytes'] += len(Body)
+        return {}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        self.stats['get'] += 1
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+        return {'Body': io.BytesIO(self.objects[(Bucket, Key)])}
+
+
+class StubMessage(object):
+    def __init__(self, body):
+        self.body = body
+
+    def delete(self):
+        pass
+
+    def change_visibility(self, VisibilityTimeout):
+        pass
+
+
+class StubQueue(object):
+    def __init__(self, name):
+        self.name = name
+        self.messages = []
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'messages': 0, 'bytes': 0}
+
+    def send_message(self, MessageBody, **kwargs):
+        with self.lock:
+            self.messages.append(MessageBody)
+            self.stats['requests'] += 1
+            self.stats['messages'] += 1
+            self.stats['bytes'] += len(MessageBody)
+        return {}
+
+    def send_messages(self, Entries):
+        with self.lock:
+            self.stats['requests'] += 1
+            for entry in Entries:
+                self.messages.append(entry['MessageBody'])
+                self.stats['messages'] += 1
+                self.stats['bytes'] += len(entry['MessageBody'])
+        return {'Successful': [{'Id': entry['Id']} for entry in Entries]}
+
+    def receive_messages(self, MaxNumberOfMessages=1, **kwargs):
+        with self.lock:
+            taken = self.messages[:MaxNumberOfMessages]
+            del self.messages[:MaxNumberOfMessages]
+        return [StubMessage(body) for body in taken]
+
+
+class StubSQSResource(object):
+    def __init__(self):
+        self.queues = {}
+
+    def get_queue_by_name(self, QueueName, **kwargs):
+        if QueueName not in self.queues:
+            self.queues[QueueName] = StubQueue(QueueName)
+        return self.queues[QueueName]
+
+
+s3_client = StubS3Client()
+sqs_resource = StubSQSResource()
+
+
+def install():
+    boto3.client = lambda service, *args, **kwargs: s3_client
+    boto3.resource = lambda service, *args, **kwargs: sqs_resource
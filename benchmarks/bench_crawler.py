@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""
+Crawl synthetic sites with crawler-node GenericWebsiteSpider, S3 and SQS
+replaced by aws_stubs. Started by run.py, prints the result as JSON.
+"""
+import argparse
+import os
+import sys
+from urllib.parse import urlparse
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(BASE_DIR, 'crawler-node', 'src'))
+
+import aws_stubs  # NOQA
+aws_stubs.install()
+
+import worker  # NOQA
+from scrapy import signals  # NOQA
+from scrapy.crawler import CrawlerProcess  # NOQA
+from metrics import LatencyRecorder, ResourceUsage, report  # NOQA
+
+
+class BenchSpider(worker.GenericWebsiteSpider):
+    def __init__(self, *args, **kwargs):
+        super(BenchSpider, self).__init__(*args, **kwargs)
+        # the offsite filter matches host names, without the port of the synthetic site
+        self.allowed_domains = [urlparse(url).hostname for url in self.start_urls]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('domains', nargs='+')
+    parser.add_argument('--delay', type=float, default=None,
+                        help="DOWNLOAD_DELAY, instead of the configured one")
+    args = parser.parse_args()
+
+    latency = LatencyRecorder()
+    usage = ResourceUsage()
+    # scrapy logs these and goes on, the benchmark must not
+    errors = {'postprocess': 0, 'crawl': 0}
+
+    settings = dict(worker.SCRAPY_SETTINGS)
+    settings['LOG_LEVEL'] = 'WARNING'
+    if args.delay is not None:
+        settings['DOWNLOAD_DELAY'] = args.delay
+    BenchSpider.results_queue = worker.results_queue
+
+    # signal receivers are weak references, they must outlive the crawl
+    def fetch_started(request, spider):
+        latency.start(request.url)
+
+    def item_scraped(item, response, spider):
+        latency.finish(response.url)
+
+    def item_error(item, response, spider, failure):
+        errors['postprocess'] += 1
+
+    def spider_error(failure, response, spider):
+        errors['crawl'] += 1
+
+    def crawl_failed(failure):
+        errors['crawl'] += 1
+        failure.printTraceback()
+
+    process = CrawlerProcess(settings)
+    for domain in args.domains:
+        crawler = process.create_crawler(BenchSpider)
+        crawler.signals.connect(fetch_started, signal=signals.request_reached_downloader)
+        crawler.signals.connect(item_scraped, signal=signals.item_scraped)
+        crawler.signals.connect(item_error, signal=signals.item_error)
+        crawler.signals.connect(spider_error, signal=signals.spider_error)
+        process.crawl(crawler, domain=domain).addErrback(crawl_failed)
+    process.start()
+    worker.s3_uploader.join()
+
+    result = usage.summary(worker.results_queue.stats['messages'])
+    result['errors'] = errors
+    result.update(latency.summary())
+    result['sqs'] = worker.results_queue.stats
+    result['s3'] = aws_stubs.s3_client.stats
+    report(result)
+
+
+if __name__ == '__main__':
+    main()
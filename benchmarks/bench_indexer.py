@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""
+Crawl synthetic sites with indexer-node Crawler/MySpider, S3 and SQS
+replaced by aws_stubs. Started by run.py, prints the result as JSON.
+"""
+from gevent import monkey
+monkey.patch_all()  # NOQA
+
+import argparse
+import os
+import sys
+
+from gevent import pool
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(BASE_DIR, 'indexer-node', 'src'))
+
+import aws_stubs  # NOQA
+aws_stubs.install()
+
+import worker  # NOQA
+from my_envelope import decode_envelope  # NOQA
+from metrics import LatencyRecorder, ResourceUsage, report  # NOQA
+
+
+def count_records(queue):
+    def fetch_object(bucket, key):
+        return aws_stubs.s3_client.get_object(Bucket=bucket, Key=key)['Body'].read()
+
+    records = 0
+    for body in queue.messages:
+        data = decode_envelope(body, fetch_object)
+        records += len(data) if isinstance(data, list) else 1
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('domains', nargs='+')
+    parser.add_argument('--delay', type=float, default=None,
+                        help="seconds between requests to a host, instead of the robots.txt one")
+    args = parser.parse_args()
+
+    latency = LatencyRecorder()
+    usage = ResourceUsage()
+    # the crawler logs and goes on, the benchmark must not
+    errors = {'postprocess': 0, 'crawl': 0}
+
+    request = worker.fetch_engine.request
+
+    def timed_request(url, *a, **kw):
+        latency.start(url)
+        return request(url, *a, **kw)
+
+    worker.fetch_engine.request = timed_request
+
+    class BenchSpider(worker.MySpider):
+        def __init__(self, *a, **kw):
+            super(BenchSpider, self).__init__(*a, **kw)
+            if args.delay is not None and self.urls:
+                self.sleep_seconds = args.delay
+
+        def add_result(self, result, upload=None):
+            # records waiting for their upload come back here when they're released
+            if upload is None:
+                latency.finish(result['identifier'])
+            super(BenchSpider, self).add_result(result, upload=upload)
+
+        def postprocess(self, job):
+            try:
+                return super(BenchSpider, self).postprocess(job)
+            except Exception:
+                errors['postprocess'] += 1
+                raise
+
+    # crawl_domain creates the spider by this name
+    worker.MySpider = BenchSpider
+
+    crawls = pool.Pool(worker.SYS_SETTINGS.MAX_CONCURRENT_DOMAINS)
+    greenlets = [crawls.spawn(worker.crawl_domain, domain) for domain in args.domains]
+    crawls.join()
+    if worker.parse_pool.resolved:
+        worker.parse_pool.shutdown()
+    errors['crawl'] = sum(1 for greenlet in greenlets if not greenlet.value)
+
+    result = usage.summary(count_records(worker.results_queue))
+    result['errors'] = errors
+    result.update(latency.summary())
+    result['fetch'] = worker.fetch_engine.get_stats()
+    result['sqs'] = worker.results_queue.stats
+    result['s3'] = aws_stubs.s3_client.stats
+    report(result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+import json
+import resource
+import sys
+import time
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(int(round(p / 100.0 * (len(values) - 1))), len(values) - 1)
+    return values[index]
+
+
+def round_or_none(value, digits=4):
+    return None if value is None else round(value, digits)
+
+
+class LatencyRecorder(object):
+    """Seconds from the start of a page fetch to its record, by url"""
+
+    def __init__(self):
+        self.started = {}
+        self.latencies = []
+
+    def start(self, url):
+        self.started.setdefault(url, time.time())
+
+    def finish(self, url):
+        started_at = self.started.pop(url, None)
+        if started_at is not None:
+            self.latencies.append(time.time() - started_at)
+
+    def summary(self):
+        return {
+            'latency_p50': round_or_none(percentile(self.latencies, 50)),
+            'latency_p99': round_or_none(percentile(self.latencies, 99)),
+        }
+
+
+class ResourceUsage(object):
+    """CPU time and peak RSS of the process and its (finished) children"""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.cpu_at_start = self.cpu_seconds()
+
+    @staticmethod
+    def cpu_seconds():
+        total = 0.0
+        for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+            usage = resource.getrusage(who)
+            total += usage.ru_utime + usage.ru_stime
+        return total
+
+    def summary(self, pages):
+        seconds = time.time() - self.started_at
+        cpu = self.cpu_seconds() - self.cpu_at_start
+        return {
+            'seconds': round(seconds, 3),
+            'pages': pages,
+            'pages_per_second': round(pages / seconds, 2) if seconds else None,
+            'cpu_seconds': round(cpu, 3),
+            'cpu_ms_per_page': round(cpu * 1000 / pages, 2) if pages else None,
+            # kilobytes on Linux
+            'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'peak_children_rss_kb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+        }
+
+
+def report(result):
+    """Last line of the target's stdout is its result, the runner reads it"""
+    sys.stdout.write('\n' + json.dumps(result) + '\n')
+    sys.stdout.flush()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+"""
+Offline crawl benchmark.
+
+Starts the synthetic site server, crawls `--domains` copies of the site
+(127.0.0.2, 127.0.0.3... on the same port) with the indexer-node and/or
+crawler-node spiders in separate processes, then prints the results and
+appends them to `--output` as JSON lines, one per target run.
+"""
+import argparse
+import datetime
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import synthetic_site
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+TARGETS = {
+    'indexer': os.path.join(BENCH_DIR, 'bench_indexer.py'),
+    'crawler': os.path.join(BENCH_DIR, 'bench_crawler.py'),
+}
+# targets which crawl the whole site, crawler-node stops at its DEPTH_LIMIT
+COMPLETE_CRAWL = ('indexer',)
+# targets which make records of 5xx pages too
+ERROR_PAGES = ('indexer',)
+
+
+def get_parser():
+    parser = synthetic_site.get_parser()
+    parser.description = __doc__.strip().splitlines()[0]
+    parser.add_argument('--target', choices=sorted(TARGETS) + ['all'], default='all')
+    parser.add_argument('--domains', type=int, default=4, help="sites crawled at once")
+    parser.add_argument('--delay', type=float, default=0,
+                        help="seconds between requests to a host, overrides the node settings")
+    parser.add_argument('--timeout', type=int, default=1800, help="seconds per target run")
+    parser.add_argument('--output', default=os.path.join(BENCH_DIR, 'results.jsonl'))
+    parser.add_argument('--env', action='append', default=[],
+                        help="NAME=VALUE setting for the node, may be repeated")
+    return parser
+
+
+def get_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR, stderr=subprocess.DEVNULL
+        ).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def wait_for_port(port, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("Synthetic site didn't start on port {}".format(port))
+
+
+def start_site(args):
+    site_args = [
+        '--port', str(args.port),
+        '--pages', str(args.pages),
+        '--fanout', str(args.fanout),
+        '--external-links', str(args.external_links),
+        '--page-bytes', str(args.page_bytes),
+        '--crawl-delay', str(args.crawl_delay),
+        '--slow-rate', str(args.slow_rate),
+        '--slow-seconds', str(args.slow_seconds),
+        '--error-rate', str(args.error_rate),
+        '--seed', str(args.seed),
+    ]
+    for path in args.disallow:
+        site_args += ['--disallow', path]
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(BENCH_DIR, 'synthetic_site.py')] + site_args
+    )
+    wait_for_port(args.port)
+    return server
+
+
+def run_target(name, args, domains, workdir):
+    env = dict(os.environ)
+    env.update({
+        'PYTHONDONTWRITEBYTECODE': '1',
+        # nothing is shared with other runs or real deployments
+        'REDIS_CONNECTION': '',
+        'VALIDATORS_DB': os.path.join(workdir, 'validators.sqlite'),
+    })
+    env.update(value.split('=', 1) for value in args.env)
+    command = [sys.executable, TARGETS[name]] + domains + ['--delay', str(args.delay)]
+    proc = subprocess.run(
+        command, cwd=workdir, env=env, timeout=args.timeout,
+        stdout=subprocess.PIPE, universal_newlines=True,
+    )
+    lines = [line for line in proc.stdout.splitlines() if line.startswith('{')]
+    if proc.returncode or not lines:
+        raise RuntimeError("{} benchmark failed with code {}".format(name, proc.returncode))
+    return json.loads(lines[-1])
+
+
+def check_result(name, result, args):
+    """Raise RuntimeError if the run failed, even when the target exited fine"""
+    errors = result.get('errors', {})
+    if any(errors.values()):
+        raise RuntimeError("{} benchmark had errors: {}".format(name, errors))
+    if not result['pages']:
+        raise RuntimeError("{} benchmark produced no records".format(name))
+    site = synthetic_site.SyntheticSite(**vars(args))
+    expected = site.expected_pages(error_pages=name in ERROR_PAGES) * args.domains
+    if result['pages'] > expected or name in COMPLETE_CRAWL and result['pages'] != expected:
+        raise RuntimeError("{} benchmark produced {} records, expected {}".format(
+            name, result['pages'], expected))
+    result['expected_pages'] = expected
+
+
+def main():
+    args = get_parser().parse_args()
+    targets = sorted(TARGETS) if args.target == 'all' else [args.target]
+    domains = ['127.0.0.{}:{}'.format(i + 2, args.port) for i in range(args.domains)]
+    site = {
+        name: getattr(args, name)
+        for name in ('pages', 'fanout', 'external_links', 'page_bytes', 'crawl_delay',
+                     'disallow', 'slow_rate', 'slow_seconds', 'error_rate', 'seed')
+    }
+
+    server = start_site(args)
+    results = []
+    try:
+        for name in targets:
+            with tempfile.TemporaryDirectory() as workdir:
+                print("Running {} benchmark...".format(name))
+                result = run_target(name, args, domains, workdir)
+            check_result(name, result, args)
+            result.update({
+                'target': name,
+                'revision': get_revision(),
+                'timestamp': datetime.datetime.utcnow().isoformat(),
+                'domains': args.domains,
+                'delay': args.delay,
+                'env': args.env,
+                'site': site,
+            })
+            results.append(result)
+    finally:
+        server.terminate()
+        server.wait()
+
+    with open(args.output, 'a') as f:
+        for result in results:
+            f.write(json.dumps(result, sort_keys=True) + '\n')
+    for result in results:
+        print(
+            "{target}: {pages} pages in {seconds}s, {pages_per_second} pages/s, "
+            "latency p50 {latency_p50} p99 {latency_p99}, "
+            "{cpu_ms_per_page} ms CPU/page, peak RSS {peak_rss_kb} KB".format(**result)
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+"""
+Synthetic website for crawl benchmarks.
+
+Every host name (127.0.0.2, 127.0.0.3...) gets the same generated site:
+`pages` HTML pages, each linking to `fanout` other pages of the site and
+a few external domains. Page content, slow pages and failing pages are
+derived from the seed and the page number, so runs are repeatable.
+"""
+import argparse
+import random
+import re
+import socketserver
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+PAGE_LINK_RE = re.compile(r'href="/page/(\d+)"')
+WORDS = [
+    'archive', 'record', 'agency', 'policy', 'service', 'digital', 'report', 'budget',
+    'program', 'health', 'transport', 'education', 'grant', 'public', 'review',
+    'minister', 'statement', 'community', 'regional', 'national', 'data', 'system',
+    'research', 'council', 'guideline', 'funding', 'project', 'support', 'access',
+    'customer', 'network', 'safety', 'energy', 'water', 'planning', 'heritage',
+]
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--pages', type=int, default=200, help="pages per site")
+    parser.add_argument('--fanout', type=int, default=5, help="internal links per page")
+    parser.add_argument('--external-links', type=int, default=2, help="external links per page")
+    parser.add_argument('--page-bytes', type=int, default=20000, help="average page size")
+    parser.add_argument('--crawl-delay', type=int, default=0, help="robots.txt Crawl-delay")
+    parser.add_argument('--disallow', action='append', default=[],
+                        help="robots.txt Disallow path, may be repeated")
+    parser.add_argument('--slow-rate', type=float, default=0.0,
+                        help="fraction of pages answered after --slow-seconds")
+    parser.add_argument('--slow-seconds', type=float, default=1.0)
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help="fraction of pages answered with 500")
+    parser.add_argument('--seed', type=int, default=1)
+    return parser
+
+
+class SyntheticSite(object):
+    def __init__(self, pages=200, fanout=5, external_links=2, page_bytes=20000, crawl_delay=0,
+                 disallow=(), slow_rate=0.0, slow_seconds=1.0, error_rate=0.0, seed=1, **kwargs):
+        self.pages = pages
+        self.fanout = fanout
+        self.external_links = external_links
+        self.page_bytes = page_bytes
+        self.crawl_delay = crawl_delay
+        self.disallow = disallow
+        self.slow_rate = slow_rate
+        self.slow_seconds = slow_seconds
+        self.error_rate = error_rate
+        self.seed = seed
+
+    def robots(self):
+        lines = ['User-agent: *']
+        if self.crawl_delay:
+            lines.append('Crawl-delay: {}'.format(self.crawl_delay))
+        for path in self.disallow:
+            lines.append('Disallow: {}'.format(path))
+        return '\n'.join(lines) + '\n'
+
+    def page_number(self, path):
+        if path in ('', '/'):
+            return 0
+        if not path.startswith('/page/'):
+            return None
+        number = path[len('/page/'):]
+        if not number.isdigit() or int(number) >= self.pages:
+            return None
+        return int(number)
+
+    def page(self, number):
+        """Return (status, delay, body) of the page"""
+        rnd = random.Random(self.seed * 1000003 + number)
+        delay = self.slow_seconds if rnd.random() < self.slow_rate else 0
+        if number and rnd.random() < self.error_rate:
+            return 500, delay, b'<html><body>Internal error</body></html>'
+        links = ''.join(
+            '<li><a href="/page/{}">{}</a></li>'.format(rnd.randrange(self.pages), rnd.choice(WORDS))
+            for _ in range(self.fanout)
+        )
+        links += ''.join(
+            '<li><a href="http://site{}.example.gov.au/">external</a></li>'.format(rnd.randrange(1000))
+            for _ in range(self.external_links)
+        )
+        # random words, so pages aren't near duplicates of each other
+        size = int(self.page_bytes * rnd.uniform(0.5, 1.5))
+        paragraphs = []
+        written = 0
+        while written < size:
+            text = ' '.join(rnd.choice(WORDS) + str(rnd.randrange(10000)) for _ in range(60))
+            paragraphs.append('<p>{}</p>'.format(text))
+            written += len(text) + 7
+        body = (
+            '<html><head><title>Page {0}</title>'
+            '<meta name="description" content="Synthetic page {0}"></head>'
+            '<body><h1>Page {0}</h1>{1}<ul>{2}</ul></body></html>'
+        ).format(number, ''.join(paragraphs), links)
+        return 200, delay, body.encode('utf-8')
+
+    def expected_pages(self, error_pages=False):
+        """
+        Pages a complete crawl of one host gets: the home page and every
+        distinct page linked from the pages it gets. Failing pages have no
+        links and are counted only with `error_pages`, disallowed ones
+        aren't fetched. The home page is page 0, so /page/0 is a
+        (duplicate) page of its own.
+        """
+        pages = 1
+        seen = set()
+        queue = [0]
+        while queue:
+            body = self.page(queue.pop())[2].decode('utf-8')
+            for match in PAGE_LINK_RE.finditer(body):
+                number = int(match.group(1))
+                path = '/page/{}'.format(number)
+                if number in seen or any(path.startswith(prefix) for prefix in self.disallow if prefix):
+                    continue
+                seen.add(number)
+                if self.page(number)[0] == 200:
+                    pages += 1
+                    queue.append(number)
+                elif error_pages:
+                    pages += 1
+        return pages
+
+
+class SiteHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    site = None
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        if path == '/robots.txt':
+            return self.reply(200, self.site.robots().encode('utf-8'), 'text/plain')
+        number = self.site.page_number(path)
+        if number is None:
+            return self.reply(404, b'<html><body>Not found</body></html>')
+        status, delay, body = self.site.page(number)
+        if delay:
+            time.sleep(delay)
+        self.reply(status, body)
+
+    def reply(self, status, body, content_type='text/html; charset=utf-8'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def serve(port, **kwargs):
+    handler = type('Handler', (SiteHandler,), {'site': SyntheticSite(**kwargs)})
+    # all interfaces, so every 127.x.x.x address is a separate "domain"
+    server = ThreadingHTTPServer(('', port), handler)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    args = get_parser().parse_args()
+    serve(**vars(args))
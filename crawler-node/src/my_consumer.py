@@ -0,0 +1,142 @@
+from twisted.internet import reactor, task, threads
+
+from my_logging import logger  # NOQA
+from my_metrics import metrics
+
+
+class DomainConsumer(object):
+    """
+    Keep a single Scrapy CrawlerRunner (and reactor) busy with domains
+    from the requests queue.
+
+    Up to `max_domains` spiders run at once, a new one is started as soon
+    as another finishes. Receiving is a blocking boto3 call, so it's done
+    in a reactor thread and never stalls the downloads. After `limit`
+    domains no more are received and the reactor is stopped when the
+    running ones are finished, so the daemon can restart the process.
+
+    A message is deleted only when the crawl of its domain is finished,
+    until then its visibility timeout is extended, so if the node dies the
+    domains it had are received by another one.
+    """
+
+    def __init__(self, runner, spider_cls, requests_queue, max_domains=10, limit=None,
+                 wait_seconds=20, on_stop=None, visibility_timeout=300):
+        self.runner = runner
+        self.spider_cls = spider_cls
+        self.requests_queue = requests_queue
+        self.max_domains = max_domains
+        self.limit = limit
+        self.wait_seconds = wait_seconds
+        self.on_stop = on_stop
+        self.visibility_timeout = visibility_timeout
+        self.retry_seconds = 10
+        # messages of the domains being crawled
+        self.messages = set()
+        self.active = 0
+        self.received = 0
+        self.polling = False
+        self.stopping = False
+
+    def start(self):
+        reactor.callWhenRunning(self.poll)
+        heartbeat = task.LoopingCall(self.keep_visible)
+        heartbeat.start(self.visibility_timeout / 3, now=False)
+        reactor.run()
+
+    def free_slots(self):
+        slots = self.max_domains - self.active
+        if self.limit is not None:
+            slots = min(slots, self.limit - self.received)
+        return min(slots, 10)  # SQS gives up to 10 messages at once
+
+    def poll(self):
+        if self.polling or self.stopping:
+            return
+        if self.limit is not None and self.received >= self.limit:
+            return self.stop_when_idle()
+        slots = self.free_slots()
+        if slots <= 0:
+            # poll() is called again when some domain is finished
+            return
+        self.polling = True
+        d = threads.deferToThread(self.receive, slots)
+        d.addCallback(self.start_domains)
+        d.addErrback(self.receive_failed)
+        d.addBoth(self.poll_done)
+
+    def receive(self, count):
+        return self.requests_queue.receive_messages(
+            MaxNumberOfMessages=count,
+            WaitTimeSeconds=self.wait_seconds,
+            VisibilityTimeout=self.visibility_timeout,
+        )
+
+    def keep_visible(self):
+        """Extend the visibility of the messages being crawled"""
+        if self.messages:
+            threads.deferToThread(self.extend_visibility, list(self.messages))
+
+    def extend_visibility(self, messages):
+        for msg in messages:
+            try:
+                msg.change_visibility(VisibilityTimeout=self.visibility_timeout)
+            except Exception as e:
+                logger.warning("Can't extend visibility of %s: %s", msg.body, e)
+
+    def delete(self, msg):
+        try:
+            msg.delete()
+        except Exception as e:
+            # the domain will be crawled again after the visibility timeout
+            logger.warning("Can't delete request %s: %s", msg.body, e)
+
+    def receive_failed(self, failure):
+        logger.error("Can't receive domains: %s", failure.getErrorMessage())
+        # don't hammer SQS if it's unavailable
+        return self.retry_seconds
+
+    def poll_done(self, delay):
+        self.polling = False
+        reactor.callLater(delay or 0, self.poll)
+
+    def start_domains(self, messages):
+        for msg in messages:
+            domain = msg.body
+            logger.info("Going to crawl %s", domain)
+            self.messages.add(msg)
+            self.received += 1
+            self.active += 1
+            metrics.set('crawls_active', self.active)
+            d = self.runner.crawl(self.spider_cls, domain=domain)
+            d.addErrback(lambda failure, domain=domain: logger.error(
+                "Crawl of %s failed: %s", domain, failure.getErrorMessage()
+            ))
+            d.addBoth(self.domain_done, msg)
+        if not messages:
+            logger.info("No messages to process, waiting...")
+
+    def domain_done(self, _, msg):
+        domain = msg.body
+        # the message is done even if the crawl failed, a broken domain isn't retried forever
+        self.messages.discard(msg)
+        threads.deferToThread(self.delete, msg)
+        self.active -= 1
+        metrics.set('crawls_active', self.active)
+        metrics.inc('domains_total')
+        logger.info("Domain %s fetch finished, %s domains in flight", domain, self.active)
+        if self.limit is not None and self.received >= self.limit:
+            self.stop_when_idle()
+        else:
+            self.poll()
+
+    def stop_when_idle(self):
+        if self.active or self.stopping:
+            return
+        self.stopping = True
+        logger.info("%s domains crawled, stopping", self.received)
+        d = threads.deferToThread(self.on_stop) if self.on_stop else None
+        if d is None:
+            reactor.stop()
+        else:
+            d.addBoth(lambda _: reactor.stop())
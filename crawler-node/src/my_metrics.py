@@ -0,0 +1,236 @@
+"""
+Counters, gauges and latency histograms of the node, the same file is used
+by indexer-node, manager-node and crawler-node.
+
+Metrics are disabled until `metrics.enable()` is called, then they are
+served on http://<host>:<port>/metrics in Prometheus text format and
+summarized in the log every `log_seconds`. When disabled every call is a
+no-op and `metrics.timer()` returns a shared do-nothing context manager.
+
+    from my_metrics import metrics
+    metrics.inc('pages_total', status='200')
+    with metrics.timer('fetch_seconds'):
+        ...
+"""
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class NullTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_TIMER = NullTimer()
+
+
+class Timer(object):
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started_at = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.time() - self.started_at, **self.labels)
+        return False
+
+
+class Histogram(object):
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+
+def format_label(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, format_label(value)) for name, value in pairs) + '}'
+
+
+class Metrics(object):
+    def __init__(self, namespace='disco'):
+        self.namespace = namespace
+        self.enabled = False
+        self.lock = threading.Lock()
+        # (name, sorted label pairs): value
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.last_summary = {}
+
+    def enable(self, port=None, log_seconds=None):
+        self.enabled = True
+        if port:
+            self.serve(port)
+        if log_seconds:
+            thread = threading.Thread(target=self._log_summaries, args=(log_seconds,))
+            thread.daemon = True
+            thread.start()
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        if not self.enabled:
+            return
+        self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def add(self, name, value, **labels):
+        """Change the gauge by `value`, e.g. +1/-1 for things in progress"""
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.gauges[key] = self.gauges.get(key, 0) + value
+
+    def remove(self, name, **labels):
+        """Forget the gauge, e.g. of a host which isn't crawled anymore"""
+        self.gauges.pop((name, tuple(sorted(labels.items()))), None)
+
+    def observe(self, name, value, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def timer(self, name, **labels):
+        """Context manager observing its duration in seconds"""
+        if not self.enabled:
+            return NULL_TIMER
+        return Timer(self, name, labels)
+
+    def render(self):
+        """Prometheus text exposition format"""
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+            histograms = sorted(
+                (key, list(h.counts), h.count, h.sum, h.buckets)
+                for key, h in self.histograms.items()
+            )
+        typed = set()
+
+        def add_type(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append('# TYPE {} {}'.format(name, kind))
+
+        for (name, labels), value in counters:
+            name = '{}_{}'.format(self.namespace, name)
+            add_type(name, 'counter')
+            lines.append('{}{} {}'.format(name, format_labels(labels), value))
+        for (name, labels), value in gauges:
+            name = '{}_{}'.format(self.namespace, name)
+            add_type(name, 'gauge')
+            lines.append('{}{} {}'.format(name, format_labels(labels), value))
+        for (name, labels), counts, count, total, buckets in histograms:
+            name = '{}_{}'.format(self.namespace, name)
+            add_type(name, 'histogram')
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, counts):
+                cumulative += bucket_count
+                lines.append('{}_bucket{} {}'.format(
+                    name, format_labels(labels, [('le', bound)]), cumulative
+                ))
+            lines.append('{}_bucket{} {}'.format(name, format_labels(labels, [('le', '+Inf')]), count))
+            lines.append('{}_sum{} {}'.format(name, format_labels(labels), total))
+            lines.append('{}_count{} {}'.format(name, format_labels(labels), count))
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """
+        Short dict for the log: counters and number/mean milliseconds of
+        observations since the previous summary, current gauges
+        """
+        result = {}
+        with self.lock:
+            for (name, labels), value in self.counters.items():
+                key = name + format_labels(labels)
+                result[key] = value - self.last_summary.get(key, 0)
+                self.last_summary[key] = value
+            for (name, labels), value in self.gauges.items():
+                result[name + format_labels(labels)] = value
+            for (name, labels), histogram in self.histograms.items():
+                key = name + format_labels(labels)
+                count, total = self.last_summary.get(key, (0, 0.0))
+                self.last_summary[key] = (histogram.count, histogram.sum)
+                count = histogram.count - count
+                if count:
+                    result[key] = '{}x{:.1f}ms'.format(count, (histogram.sum - total) * 1000 / count)
+        return result
+
+    def _log_summaries(self, interval):
+        while True:
+            time.sleep(interval)
+            logger.info("Metrics: %s", ', '.join(
+                '{}={}'.format(key, value) for key, value in sorted(self.summary().items())
+            ))
+
+    def serve(self, port, host=''):
+        handler = type('MetricsHandler', (MetricsHandler,), {'metrics': self})
+        server = HTTPServer((host, port), handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        logger.info("Metrics are served on port %s", port)
+        return server
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    metrics = None
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+metrics = Metrics()
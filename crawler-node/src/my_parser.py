@@ -17,18 +17,24 @@ class WebsiteParser(object):
      * parsed dict with information to send to SQS
     """
 
-    def __init__(self, response, allowed_domains=[]):
+    def __init__(self, response, allowed_domains=[], links=None):
         self.response = response
         self.allowed_domains = allowed_domains
-        self.my_le = LinkExtractor(allow=('', ))
+        # links already extracted by the spider, if it did it
+        self.links = links
+        self.multihash = None
 
     def get_body(self):
         return self.response.body
 
     def get_content_multihash(self):
-        return base58.b58encode(
-            bytes(multihash.encode(self.response.body, multihash.SHA1))
-        )
+        if self.multihash is None:
+            encoded = base58.b58encode(
+                bytes(multihash.encode(self.response.body, multihash.SHA1))
+            )
+            # base58>=1.0 returns bytes, but it goes to JSON and S3 keys
+            self.multihash = encoded.decode('ascii') if isinstance(encoded, bytes) else encoded
+        return self.multihash
 
     def get_s3_filename(self):
         # return hashlib.sha256(self.response.url.encode('utf-8')).hexdigest()
@@ -97,17 +103,21 @@ class WebsiteParser(object):
     def _get_language(self):
         return 'en-us'
 
+    def _extract_links(self):
+        if self.links is None:
+            self.links = [
+                link.url for link in LinkExtractor(allow=('', )).extract_links(self.response)
+            ]
+        return self.links
+
     def _get_external_domains(self):
         # get the list of external domain names linked from this page
         external_domains = set()
-        for link in self.my_le.extract_links(self.response):
-            parsed_link = urlparse(link.url)
+        for url in self._extract_links():
+            parsed_link = urlparse(url)
             if parsed_link.netloc not in self.allowed_domains:
                 external_domains.add(parsed_link.netloc)
         return sorted(list(external_domains))
 
     def _get_links(self):
-        links = set()
-        for link in self.my_le.extract_links(self.response):
-            links.add(link.url)
-        return sorted(list(links))
+        return sorted(set(self._extract_links()))
@@ -0,0 +1,153 @@
+import json
+import pprint
+import threading
+
+from twisted.internet import threads
+from twisted.python.threadpool import ThreadPool
+
+from my_logging import logger  # NOQA
+from my_metrics import metrics
+from my_parser import WebsiteParser
+
+# SQS limits: 256 KiB per batch request, 10 messages per batch
+SQS_MAX_BYTES = 256 * 1024
+SQS_BATCH_SIZE = 10
+
+# shared by the pipelines of all spiders of the process
+_threadpool = None
+
+
+def get_threadpool(size):
+    """Thread pool of the pipelines, started on the first use and stopped with the reactor"""
+    global _threadpool
+    if _threadpool is None:
+        from twisted.internet import reactor
+        _threadpool = ThreadPool(minthreads=0, maxthreads=size, name='pipeline')
+        _threadpool.start()
+        reactor.addSystemEventTrigger('during', 'shutdown', _threadpool.stop)
+    return _threadpool
+
+
+class ResultsPipeline(object):
+    """
+    Save pages and send their results without blocking the reactor.
+
+    The spider only passes the response and its links here. Goose
+    extraction, S3 upload and building the result run in a thread pool of
+    `threads` threads (not the reactor one, DNS resolution needs it), and
+    results are sent with SendMessageBatch, up to `batch_size` messages
+    at once.
+    Scrapy waits for the returned deferred, so a slow pipeline slows the
+    downloads of the spider instead of buffering responses without limit.
+    """
+
+    def __init__(self, batch_size=SQS_BATCH_SIZE, threads=10):
+        self.batch_size = min(batch_size, SQS_BATCH_SIZE)
+        self.threads = threads
+        # guards the pending batch and the stats, both are used by the pool threads
+        self.lock = threading.Lock()
+        self.pending = []
+        self.pending_size = 0
+        self.stats = {'items': 0, 'messages': 0, 'requests': 0, 'failed': 0}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(
+            batch_size=crawler.settings.getint('RESULTS_BATCH_SIZE', SQS_BATCH_SIZE),
+            threads=crawler.settings.getint('PIPELINE_THREADS', 10),
+        )
+
+    def _count(self, name, value=1):
+        with self.lock:
+            self.stats[name] += value
+
+    def defer_to_thread(self, func, *args):
+        from twisted.internet import reactor
+        return threads.deferToThreadPool(reactor, get_threadpool(self.threads), func, *args)
+
+    def process_item(self, item, spider):
+        d = self.defer_to_thread(self._process, item, spider)
+        d.addErrback(lambda failure: logger.error(
+            "Can't process %s: %s", item['response'].url, failure.getTraceback()
+        ))
+        # the response isn't needed anymore, don't keep it in the item
+        d.addBoth(lambda _: {'url': item['response'].url})
+        return d
+
+    def _process(self, item, spider):
+        parser = WebsiteParser(
+            item['response'],
+            allowed_domains=spider.allowed_domains,
+            links=item['links'],
+        )
+        # save response.body to S3 (blocks only if too many uploads are queued)
+        with metrics.timer('s3_queue_seconds'):
+            upload = spider.s3_uploader.upload(parser.get_s3_filename(), parser.get_body())
+
+        with metrics.timer('parse_seconds'):
+            result = parser.get_result()
+        if upload is not None and not upload.result():
+            # the record would point to a missing S3 object
+            metrics.inc('records_dropped_total', reason='upload')
+            logger.error("Body of %s isn't uploaded, the record is dropped", item['response'].url)
+            return
+        self._count('items')
+        metrics.inc('records_total')
+        if spider.results_queue is None:
+            # for demo run just print it
+            pprint.pprint(result)
+            return
+        body = json.dumps(result)
+        size = len(body.encode('utf-8'))
+        batch = None
+        with self.lock:
+            if self.pending and self.pending_size + size > SQS_MAX_BYTES:
+                batch = self._take_pending()
+            self.pending.append(body)
+            self.pending_size += size
+            if batch is None and len(self.pending) >= self.batch_size:
+                batch = self._take_pending()
+        if batch:
+            self._send(spider.results_queue, batch)
+
+    def _take_pending(self):
+        batch = self.pending
+        self.pending = []
+        self.pending_size = 0
+        return batch
+
+    def _send(self, queue, batch):
+        entries = [
+            {'Id': str(i), 'MessageBody': body}
+            for i, body in enumerate(batch)
+        ]
+        self._count('requests')
+        try:
+            with metrics.timer('sqs_send_seconds', queue='results'):
+                resp = queue.send_messages(Entries=entries)
+        except Exception as e:
+            logger.exception(e)
+            failed = entries
+        else:
+            failed = [entries[int(x['Id'])] for x in resp.get('Failed', [])]
+        self._count('messages', len(entries) - len(failed))
+        metrics.inc('result_messages_total', len(entries) - len(failed))
+        for entry in failed:
+            # one more chance for each of them
+            try:
+                queue.send_message(MessageBody=entry['MessageBody'])
+                self._count('messages')
+            except Exception as e:
+                self._count('failed')
+                metrics.inc('result_messages_failed_total')
+                logger.exception(e)
+
+    def close_spider(self, spider):
+        with self.lock:
+            batch = self._take_pending()
+        if not batch or spider.results_queue is None:
+            logger.info("Results of %s: %s", spider.allowed_domains, self.stats)
+            return None
+        d = self.defer_to_thread(self._send, spider.results_queue, batch)
+        d.addBoth(lambda _: logger.info("Results of %s: %s", spider.allowed_domains, self.stats))
+        return d
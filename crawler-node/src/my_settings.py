@@ -20,6 +20,23 @@ SYS_SETTINGS = AttrDict({
     ),
     'AWS_REGION': os.environ.get('AWS_REGION', 'ap-southeast-2'),
     'DOMAINS_PER_ITERATION': int(os.environ.get('DOMAINS_PER_ITERATION') or 10),
+    # keep one reactor and start domains as others finish ('0' - process per batch)
+    'PERSISTENT_CONSUMER': os.environ.get('PERSISTENT_CONSUMER', '1') == '1',
+    # the process exits after that many domains to release the memory (0 - never)
+    'DOMAINS_BEFORE_RESTART': int(os.environ.get('DOMAINS_BEFORE_RESTART') or 500),
+    # domain requests are hidden from other nodes that long, and extended while crawled
+    'DOMAINS_VISIBILITY_TIMEOUT': int(os.environ.get('DOMAINS_VISIBILITY_TIMEOUT') or 300),
+
+    # optional, used to share the S3 key cache between nodes
+    'REDIS_CONNECTION': os.environ.get('REDIS_CONNECTION', ''),
+    'S3_UPLOAD_CONCURRENCY': int(os.environ.get('S3_UPLOAD_CONCURRENCY') or 10),
+    'S3_KEY_CACHE_SIZE': int(os.environ.get('S3_KEY_CACHE_SIZE') or 100000),
+
+    # Prometheus metrics on http://<host>:METRICS_PORT/metrics and in the log
+    # every METRICS_LOG_SECONDS (0 - don't log), nothing is collected if disabled
+    'METRICS_ENABLED': os.environ.get('METRICS_ENABLED', '0') == '1',
+    'METRICS_PORT': int(os.environ.get('METRICS_PORT') or 9100),
+    'METRICS_LOG_SECONDS': int(os.environ.get('METRICS_LOG_SECONDS') or 60),
 })
 
 
@@ -34,4 +51,9 @@ SCRAPY_SETTINGS = {
     'REDIRECT_MAX_TIMES': 5,
     'ROBOTSTXT_OBEY': True,
     'TELNETCONSOLE_ENABLED': False,
+    # parsing, S3 uploads and SQS sends are done in the pipeline's own thread pool,
+    # the reactor one is left to DNS resolution and the requests queue polling
+    'ITEM_PIPELINES': {'my_pipeline.ResultsPipeline': 300},
+    'PIPELINE_THREADS': int(os.environ.get('PIPELINE_THREADS') or 10),
+    'RESULTS_BATCH_SIZE': int(os.environ.get('RESULTS_BATCH_SIZE') or 10),
 }
@@ -0,0 +1,158 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from botocore.exceptions import ClientError
+
+from my_logging import logger  # NOQA
+from my_metrics import metrics
+
+
+class KeyCache(object):
+    """
+    Keys known to exist in the bucket.
+    Local LRU, optionally backed by Redis so all nodes share it.
+    """
+
+    def __init__(self, size=100000, redis_db=None, redis_prefix='s3:'):
+        self.size = size
+        self.redis_db = redis_db
+        self.redis_prefix = redis_prefix
+        self.local = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _remember(self, key):
+        with self.lock:
+            self.local[key] = True
+            self.local.move_to_end(key)
+            while len(self.local) > self.size:
+                self.local.popitem(last=False)
+
+    def is_known_locally(self, key):
+        return key in self.local
+
+    def __contains__(self, key):
+        if key in self.local:
+            return True
+        if self.redis_db is not None:
+            try:
+                if self.redis_db.exists(self.redis_prefix + key):
+                    self._remember(key)
+                    return True
+            except Exception as e:
+                logger.warning("Redis key cache is unavailable: %s", e)
+        return False
+
+    def add(self, key):
+        self._remember(key)
+        if self.redis_db is not None:
+            try:
+                self.redis_db.set(self.redis_prefix + key, 1)
+            except Exception as e:
+                logger.warning("Redis key cache is unavailable: %s", e)
+
+
+class S3Uploader(object):
+    """
+    Upload content-addressed objects on a bounded thread pool.
+
+    Keys are content hashes, so an existing key never has to be uploaded
+    again: it's skipped if it's in the key cache or HEAD finds it in the
+    bucket, and the same key requested twice in a run is uploaded once.
+    `upload` blocks when `max_pending` uploads are queued, which slows
+    down the caller (and the crawl behind it) until uploads catch up.  It
+    returns the future of the upload (None if the key is known to exist),
+    its result is False if the object isn't uploaded after `retries`
+    attempts.
+    """
+
+    def __init__(self, s3_client, bucket, concurrency=10, max_pending=100, key_cache=None,
+                 retries=3):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.retries = retries
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.key_cache = key_cache if key_cache is not None else KeyCache()
+        self.inflight = {}
+        self.futures = set()
+        self.lock = threading.Lock()
+        self.stats = {
+            'uploaded': 0,
+            'exists': 0,
+            'coalesced': 0,
+            'failed': 0,
+        }
+
+    def _count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+        metrics.inc('s3_objects_total', result=name)
+
+    def upload(self, key, body):
+        if isinstance(key, bytes):
+            key = key.decode('ascii')
+        self.slots.acquire()
+        with self.lock:
+            if key in self.inflight or self.key_cache.is_known_locally(key):
+                self.stats['coalesced'] += 1
+                metrics.inc('s3_objects_total', result='coalesced')
+                self.slots.release()
+                return self.inflight.get(key)
+            future = self.inflight[key] = self.executor.submit(self._upload, key, body)
+            self.futures.add(future)
+        future.add_done_callback(self._forget)
+        return future
+
+    def _forget(self, future):
+        with self.lock:
+            self.futures.discard(future)
+
+    def _upload(self, key, body):
+        try:
+            for attempt in range(1, self.retries + 1):
+                try:
+                    if key in self.key_cache or self._exists(key):
+                        self._count('exists')
+                    else:
+                        with metrics.timer('s3_seconds', op='put'):
+                            self.s3_client.put_object(
+                                ACL='private',  # 'public-read'
+                                Body=body,
+                                Bucket=self.bucket,
+                                ContentLength=len(body),
+                                Key=key,
+                            )
+                        self._count('uploaded')
+                except Exception as e:
+                    logger.warning("Upload of %s failed (attempt %s): %s", key, attempt, e)
+                    if attempt < self.retries:
+                        time.sleep(2 ** attempt)
+                    continue
+                self.key_cache.add(key)
+                return True
+            self._count('failed')
+            logger.error("Upload of %s failed", key)
+            return False
+        finally:
+            with self.lock:
+                self.inflight.pop(key, None)
+            self.slots.release()
+
+    def _exists(self, key):
+        try:
+            with metrics.timer('s3_seconds', op='head'):
+                self.s3_client.head_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+        return True
+
+    def join(self):
+        """Wait for all pending uploads"""
+        with self.lock:
+            futures = list(self.futures)
+        wait(futures)
+        logger.info("S3 uploads: %s", self.stats)
@@ -1,51 +1,77 @@
 #!/usr/bin/env python
-import json
 import time  # NOQA
 import pprint  # NOQA
 import sys
 
+from my_lazy import Lazy, startup_report, track_imports, warm_up
+if '--startup-time' in sys.argv:
+    track_imports()
+
 import boto3
-import scrapy
-from scrapy.crawler import CrawlerProcess
+import redis
+from scrapy.crawler import CrawlerProcess, CrawlerRunner
 from scrapy.spiders import CrawlSpider, Rule
 from scrapy.linkextractors import LinkExtractor
+from scrapy.utils.log import configure_logging
 
+from my_consumer import DomainConsumer
 from my_logging import logger  # NOQA
+from my_metrics import metrics
 from my_settings import SCRAPY_SETTINGS, SYS_SETTINGS
-from my_parser import WebsiteParser
-
-
-s3_client = boto3.client('s3', region_name=SYS_SETTINGS.AWS_REGION)
-sqs_resource = boto3.resource('sqs', region_name=SYS_SETTINGS.AWS_REGION)
-
-
-def save_s3_file(filename, body):
-    # use SYS_SETTINGS to get the bucket and the prefix
-    s3_client.put_object(
-        ACL='private',  # 'public-read'
-        Body=body,
-        Bucket=SYS_SETTINGS.STORAGE_BUCKET,
-        ContentEncoding='utf-8',
-        ContentLength=len(body),
-        # ContentMD5='string',
-        # ContentType='text/html',
-        Key=filename,
-        # Metadata={
-        #     'string': 'string'
-        # },
-        # StorageClass='STANDARD'|'REDUCED_REDUNDANCY'|'STANDARD_IA',
+from my_storage import KeyCache, S3Uploader
+
+
+def get_queue(arn):
+    return sqs_resource.get_queue_by_name(
+        QueueName=arn.split(':')[-1],
+        QueueOwnerAWSAccountId=arn.split(':')[-2]
     )
 
 
+# created when they are used first time
+s3_client = Lazy('s3_client', lambda: boto3.client('s3', region_name=SYS_SETTINGS.AWS_REGION))
+sqs_resource = Lazy('sqs_resource', lambda: boto3.resource('sqs', region_name=SYS_SETTINGS.AWS_REGION))
+requests_queue = Lazy('requests_queue', lambda: get_queue(SYS_SETTINGS.QUEUE_REQUESTS))
+results_queue = Lazy('results_queue', lambda: get_queue(SYS_SETTINGS.QUEUE_RESULTS))
+
+
+def get_redis_db():
+    if not SYS_SETTINGS.REDIS_CONNECTION:
+        return None
+    return redis.StrictRedis.from_url(SYS_SETTINGS.REDIS_CONNECTION)
+
+
+s3_uploader = S3Uploader(
+    s3_client,
+    SYS_SETTINGS.STORAGE_BUCKET,
+    concurrency=SYS_SETTINGS.S3_UPLOAD_CONCURRENCY,
+    key_cache=KeyCache(size=SYS_SETTINGS.S3_KEY_CACHE_SIZE, redis_db=get_redis_db()),
+)
+
+
+class PageLinkExtractor(LinkExtractor):
+    """Links of a response are extracted once, for parse_item and for the Rule"""
+
+    def extract_links(self, response):
+        if 'page_links' not in response.meta:
+            response.meta['page_links'] = super().extract_links(response)
+        return response.meta['page_links']
+
+
 class GenericWebsiteSpider(CrawlSpider):
     name = 'myspider'
     start_urls = []  # 'http://ausdigital.org'
     allowed_domains = []  # "ausdigital.org"
+    link_extractor = PageLinkExtractor(allow=('', ))
 
     rules = (
-        Rule(LinkExtractor(allow=('', )), callback='parse_item'),
+        Rule(link_extractor, callback='parse_item'),
     )
 
+    # used by ResultsPipeline, results are printed if there is no queue
+    s3_uploader = s3_uploader
+    results_queue = None
+
     def __init__(self, *args, **kwargs):
         domain = kwargs.pop('domain')
         self.start_urls = ['http://{}'.format(domain)]
@@ -53,44 +79,25 @@ class GenericWebsiteSpider(CrawlSpider):
         super().__init__(*args, **kwargs)
 
     def parse_item(self, response):
-        item = scrapy.Item()
+        # parsing, S3 and SQS are done by ResultsPipeline off the reactor thread;
+        # the Rule follows the same links, they aren't extracted again
         try:
-            parser = WebsiteParser(
-                response,
-                allowed_domains=self.allowed_domains
-            )
-
-            # save response.body to S3
-            save_s3_file(
-                parser.get_s3_filename(),
-                parser.get_body()
-            )
-
-            # send SQS message about S3 saved object with the list of external links
-            if MODE == 'sqs':
-                results_queue.send_message(
-                    MessageBody=json.dumps(parser.get_result())
-                )
-            else:
-                # for demo run just print it
-                pprint.pprint(parser.get_result())
+            links = [link.url for link in self.link_extractor.extract_links(response)]
         except Exception as e:
             logger.exception(e)
-        return item
-
-
-requests_queue = sqs_resource.get_queue_by_name(
-    QueueName=SYS_SETTINGS.QUEUE_REQUESTS.split(':')[-1],
-    QueueOwnerAWSAccountId=SYS_SETTINGS.QUEUE_REQUESTS.split(':')[-2]
-)
-results_queue = sqs_resource.get_queue_by_name(
-    QueueName=SYS_SETTINGS.QUEUE_RESULTS.split(':')[-1],
-    QueueOwnerAWSAccountId=SYS_SETTINGS.QUEUE_RESULTS.split(':')[-2]
-)
+            return None
+        return {'response': response, 'links': links}
 
 
 if __name__ == '__main__':
     MODE = None
+    if '--startup-time' in sys.argv:
+        # import and initialization cost of every component, then exit
+        warm_up(s3_client, sqs_resource, requests_queue, results_queue)
+        print(startup_report())
+        sys.exit(0)
+    if SYS_SETTINGS.METRICS_ENABLED:
+        metrics.enable(port=SYS_SETTINGS.METRICS_PORT, log_seconds=SYS_SETTINGS.METRICS_LOG_SECONDS)
     if len(sys.argv) == 2:
         MODE = 'domain'
         logger.info("Fetching domain by name...")
@@ -98,9 +105,28 @@ if __name__ == '__main__':
         process = CrawlerProcess(SCRAPY_SETTINGS)
         process.crawl(GenericWebsiteSpider, domain=domain_name)
         process.start()  # the script will block here until the crawling is finished
+        s3_uploader.join()
         logger.info("Domain %s fetch finished", domain_name)
     else:
         MODE = 'sqs'
+        GenericWebsiteSpider.results_queue = results_queue
+
+        if SYS_SETTINGS.PERSISTENT_CONSUMER:
+            # single reactor for the life of the process, domains are started as
+            # soon as there is room for them instead of waiting for the whole batch
+            configure_logging(SCRAPY_SETTINGS, install_root_handler=False)
+            consumer = DomainConsumer(
+                CrawlerRunner(SCRAPY_SETTINGS),
+                GenericWebsiteSpider,
+                requests_queue,
+                max_domains=SYS_SETTINGS.DOMAINS_PER_ITERATION,
+                limit=SYS_SETTINGS.DOMAINS_BEFORE_RESTART or None,
+                on_stop=s3_uploader.join,
+                visibility_timeout=SYS_SETTINGS.DOMAINS_VISIBILITY_TIMEOUT,
+            )
+            consumer.start()  # blocks until DOMAINS_BEFORE_RESTART domains are crawled
+            logger.info("Consumer finished, %s domains crawled", consumer.received)
+            exit(0)
 
         while True:
             # standard working cycle
@@ -120,8 +146,9 @@ if __name__ == '__main__':
                 # any work exists
                 process = CrawlerProcess(SCRAPY_SETTINGS)
                 for domain in domains_to_process:
-                    process.crawl(GenericWebsiteSpider, domain=domain_name)
+                    process.crawl(GenericWebsiteSpider, domain=domain)
                 process.start()  # the script will block here until the crawling is finished
+                s3_uploader.join()
                 logger.info("Standard cycle finished, going to run another")
                 exit(0)  # if we don't kill process we waste some memory and have Reactor exception
                 # another solution is https://doc.scrapy.org/en/latest/topics/practices.html#running-multiple-spiders-in-the-same-process  # NOQA
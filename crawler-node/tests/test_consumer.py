@@ -0,0 +1,139 @@
+import pytest
+from twisted.internet import defer
+
+import my_consumer
+from my_consumer import DomainConsumer
+
+
+class FakeReactor(object):
+    def __init__(self):
+        self.calls = []
+        self.stopped = False
+
+    def callLater(self, delay, func, *args):
+        self.calls.append(delay)
+
+    def stop(self):
+        self.stopped = True
+
+
+class Message(object):
+    def __init__(self, body, fail=False):
+        self.body = body
+        self.fail = fail
+        self.deleted = False
+        self.extended = 0
+
+    def delete(self):
+        if self.fail:
+            raise IOError('SQS is down')
+        self.deleted = True
+
+    def change_visibility(self, VisibilityTimeout):
+        if self.fail:
+            raise IOError('SQS is down')
+        self.extended += 1
+
+
+class Queue(object):
+    def __init__(self, batches):
+        self.batches = batches
+        self.requests = []
+
+    def receive_messages(self, **kwargs):
+        self.requests.append(kwargs)
+        batch = self.batches.pop(0)
+        if isinstance(batch, Exception):
+            raise batch
+        return batch
+
+
+class Runner(object):
+    """Crawls are finished by the test"""
+
+    def __init__(self):
+        self.crawls = {}
+
+    def crawl(self, spider_cls, domain):
+        d = self.crawls[domain] = defer.Deferred()
+        return d
+
+
+@pytest.fixture
+def reactor(monkeypatch):
+    reactor = FakeReactor()
+    monkeypatch.setattr(my_consumer, 'reactor', reactor)
+    # blocking calls run right away instead of a reactor thread
+    monkeypatch.setattr(my_consumer.threads, 'deferToThread', defer.maybeDeferred)
+    return reactor
+
+
+def make_consumer(batches, **kwargs):
+    return DomainConsumer(Runner(), object, Queue(batches), wait_seconds=0, **kwargs)
+
+
+def test_messages_are_deleted_after_the_crawl(reactor):
+    messages = [Message('a.gov.au'), Message('b.gov.au')]
+    consumer = make_consumer([messages], visibility_timeout=60)
+    consumer.poll()
+    assert consumer.requests_queue.requests == [
+        {'MaxNumberOfMessages': 10, 'WaitTimeSeconds': 0, 'VisibilityTimeout': 60},
+    ]
+    assert sorted(consumer.runner.crawls) == ['a.gov.au', 'b.gov.au']
+    assert consumer.active == 2
+    assert not any(msg.deleted for msg in messages)
+
+    consumer.keep_visible()
+    assert [msg.extended for msg in messages] == [1, 1]
+
+    consumer.requests_queue.batches = [[], []]
+    consumer.runner.crawls['a.gov.au'].callback(None)
+    # a failed crawl isn't retried either
+    consumer.runner.crawls['b.gov.au'].errback(ValueError('broken'))
+    assert [msg.deleted for msg in messages] == [True, True]
+    assert consumer.messages == set()
+    assert consumer.active == 0
+    consumer.keep_visible()
+    assert [msg.extended for msg in messages] == [1, 1]
+
+
+def test_sqs_errors_dont_stop_the_consumer(reactor):
+    msg = Message('a.gov.au', fail=True)
+    consumer = make_consumer([IOError('throttled'), [msg]])
+    consumer.poll()
+    # retried later
+    assert reactor.calls == [consumer.retry_seconds]
+    assert not consumer.polling
+    consumer.poll()
+    consumer.keep_visible()
+    consumer.requests_queue.batches = [[]]
+    consumer.runner.crawls['a.gov.au'].callback(None)
+    assert consumer.active == 0 and consumer.messages == set()
+
+
+def test_free_slots(reactor):
+    consumer = make_consumer([], max_domains=3, limit=5)
+    assert consumer.free_slots() == 3
+    consumer.active = 2
+    assert consumer.free_slots() == 1
+    consumer.active, consumer.received = 0, 4
+    assert consumer.free_slots() == 1
+    consumer = make_consumer([], max_domains=50)
+    assert consumer.free_slots() == 10
+
+
+def test_stops_after_the_limit(reactor):
+    stopped = []
+    messages = [Message('a.gov.au'), Message('b.gov.au')]
+    consumer = make_consumer([messages], limit=2, on_stop=lambda: stopped.append(True))
+    consumer.poll()
+    assert consumer.requests_queue.requests[0]['MaxNumberOfMessages'] == 2
+    consumer.runner.crawls['a.gov.au'].callback(None)
+    # one is still crawled
+    assert not reactor.stopped
+    consumer.runner.crawls['b.gov.au'].callback(None)
+    assert stopped == [True]
+    assert reactor.stopped
+    assert all(msg.deleted for msg in messages)
+    # nothing is received after the limit
+    assert len(consumer.requests_queue.requests) == 1
@@ -0,0 +1,172 @@
+import json
+import threading
+from concurrent.futures import Future
+
+import pytest
+from twisted.internet import defer
+
+import my_pipeline
+from my_pipeline import SQS_MAX_BYTES, ResultsPipeline
+
+
+class Response(object):
+    def __init__(self, url):
+        self.url = url
+        self.body = b'<html></html>'
+
+
+class Parser(object):
+    """Stands for WebsiteParser, the result is the url padded to `size`"""
+    size = 100
+
+    def __init__(self, response, allowed_domains=None, links=None):
+        self.response = response
+
+    def get_s3_filename(self):
+        return self.response.url
+
+    def get_body(self):
+        return self.response.body
+
+    def get_result(self):
+        return {'identifier': self.response.url, 'text': 'x' * self.size}
+
+
+class Uploader(object):
+    def __init__(self, failed=()):
+        self.failed = failed
+
+    def upload(self, key, body):
+        future = Future()
+        future.set_result(key not in self.failed)
+        return future
+
+
+class Queue(object):
+    def __init__(self, fail_batches=False, failed_ids=(), fail_single=False):
+        self.fail_batches = fail_batches
+        self.failed_ids = failed_ids
+        self.fail_single = fail_single
+        self.lock = threading.Lock()
+        self.requests = []
+        self.messages = []
+
+    def send_messages(self, Entries):
+        with self.lock:
+            self.requests.append(Entries)
+        if self.fail_batches:
+            raise IOError('SQS is down')
+        sent = [entry for entry in Entries if entry['Id'] not in self.failed_ids]
+        with self.lock:
+            self.messages.extend(entry['MessageBody'] for entry in sent)
+        return {'Failed': [{'Id': entry['Id']} for entry in Entries if entry not in sent]}
+
+    def send_message(self, MessageBody):
+        if self.fail_single:
+            raise IOError('SQS is down')
+        with self.lock:
+            self.messages.append(MessageBody)
+
+    @property
+    def urls(self):
+        return [json.loads(body)['identifier'] for body in self.messages]
+
+
+class Spider(object):
+    allowed_domains = ['example.gov.au']
+
+    def __init__(self, queue, uploader=None):
+        self.results_queue = queue
+        self.s3_uploader = uploader or Uploader()
+
+
+@pytest.fixture(autouse=True)
+def parser(monkeypatch):
+    monkeypatch.setattr(my_pipeline, 'WebsiteParser', Parser)
+    monkeypatch.setattr(Parser, 'size', 100)
+    return Parser
+
+
+def make_pipeline(**kwargs):
+    pipeline = ResultsPipeline(**kwargs)
+    # runs right away instead of the thread pool
+    pipeline.defer_to_thread = defer.maybeDeferred
+    return pipeline
+
+
+def process(pipeline, spider, urls):
+    for url in urls:
+        pipeline._process({'response': Response(url), 'links': []}, spider)
+
+
+def get_urls(count):
+    return ['http://example.gov.au/{}'.format(i) for i in range(count)]
+
+
+def test_results_are_sent_in_batches():
+    queue = Queue()
+    spider = Spider(queue)
+    pipeline = make_pipeline(batch_size=4)
+    process(pipeline, spider, get_urls(10))
+    assert [len(entries) for entries in queue.requests] == [4, 4]
+    # the rest is sent when the spider is closed
+    pipeline.close_spider(spider)
+    assert [len(entries) for entries in queue.requests] == [4, 4, 2]
+    assert queue.urls == get_urls(10)
+    assert pipeline.stats == {'items': 10, 'messages': 10, 'requests': 3, 'failed': 0}
+
+
+def test_batches_fit_into_a_request(parser):
+    parser.size = SQS_MAX_BYTES // 3
+    queue = Queue()
+    spider = Spider(queue)
+    pipeline = make_pipeline()
+    process(pipeline, spider, get_urls(5))
+    pipeline.close_spider(spider)
+    assert [len(entries) for entries in queue.requests] == [2, 2, 1]
+    for entries in queue.requests:
+        assert sum(len(entry['MessageBody']) for entry in entries) <= SQS_MAX_BYTES
+
+
+def test_records_of_failed_uploads_are_dropped():
+    queue = Queue()
+    spider = Spider(queue, Uploader(failed=('http://example.gov.au/1',)))
+    pipeline = make_pipeline()
+    process(pipeline, spider, get_urls(3))
+    pipeline.close_spider(spider)
+    assert queue.urls == ['http://example.gov.au/0', 'http://example.gov.au/2']
+
+
+def test_failed_sends_are_retried_one_by_one():
+    queue = Queue(fail_batches=True)
+    spider = Spider(queue)
+    pipeline = make_pipeline(batch_size=3)
+    process(pipeline, spider, get_urls(3))
+    assert queue.urls == get_urls(3)
+    assert pipeline.stats['messages'] == 3
+
+    queue = Queue(failed_ids=('1',), fail_single=True)
+    spider = Spider(queue)
+    pipeline = make_pipeline(batch_size=3)
+    process(pipeline, spider, get_urls(3))
+    assert queue.urls == ['http://example.gov.au/0', 'http://example.gov.au/2']
+    assert pipeline.stats == {'items': 3, 'messages': 2, 'requests': 1, 'failed': 1}
+
+
+def test_stats_of_concurrent_threads():
+    queue = Queue()
+    spider = Spider(queue)
+    pipeline = make_pipeline(batch_size=7)
+    urls = get_urls(4000)
+    threads = [
+        threading.Thread(target=process, args=(pipeline, spider, urls[i::8]))
+        for i in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    pipeline.close_spider(spider)
+    assert sorted(queue.urls) == sorted(urls)
+    assert pipeline.stats['items'] == pipeline.stats['messages'] == 4000
+    assert pipeline.stats['requests'] == len(queue.requests)
@@ -0,0 +1,120 @@
+from lxml import etree, html
+
+# content of these tags isn't used for the description and keywords
+SKIPPED_TAGS = {'script', 'ul', 'table', 'form'}
+# content of these tags is not a text at all
+NON_TEXT_TAGS = {'script', 'style'}
+HEADING_TAGS = {'h1', 'h2', 'h3', 'h4'}
+CAPTURED_TAGS = HEADING_TAGS | {'p'}
+
+
+class PageAnalysis(object):
+    """
+    Everything the indexer needs from the page HTML, collected in a single
+    walk over one lxml tree:
+     * links - href of every <a> tag
+     * base_url - href of the <base> tag, if the page has it
+     * title
+     * paragraphs and headings, ignoring scripts, lists, tables and forms
+     * text - the whole visible text of the page
+    """
+
+    def __init__(self, body):
+        self.links = []
+        self.base_url = None
+        self.title = ''
+        self.paragraphs = []
+        self.headings = []
+        self.text = ''
+        self.main_text = ''
+        try:
+            root = html.document_fromstring(body, parser=html.HTMLParser(
+                encoding=self._guess_encoding(body),
+                remove_comments=True,
+                remove_pis=True,
+            ))
+        except (etree.ParserError, ValueError):
+            # empty or totally broken document
+            return
+        self._walk(root)
+
+    @staticmethod
+    def _guess_encoding(body):
+        try:
+            body.decode('utf-8')
+        except UnicodeDecodeError:
+            # let libxml2 to look for meta charset
+            return None
+        return 'utf-8'
+
+    def _walk(self, root):
+        text = []  # all the visible text
+        main_text = []  # the text outside of skipped tags
+        captures = []  # stack of (element, tag, parts) for open p and headings
+        skipped = 0
+        non_text = 0
+        title = None
+
+        def add_text(value):
+            if not value or non_text:
+                return
+            text.append(value)
+            if not skipped:
+                main_text.append(value)
+                for capture in captures:
+                    capture[2].append(value)
+
+        for event, el in etree.iterwalk(root, events=('start', 'end')):
+            tag = el.tag
+            if event == 'start':
+                if tag == 'a':
+                    href = el.get('href')
+                    if href:
+                        self.links.append(href)
+                elif tag == 'base' and self.base_url is None:
+                    self.base_url = el.get('href')
+                elif tag == 'title' and title is None:
+                    title = el.text_content()
+                if tag in SKIPPED_TAGS:
+                    skipped += 1
+                if tag in NON_TEXT_TAGS:
+                    non_text += 1
+                if tag in CAPTURED_TAGS and not skipped:
+                    captures.append((el, tag, []))
+                add_text(el.text)
+            else:
+                if captures and captures[-1][0] is el:
+                    _, tag, parts = captures.pop()
+                    if tag == 'p':
+                        self.paragraphs.append(''.join(parts))
+                    else:
+                        self.headings.append(''.join(parts))
+                if tag in SKIPPED_TAGS:
+                    skipped -= 1
+                if tag in NON_TEXT_TAGS:
+                    non_text -= 1
+                add_text(el.tail)
+
+        self.title = (title or '').replace('\n', '').strip()
+        self.text = ' '.join(' '.join(text).split())
+        self.main_text = ' '.join(' '.join(main_text).split())
+
+    def get_description(self):
+        ret = ''
+        for t in self.paragraphs:
+            l = len(t)
+            if l > 150 and 'script' not in t.lower():
+                return t
+            if l > len(ret):
+                ret = t
+        if not ret:
+            ret = self.main_text
+        return ret[:300].strip()
+
+    def get_keywords(self):
+        kws = set()
+        for header in self.headings:
+            for w in header.split():
+                if len(w) > 6:
+                    kws.add(w)
+        return list(kws)
@@ -0,0 +1,185 @@
+import datetime
+import gzip
+import logging
+import os
+import socket
+import time
+import uuid
+
+import gevent
+from gevent.event import AsyncResult
+
+from my_metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# the body is stored decoded, these headers don't describe it anymore
+SKIPPED_HEADERS = ('content-encoding', 'transfer-encoding', 'content-length')
+
+
+def make_record(url, response, body):
+    """WARC/1.0 response record of the page, `response` is FetchResponse"""
+    http_headers = ['HTTP/1.1 {} {}'.format(response.status, getattr(response, 'reason', '') or '')]
+    http_headers.extend(
+        '{}: {}'.format(name, value) for name, value in response.items()
+        if name not in SKIPPED_HEADERS
+    )
+    http_headers.append('content-length: {}'.format(len(body)))
+    payload = '\r\n'.join(http_headers).encode('utf-8', 'replace') + b'\r\n\r\n' + body
+    warc_headers = [
+        'WARC/1.0',
+        'WARC-Type: response',
+        'WARC-Record-ID: <urn:uuid:{}>'.format(uuid.uuid4()),
+        'WARC-Date: {}'.format(datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')),
+        'WARC-Target-URI: {}'.format(url),
+        'Content-Type: application/http; msgtype=response',
+        'Content-Length: {}'.format(len(payload)),
+    ]
+    return '\r\n'.join(warc_headers).encode('utf-8', 'replace') + b'\r\n\r\n' + payload + b'\r\n\r\n'
+
+
+def parse_record(data):
+    """Return (status, headers, body) of a decompressed response record"""
+    _, _, payload = data.partition(b'\r\n\r\n')
+    http_headers, _, body = payload.partition(b'\r\n\r\n')
+    lines = http_headers.decode('utf-8', 'replace').split('\r\n')
+    status = int(lines[0].split()[1])
+    headers = dict(line.split(': ', 1) for line in lines[1:] if ': ' in line)
+    if body.endswith(b'\r\n\r\n'):
+        body = body[:-4]
+    return status, headers, body
+
+
+def read_record(s3_client, bucket, pointer):
+    """Read a single page back from its segment with one ranged GET"""
+    first = pointer['offset']
+    last = first + pointer['length'] - 1
+    resp = s3_client.get_object(Bucket=bucket, Key=pointer['segment'], Range='bytes={}-{}'.format(first, last))
+    return parse_record(gzip.decompress(resp['Body'].read()))
+
+
+class Segment(object):
+    def __init__(self, path, key):
+        self.path = path
+        self.key = key
+        self.file = open(path, 'wb')
+        self.size = 0
+        self.records = 0
+        self.created_at = time.time()
+        # True once the segment is uploaded, False if the upload failed
+        self.uploaded = AsyncResult()
+
+
+class SegmentWriter(object):
+    """
+    Page bodies appended to rolling WARC-like segments instead of an S3
+    object per page.
+
+    Every record is a separate gzip member, so the segment is a valid
+    .warc.gz and any record can be read alone: `append` returns its
+    {"segment": key, "offset": ..., "length": ...} pointer (see
+    `read_record`) and the upload of the segment, an AsyncResult which
+    value tells if the segment was uploaded. The segment is written to
+    `directory` and uploaded when it reaches `max_bytes` or `max_seconds`
+    or when `roll` is called, the local file is removed once it's uploaded.
+
+    Records pointing to a segment should be reported only when it's
+    uploaded, like the ones pointing to single S3 objects. Periodic
+    result flushes don't roll the segment, they report what's uploaded by
+    then; the final one of a crawl rolls it with `roll_if_pending`.
+    """
+
+    def __init__(self, s3_client, bucket, directory, prefix='', max_bytes=64 * 1024 * 1024,
+                 max_seconds=300, retries=3):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.directory = directory
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.retries = retries
+        self.segment = None
+        self.uploads = []
+        self.stats = {'segments': 0, 'records': 0, 'bytes': 0, 'failed': 0}
+
+    def _open(self):
+        name = '{}-{}-{}.warc.gz'.format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:12])
+        key = '{}segments/{}/{}'.format(self.prefix, datetime.datetime.utcnow().strftime('%Y/%m/%d'), name)
+        os.makedirs(self.directory, exist_ok=True)
+        segment = Segment(os.path.join(self.directory, name), key)
+        gevent.spawn_later(self.max_seconds, self._roll_if_current, segment)
+        return segment
+
+    def append(self, url, response, body):
+        """Write the page, return (pointer, upload of its segment)"""
+        if self.segment is None:
+            self.segment = self._open()
+        segment = self.segment
+        data = gzip.compress(make_record(url, response, body))
+        pointer = {'segment': segment.key, 'offset': segment.size, 'length': len(data)}
+        segment.file.write(data)
+        segment.size += len(data)
+        segment.records += 1
+        self.stats['records'] += 1
+        if segment.size >= self.max_bytes:
+            self.roll()
+        return pointer, segment.uploaded
+
+    def _roll_if_current(self, segment):
+        if self.segment is segment:
+            self.roll()
+
+    def roll_if_pending(self, uploads):
+        """Roll the current segment if one of `uploads` is its upload"""
+        if self.segment is not None and any(upload is self.segment.uploaded for upload in uploads):
+            self.roll()
+
+    def roll(self):
+        """Close the current segment and upload it in background"""
+        segment, self.segment = self.segment, None
+        if segment is None:
+            return
+        segment.file.close()
+        self.uploads = [upload for upload in self.uploads if not upload.ready()]
+        self.uploads.append(gevent.spawn(self._upload, segment))
+
+    def _upload(self, segment):
+        for attempt in range(1, self.retries + 1):
+            try:
+                with open(segment.path, 'rb') as f:
+                    body = f.read()
+                with metrics.timer('s3_seconds', op='segment'):
+                    self.s3_client.put_object(
+                        ACL='private',
+                        Body=body,
+                        Bucket=self.bucket,
+                        ContentLength=len(body),
+                        ContentType='application/warc',
+                        Key=segment.key,
+                    )
+            except Exception as e:
+                logger.warning("Segment %s upload failed (attempt %s): %s", segment.key, attempt, e)
+                gevent.sleep(2 ** attempt)
+                continue
+            os.remove(segment.path)
+            self.stats['segments'] += 1
+            self.stats['bytes'] += segment.size
+            metrics.inc('archive_segments_total')
+            metrics.inc('archive_bytes_total', segment.size)
+            metrics.inc('archive_records_total', segment.records)
+            logger.info("Segment %s uploaded: %s records, %s bytes", segment.key, segment.records, segment.size)
+            segment.uploaded.set(True)
+            break
+        else:
+            # its records are dropped, keep the file to look into it
+            self.stats['failed'] += 1
+            metrics.inc('archive_segments_failed_total')
+            logger.error("Segment %s is not uploaded, it's left in %s", segment.key, segment.path)
+            segment.uploaded.set(False)
+
+    def close(self):
+        """Upload the current segment and wait for all uploads"""
+        self.roll()
+        gevent.joinall(self.uploads)
+        self.uploads = []
+        logger.info("Archive segments: %s", self.stats)
@@ -0,0 +1,68 @@
+"""
+Result message envelopes, the same file is used by indexer-node and manager-node.
+
+Message body is "<version>:<codec>:<payload>":
+ * v1:zlib:<base64 of zlib compressed JSON list of records>
+ * v1:s3:<JSON {"bucket": ..., "key": ..., "codec": "zlib"}> - the compressed
+   records didn't fit into a single SQS message and were saved to S3, the
+   object can be deleted once the message is processed
+Bodies without the header are plain JSON (a record or a list of records),
+as sent by crawler-node and older indexers.
+"""
+import base64
+import json
+import zlib
+
+VERSION = 'v1'
+ZLIB_HEADER = '{}:zlib:'.format(VERSION)
+S3_HEADER = '{}:s3:'.format(VERSION)
+
+
+def compress_records(records):
+    return zlib.compress(json.dumps(records).encode('utf-8'))
+
+
+def decompress_records(data):
+    return json.loads(zlib.decompress(data).decode('utf-8'))
+
+
+def make_envelope(compressed):
+    return ZLIB_HEADER + base64.b64encode(compressed).decode('ascii')
+
+
+class FetchError(Exception):
+    """Records of the envelope are in S3 and can't be fetched now"""
+
+
+def make_pointer(bucket, key):
+    return S3_HEADER + json.dumps({'bucket': bucket, 'key': key, 'codec': 'zlib'})
+
+
+def get_pointer(body):
+    """{"bucket": ..., "key": ...} of the S3 object with the records, None if they are in the body"""
+    if body.startswith(S3_HEADER):
+        return json.loads(body[len(S3_HEADER):])
+    return None
+
+
+def decode_envelope(body, fetch_object=None):
+    """
+    Return the data from the message body.
+    fetch_object(bucket, key) should return the content of S3 object,
+    it's needed only for envelopes pointing to S3; its errors are raised
+    as FetchError, the rest (ValueError and others) mean a broken body.
+    """
+    if body.startswith(ZLIB_HEADER):
+        return decompress_records(base64.b64decode(body[len(ZLIB_HEADER):]))
+    if body.startswith(S3_HEADER):
+        pointer = get_pointer(body)
+        if fetch_object is None:
+            raise ValueError("Can't fetch records from S3 for {}".format(pointer))
+        try:
+            compressed = fetch_object(pointer['bucket'], pointer['key'])
+        except Exception as e:
+            raise FetchError("Can't fetch {}: {}".format(pointer['key'], e))
+        return decompress_records(compressed)
+    if not body.lstrip().startswith(('{', '[')):
+        raise ValueError("Unsupported envelope {}".format(body[:16]))
+    return json.loads(body)
@@ -0,0 +1,195 @@
+import ipaddress
+import logging
+import socket
+import time
+from urllib.parse import urljoin
+
+import urllib3
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+from my_metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+READ_CHUNK_SIZE = 16 * 1024
+
+
+class DNSCache(object):
+    """
+    Resolved addresses by host name, kept for `ttl` seconds
+    """
+
+    def __init__(self, ttl=300, size=10000):
+        self.ttl = ttl
+        self.size = size
+        self.cache = {}
+        self.lookups = 0
+        self.hits = 0
+
+    def resolve(self, host):
+        try:
+            ipaddress.ip_address(host)
+        except ValueError:
+            pass
+        else:
+            return host
+        self.lookups += 1
+        now = time.time()
+        cached = self.cache.get(host)
+        if cached and cached[0] > now:
+            self.hits += 1
+            return cached[1]
+        address = socket.getaddrinfo(host, None, 0, socket.SOCK_STREAM)[0][4][0]
+        if len(self.cache) >= self.size:
+            self.cache.clear()
+        self.cache[host] = (now + self.ttl, address)
+        return address
+
+
+class CachedDNSMixin(object):
+    """
+    Connect to the address from the engine's DNS cache. Host name is still
+    used for the Host header, SNI and certificate checks. Requests sent over
+    an already used socket are counted as reused connections.
+    """
+    engine = None
+    fresh = False
+
+    def _new_conn(self):
+        hostname = self._dns_host
+        self._dns_host = self.engine.dns_cache.resolve(hostname.rstrip('.'))
+        self.engine.count('connections')
+        self.fresh = True
+        try:
+            return super()._new_conn()
+        finally:
+            self._dns_host = hostname
+
+    def request(self, *args, **kwargs):
+        if self.sock is not None and not self.fresh:
+            self.engine.count('connections_reused')
+        try:
+            # connects here if there is no socket yet
+            return super().request(*args, **kwargs)
+        finally:
+            self.fresh = False
+
+
+class FetchResponse(dict):
+    """
+    Response headers (lowercase names, like httplib2 has them) plus status
+    and the url after redirects (None if there were none).
+    `aborted` tells why the body wasn't downloaded, if it wasn't.
+    """
+
+    def __init__(self, resp, aborted=None):
+        super(FetchResponse, self).__init__(
+            (name.lower(), value) for name, value in resp.headers.items()
+        )
+        self.status = resp.status
+        self.reason = resp.reason
+        self.url = None
+        history = resp.retries.history if resp.retries else ()
+        if history and history[-1].redirect_location:
+            self.url = urljoin(history[-1].url, history[-1].redirect_location)
+        self.aborted = aborted
+
+
+class FetchEngine(object):
+    """
+    HTTP client shared by all the crawler workers of the process.
+
+    * per host keep-alive connection pools (and TLS sessions with them)
+    * TTL cache of DNS lookups for new connections
+    * bodies are streamed and the download is aborted early when the
+      Content-Type isn't wanted, the Content-Length is over the cap or
+      the cap is reached while reading
+
+    The counters in `stats` are exported to metrics as fetch_<name>_total.
+    """
+
+    def __init__(self, timeout=20, connect_timeout=10, max_bytes=100 * 1024,
+                 content_types=('text/',), dns_ttl=300, pool_size=4, num_pools=200):
+        self.max_bytes = max_bytes
+        self.content_types = content_types
+        self.dns_cache = DNSCache(ttl=dns_ttl)
+        self.stats = {
+            'requests': 0,
+            'connections': 0,
+            'connections_reused': 0,
+            'aborted': 0,
+            'bytes_read': 0,
+            'bytes_saved': 0,
+        }
+        self.manager = urllib3.PoolManager(
+            num_pools=num_pools,
+            maxsize=pool_size,
+            timeout=urllib3.Timeout(connect=connect_timeout, read=timeout),
+            retries=Retry(connect=2, read=0, status=0, redirect=5, raise_on_redirect=False),
+        )
+        # pool classes using connections with the DNS cache of this engine
+        engine = self
+        self.manager.pool_classes_by_scheme = {
+            'http': type('CachedHTTPConnectionPool', (HTTPConnectionPool,), {
+                'ConnectionCls': type('CachedHTTPConnection', (CachedDNSMixin, HTTPConnection), {
+                    'engine': engine,
+                }),
+            }),
+            'https': type('CachedHTTPSConnectionPool', (HTTPSConnectionPool,), {
+                'ConnectionCls': type('CachedHTTPSConnection', (CachedDNSMixin, HTTPSConnection), {
+                    'engine': engine,
+                }),
+            }),
+        }
+
+    def count(self, name, value=1):
+        self.stats[name] += value
+        metrics.inc('fetch_{}_total'.format(name), value)
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['dns_lookups'] = self.dns_cache.lookups
+        stats['dns_hits'] = self.dns_cache.hits
+        return stats
+
+    def _abort_reason(self, resp):
+        content_type = resp.headers.get('content-type', '')
+        if self.content_types and content_type and not content_type.startswith(self.content_types):
+            return 'content-type'
+        length = resp.headers.get('content-length')
+        if length and length.isdigit() and int(length) > self.max_bytes:
+            return 'content-length'
+        return None
+
+    def request(self, url, method='GET', headers=None):
+        """Return (response, body) like httplib2 does, body is empty if aborted"""
+        self.count('requests')
+        resp = self.manager.request(
+            method, url, headers=headers, preload_content=False, decode_content=True
+        )
+        aborted = None
+        chunks = []
+        try:
+            aborted = self._abort_reason(resp)
+            if not aborted:
+                read = 0
+                for chunk in resp.stream(READ_CHUNK_SIZE):
+                    chunks.append(chunk)
+                    read += len(chunk)
+                    if read > self.max_bytes:
+                        aborted = 'max-bytes'
+                        break
+                self.count('bytes_read', read)
+        finally:
+            if aborted:
+                self.count('aborted')
+                length = resp.headers.get('content-length')
+                if length and length.isdigit():
+                    self.count('bytes_saved', max(int(length) - sum(len(c) for c in chunks), 0))
+                # the rest of the body is still on the wire, the connection can't be reused
+                resp.close()
+            resp.release_conn()
+        body = b'' if aborted else b''.join(chunks)
+        return FetchResponse(resp, aborted=aborted), body
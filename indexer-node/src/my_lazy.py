@@ -0,0 +1,97 @@
+"""
+Resources created on first use, the same file is used by all the nodes.
+
+    results_queue = Lazy('results_queue', lambda: get_queue(SYS_SETTINGS.QUEUE_RESULTS))
+    results_queue.send_messages(...)  # the queue is resolved here, once
+
+Time spent creating the resources (and importing modules, if
+`track_imports()` was called early enough) is recorded, `startup_report()`
+formats it. Workers print it when they are started with --startup-time.
+"""
+import builtins
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# component name: seconds
+timings = OrderedDict()
+
+
+class timed(object):
+    """Context manager adding its duration to the component's timing"""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started_at = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        timings[self.name] = timings.get(self.name, 0) + time.time() - self.started_at
+        return False
+
+
+class Lazy(object):
+    """Proxy creating the object with `factory()` when it's used first time"""
+
+    def __init__(self, name, factory):
+        self._name = name
+        self._factory = factory
+        self._obj = None
+        self._lock = threading.Lock()
+
+    def resolve(self):
+        if self._obj is None:
+            with self._lock:
+                if self._obj is None:
+                    with timed(self._name):
+                        self._obj = self._factory()
+        return self._obj
+
+    @property
+    def resolved(self):
+        """The object is created, e.g. it has to be closed"""
+        return self._obj is not None
+
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+
+    def __repr__(self):
+        return '<Lazy {} {}>'.format(self._name, 'ready' if self._obj is not None else 'not created')
+
+
+def track_imports():
+    """Record the import time of modules imported from now on, by top level package"""
+    original_import = builtins.__import__
+    depth = [0]
+
+    def timed_import(name, *args, **kwargs):
+        if depth[0] or name in sys.modules:
+            return original_import(name, *args, **kwargs)
+        depth[0] += 1
+        try:
+            with timed('import ' + name.split('.')[0]):
+                return original_import(name, *args, **kwargs)
+        finally:
+            depth[0] -= 1
+
+    builtins.__import__ = timed_import
+
+
+def warm_up(*resources):
+    """Create the resources now, errors are reported, not raised"""
+    for resource in resources:
+        try:
+            resource.resolve()
+        except Exception as e:
+            timings[resource._name + ' (failed: {})'.format(e.__class__.__name__)] = timings.pop(
+                resource._name, 0
+            )
+
+
+def startup_report():
+    lines = ['{:>9.1f} ms  {}'.format(seconds * 1000, name) for name, seconds in timings.items()]
+    lines.append('{:>9.1f} ms  total'.format(sum(timings.values()) * 1000))
+    return '\n'.join(lines)
@@ -0,0 +1,363 @@
+"""
+Local back ends for running the whole pipeline on a single host, the same
+file is used by indexer-node and manager-node.
+
+They implement the small parts of the boto3 SQS/S3, Redis and
+Elasticsearch APIs the nodes use, on top of SQLite files and plain files
+in a data directory, so several processes of the host can share them:
+ * LocalQueues / LocalQueue - SQS queues with visibility timeout
+ * LocalS3 - objects stored as files, <dir>/s3/<bucket>/<key>
+ * LocalRedis - key-value store with NX and expiration, sorted sets
+ * LocalIndex - bulk API appending documents to <dir>/index/<index>.jsonl
+"""
+import datetime
+import io
+import json
+import os
+import sqlite3
+import time
+import uuid
+
+from botocore.exceptions import ClientError
+
+
+def connect(path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    db = sqlite3.connect(path, timeout=60, isolation_level=None)
+    db.execute('PRAGMA journal_mode=WAL')
+    return db
+
+
+class LocalMessage(object):
+    def __init__(self, queue, message_id, body):
+        self.queue = queue
+        self.message_id = message_id
+        self.body = body
+
+    def delete(self):
+        self.queue.delete_message(self.message_id)
+
+    def change_visibility(self, VisibilityTimeout):
+        self.queue.change_message_visibility(self.message_id, VisibilityTimeout)
+
+
+class LocalQueue(object):
+    """
+    Messages of a queue in a SQLite table. Received messages are hidden for
+    `visibility_timeout` seconds and appear again if they aren't deleted.
+    """
+
+    def __init__(self, db_path, name, visibility_timeout=300, poll_seconds=0.5):
+        self.name = name
+        self.visibility_timeout = visibility_timeout
+        self.poll_seconds = poll_seconds
+        self.db = connect(db_path)
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS messages (id TEXT PRIMARY KEY, queue TEXT, '
+            'body TEXT, sent_at REAL, visible_at REAL)'
+        )
+        self.db.execute('CREATE INDEX IF NOT EXISTS messages_visible ON messages (queue, visible_at)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS activity (queue TEXT PRIMARY KEY, updated_at REAL)')
+
+    def _touch(self, now):
+        self.db.execute(
+            'INSERT OR REPLACE INTO activity (queue, updated_at) VALUES (?, ?)', (self.name, now)
+        )
+
+    def send_message(self, MessageBody, **kwargs):
+        message_id = str(uuid.uuid4())
+        now = time.time()
+        self.db.execute(
+            'INSERT INTO messages (id, queue, body, sent_at, visible_at) VALUES (?, ?, ?, ?, ?)',
+            (message_id, self.name, MessageBody, now, now)
+        )
+        self._touch(now)
+        return {'MessageId': message_id}
+
+    def send_messages(self, Entries):
+        now = time.time()
+        rows = [
+            (str(uuid.uuid4()), self.name, entry['MessageBody'], now, now)
+            for entry in Entries
+        ]
+        with self.db:
+            self.db.execute('BEGIN IMMEDIATE')
+            self.db.executemany(
+                'INSERT INTO messages (id, queue, body, sent_at, visible_at) VALUES (?, ?, ?, ?, ?)',
+                rows
+            )
+            self._touch(now)
+        return {
+            'Successful': [
+                {'Id': entry['Id'], 'MessageId': row[0]} for entry, row in zip(Entries, rows)
+            ],
+            'Failed': [],
+        }
+
+    def _receive(self, count, visibility_timeout):
+        now = time.time()
+        with self.db:
+            self.db.execute('BEGIN IMMEDIATE')
+            rows = self.db.execute(
+                'SELECT id, body FROM messages WHERE queue = ? AND visible_at <= ? '
+                'ORDER BY visible_at LIMIT ?',
+                (self.name, now, count)
+            ).fetchall()
+            self.db.executemany(
+                'UPDATE messages SET visible_at = ? WHERE id = ?',
+                [(now + visibility_timeout, row[0]) for row in rows]
+            )
+            if rows:
+                self._touch(now)
+        return [LocalMessage(self, message_id, body) for message_id, body in rows]
+
+    def receive_messages(self, MaxNumberOfMessages=1, WaitTimeSeconds=0, VisibilityTimeout=None,
+                         **kwargs):
+        deadline = time.time() + WaitTimeSeconds
+        if VisibilityTimeout is None:
+            VisibilityTimeout = self.visibility_timeout
+        while True:
+            messages = self._receive(MaxNumberOfMessages, VisibilityTimeout)
+            if messages or time.time() >= deadline:
+                return messages
+            time.sleep(self.poll_seconds)
+
+    def delete_message(self, message_id):
+        self.db.execute('DELETE FROM messages WHERE id = ?', (message_id,))
+
+    def change_message_visibility(self, message_id, timeout):
+        self.db.execute(
+            'UPDATE messages SET visible_at = ? WHERE id = ?', (time.time() + timeout, message_id)
+        )
+
+    def count(self):
+        """Messages in the queue, including the received ones"""
+        return self.db.execute(
+            'SELECT COUNT(*) FROM messages WHERE queue = ?', (self.name,)
+        ).fetchone()[0]
+
+    def last_activity(self):
+        """Time of the last message sent or received, None if there were none"""
+        row = self.db.execute(
+            'SELECT updated_at FROM activity WHERE queue = ?', (self.name,)
+        ).fetchone()
+        return row[0] if row else None
+
+
+class LocalQueues(object):
+    """Stands for boto3 SQS resource"""
+
+    def __init__(self, data_dir, visibility_timeout=300):
+        self.db_path = os.path.join(data_dir, 'queues.sqlite')
+        self.visibility_timeout = visibility_timeout
+
+    def get_queue_by_name(self, QueueName, **kwargs):
+        return LocalQueue(self.db_path, QueueName, visibility_timeout=self.visibility_timeout)
+
+
+class LocalS3(object):
+    """Stands for boto3 S3 client"""
+
+    def __init__(self, data_dir):
+        self.root = os.path.join(data_dir, 's3')
+
+    def _path(self, bucket, key):
+        path = os.path.normpath(os.path.join(self.root, bucket, key))
+        if not path.startswith(os.path.join(self.root, bucket) + os.sep):
+            raise ValueError("Wrong key {}".format(key))
+        return path
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        path = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if isinstance(Body, str):
+            Body = Body.encode('utf-8')
+        # readers never see partially written objects
+        tmp_path = '{}.{}.tmp'.format(path, uuid.uuid4().hex)
+        with open(tmp_path, 'wb') as f:
+            f.write(Body)
+        os.rename(tmp_path, path)
+        return {}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        path = self._path(Bucket, Key)
+        if not os.path.isfile(path):
+            raise ClientError({'Error': {'Code': '404', 'Message': 'Not Found'}}, 'HeadObject')
+        return {'ContentLength': os.path.getsize(path)}
+
+    def get_object(self, Bucket, Key, Range=None, **kwargs):
+        path = self._path(Bucket, Key)
+        if not os.path.isfile(path):
+            raise ClientError({'Error': {'Code': 'NoSuchKey', 'Message': 'Not Found'}}, 'GetObject')
+        with open(path, 'rb') as f:
+            if Range is None:
+                return {'Body': io.BytesIO(f.read())}
+            # only "bytes=first-last" is supported
+            first, last = Range.split('=', 1)[1].split('-')
+            f.seek(int(first))
+            return {'Body': io.BytesIO(f.read(int(last) - int(first) + 1))}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        path = self._path(Bucket, Key)
+        if os.path.isfile(path):
+            os.remove(path)
+        return {}
+
+
+class LocalPipeline(object):
+    def __init__(self, local_redis):
+        self.local_redis = local_redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        def command(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+            return self
+        return command
+
+    def execute(self):
+        commands, self.commands = self.commands, []
+        return [getattr(self.local_redis, name)(*args, **kwargs) for name, args, kwargs in commands]
+
+
+class LocalRedis(object):
+    """
+    Stands for redis.StrictRedis, only get/set/exists/delete, a few sorted
+    set commands and pipelines of them
+    """
+
+    def __init__(self, data_dir):
+        self.db = connect(os.path.join(data_dir, 'redis.sqlite'))
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value BLOB, expires_at REAL)'
+        )
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS zset (key TEXT, member TEXT, score REAL, '
+            'PRIMARY KEY (key, member))'
+        )
+        self.db.execute('CREATE INDEX IF NOT EXISTS zset_score ON zset (key, score)')
+
+    def get(self, key):
+        row = self.db.execute(
+            'SELECT value FROM kv WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)',
+            (key, time.time())
+        ).fetchone()
+        if row is None:
+            return None
+        value = row[0]
+        return value.encode('utf-8') if isinstance(value, str) else value
+
+    def exists(self, key):
+        return int(self.get(key) is not None)
+
+    def set(self, key, value, ex=None, nx=False):
+        now = time.time()
+        expires_at = now + ex if ex else None
+        if isinstance(value, (int, float)):
+            value = str(value)
+        if not nx:
+            self.db.execute(
+                'INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)',
+                (key, value, expires_at)
+            )
+            return True
+        with self.db:
+            self.db.execute('BEGIN IMMEDIATE')
+            self.db.execute(
+                'DELETE FROM kv WHERE key = ? AND expires_at IS NOT NULL AND expires_at <= ?',
+                (key, now)
+            )
+            cursor = self.db.execute(
+                'INSERT OR IGNORE INTO kv (key, value, expires_at) VALUES (?, ?, ?)',
+                (key, value, expires_at)
+            )
+        return True if cursor.rowcount else None
+
+    def delete(self, *keys):
+        deleted = 0
+        for key in keys:
+            deleted += self.db.execute('DELETE FROM kv WHERE key = ?', (key,)).rowcount
+        return deleted
+
+    def zadd(self, name, mapping, nx=False):
+        sql = 'INSERT OR IGNORE' if nx else 'INSERT OR REPLACE'
+        added = 0
+        with self.db:
+            self.db.execute('BEGIN IMMEDIATE')
+            for member, score in mapping.items():
+                exists = self.db.execute(
+                    'SELECT 1 FROM zset WHERE key = ? AND member = ?', (name, member)
+                ).fetchone()
+                self.db.execute(
+                    sql + ' INTO zset (key, member, score) VALUES (?, ?, ?)', (name, member, score)
+                )
+                added += 0 if exists else 1
+        return added
+
+    def zrangebyscore(self, name, min, max, start=None, num=None):
+        rows = self.db.execute(
+            'SELECT member FROM zset WHERE key = ? AND score >= ? AND score <= ? '
+            'ORDER BY score LIMIT ? OFFSET ?',
+            (name, float(min), float(max), -1 if num is None else num, start or 0)
+        ).fetchall()
+        return [row[0].encode('utf-8') for row in rows]
+
+    def zrem(self, name, *values):
+        removed = 0
+        for value in values:
+            removed += self.db.execute(
+                'DELETE FROM zset WHERE key = ? AND member = ?', (name, value)
+            ).rowcount
+        return removed
+
+    def zcard(self, name):
+        return self.db.execute('SELECT COUNT(*) FROM zset WHERE key = ?', (name,)).fetchone()[0]
+
+    def pipeline(self, transaction=True):
+        return LocalPipeline(self)
+
+
+class LocalSerializer(object):
+    def dumps(self, data):
+        if isinstance(data, str):
+            return data
+        return json.dumps(data, default=self.default)
+
+    def default(self, value):
+        if isinstance(value, (datetime.date, datetime.datetime)):
+            return value.isoformat()
+        raise TypeError("Unable to serialize {!r}".format(value))
+
+
+class LocalTransport(object):
+    serializer = LocalSerializer()
+
+
+class LocalIndex(object):
+    """
+    Stands for Elasticsearch client when there is no cluster: bulk actions
+    are appended to <dir>/index/<index>.jsonl, one
+    {"_op": ..., "_id": ..., "doc": ...} line per document
+    """
+    transport = LocalTransport()
+
+    def __init__(self, data_dir):
+        self.root = os.path.join(data_dir, 'index')
+        os.makedirs(self.root, exist_ok=True)
+
+    def bulk(self, body):
+        lines = [line for line in body.split('\n') if line]
+        by_index = {}
+        items = []
+        for action_line, source_line in zip(lines[::2], lines[1::2]):
+            op_type, meta = list(json.loads(action_line).items())[0]
+            source = json.loads(source_line)
+            doc = source.get('doc', source) if op_type == 'update' else source
+            by_index.setdefault(meta['_index'], []).append(
+                json.dumps({'_op': op_type, '_id': meta['_id'], 'doc': doc})
+            )
+            items.append({op_type: {'_index': meta['_index'], '_id': meta['_id'], 'status': 200}})
+        for index, records in by_index.items():
+            with open(os.path.join(self.root, os.path.basename(index) + '.jsonl'), 'a') as f:
+                f.write('\n'.join(records) + '\n')
+        return {'errors': False, 'items': items}
@@ -0,0 +1,169 @@
+import logging
+import multiprocessing
+import os
+import time
+import traceback
+
+from gevent import pool, queue
+from gevent.threadpool import ThreadPool
+
+from my_analysis import PageAnalysis
+from my_parser import WebsiteParser
+from my_simhash import get_features, simhash
+
+logger = logging.getLogger(__name__)
+
+
+def analyse_page(url, body, headers):
+    """
+    CPU-bound part of the page processing, it doesn't depend on the crawl
+    state so it can run in a worker process.
+
+    Return the links found on the page (and its <base href>), SimHash of its text (None if the
+    text is too short) and the record without the link lists, which the
+    spider fills in.
+    """
+    analysis = PageAnalysis(body)
+    features = get_features(analysis.text)
+    parser = WebsiteParser(
+        url=url,
+        body=body,
+        analysis=analysis,
+        external_links=[],
+        internal_links=[],
+        resp=headers,
+    )
+    return {
+        'links': analysis.links,
+        'base_url': analysis.base_url,
+        'fingerprint': simhash(features) if features else None,
+        'record': parser.get_result(),
+        's3_filename': parser.get_s3_filename(),
+    }
+
+
+def serve(conn):
+    """Worker process loop: (url, body, headers) in, (ok, result or traceback) out"""
+    while True:
+        try:
+            args = conn.recv()
+        except EOFError:
+            break
+        if args is None:
+            break
+        try:
+            reply = (True, analyse_page(*args))
+        except Exception:
+            reply = (False, traceback.format_exc())
+        conn.send(reply)
+    conn.close()
+
+
+class ParseError(Exception):
+    pass
+
+
+class ParseWorker(object):
+    """A worker process and our end of its pipe, one page at a time"""
+
+    def __init__(self, context):
+        self.conn, child_conn = context.Pipe()
+        # made of a patched socketpair, the native threads need it blocking
+        for conn in (self.conn, child_conn):
+            os.set_blocking(conn.fileno(), True)
+        self.process = context.Process(target=serve, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def call(self, url, body, headers):
+        # blocking pipe I/O, runs in a native thread (see ParsePool)
+        self.conn.send((url, body, headers))
+        ok, result = self.conn.recv()
+        if not ok:
+            raise ParseError(result)
+        return result
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (OSError, EOFError):
+            pass
+        self.process.join(5)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.conn.close()
+
+
+class ParsePool(object):
+    """
+    Parse pages in `processes` worker processes, so parsing uses all the
+    cores and doesn't block the fetches on the gevent loop.
+
+    `spawn` runs the post-processing greenlet and blocks when `window`
+    pages are being processed, so the crawler pipelines stop taking jobs,
+    their queues fill up and the fetch workers wait. With no processes
+    pages are parsed in the calling greenlet, like before.
+
+    The process is monkey-patched, so concurrent.futures and
+    multiprocessing.Pool don't work here: their feeder and result threads
+    are greenlets and a pipe write blocking the whole loop deadlocks them.
+    Every worker has its own pipe with one page in flight, the pipe I/O
+    is done in a native thread of a gevent ThreadPool and only the calling
+    greenlet waits for it.
+    """
+
+    def __init__(self, processes=0, window=None):
+        self.processes = processes
+        self.workers = []
+        self.idle = queue.Queue()
+        self.threads = None
+        if processes:
+            # forked, the parent is patched but the workers only use pipes
+            context = multiprocessing.get_context('fork')
+            for _ in range(processes):
+                worker = ParseWorker(context)
+                self.workers.append(worker)
+                self.idle.put(worker)
+            self.threads = ThreadPool(processes)
+        self.greenlets = pool.Pool(window or max(processes * 2, 1))
+        self.stats = {'pages': 0, 'inline': 0, 'seconds': 0.0}
+
+    @property
+    def enabled(self):
+        return self.threads is not None
+
+    def spawn(self, func, *args):
+        return self.greenlets.spawn(func, *args)
+
+    def analyse(self, url, body, headers):
+        started_at = time.time()
+        self.stats['pages'] += 1
+        try:
+            if self.threads is not None:
+                worker = self.idle.get()
+                try:
+                    if self.threads is not None:
+                        return self.threads.apply(worker.call, (url, body, dict(headers)))
+                except (OSError, EOFError):
+                    # a worker died (OOM killer?), the rest of the run is parsed inline
+                    logger.error("Parse worker %s died, parsing pages in process", worker.process.pid)
+                    self.threads = None
+                except ParseError as e:
+                    raise ParseError("{} parse failed:\n{}".format(url, e))
+                finally:
+                    # wakes up the waiting greenlets if the pool is broken
+                    self.idle.put(worker)
+            self.stats['inline'] += 1
+            return analyse_page(url, body, headers)
+        finally:
+            self.stats['seconds'] += time.time() - started_at
+
+    def shutdown(self):
+        self.greenlets.join()
+        threads, self.threads = self.threads, None
+        for worker in self.workers:
+            worker.stop()
+        self.workers = []
+        if threads is not None:
+            threads.kill()
+        logger.info("Parse stats: %s", self.stats)
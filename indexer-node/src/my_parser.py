@@ -6,22 +6,44 @@ from urllib.parse import urlparse
 import dateutil.parser
 import multihash
 # from goose import Goose
-from bs4 import BeautifulSoup
 
 from randomname import get_random_name
 
 
+def get_unchanged_result(url):
+    """
+    Lightweight result for the page which hasn't changed since the last crawl
+    """
+    return {
+        'identifier': url,
+        'owner': urlparse(url).netloc,
+        'unchanged': True,
+    }
+
+
+def get_duplicate_result(url, original):
+    """
+    Lightweight result for the page which is a near duplicate of `original`
+    """
+    return {
+        'identifier': url,
+        'owner': urlparse(url).netloc,
+        'duplicate_of': original,
+    }
+
+
 class WebsiteParser(object):
     """
-    Receive response from scrapy
+    Receive fetched page and its PageAnalysis
     Return the list of items to save:
      * HTML content to save to S3
      * parsed dict with information to send to SQS
     """
 
-    def __init__(self, url, body, external_links, internal_links, resp):
+    def __init__(self, url, body, analysis, external_links, internal_links, resp):
         self.url = url
         self.body = body
+        self.analysis = analysis
         self.internal_links = internal_links
         self.external_links = external_links
         self.resp = resp
@@ -30,9 +52,11 @@ class WebsiteParser(object):
         return self.body
 
     def get_content_multihash(self):
-        return base58.b58encode(
+        encoded = base58.b58encode(
             bytes(multihash.encode(self.get_body(), multihash.SHA1))
         )
+        # base58>=1.0 returns bytes, but it goes to JSON and S3 keys
+        return encoded.decode('ascii') if isinstance(encoded, bytes) else encoded
 
     def get_s3_filename(self):
         return self.get_content_multihash()
@@ -42,12 +66,6 @@ class WebsiteParser(object):
         Return parse results
         https://github.com/difchain/rmaas/blob/master/docs/WebCrawler_Client.md
         """
-        soup = BeautifulSoup(self.get_body(), "lxml")
-        [x.extract() for x in soup.findAll('script')]
-        [x.extract() for x in soup.findAll('ul')]
-        [x.extract() for x in soup.findAll('table')]
-        [x.extract() for x in soup.findAll('form')]
-
         owner = urlparse(self.url).netloc
         identifier = self.url
         result = {
@@ -57,8 +75,8 @@ class WebsiteParser(object):
             # RecordVersion area
             'Hash': self.get_content_multihash(),
             'RecordsAuthority': 'naa.gov.au:gda{}'.format(random.randint(15, 30)),
-            'Title': soup.title.text.replace('\n', '').strip(),
-            'Description': self._get_description(soup),
+            'Title': self.analysis.title,
+            'Description': self.analysis.get_description(),
             'Author': get_random_name(),
             'DateCreated': self._get_date_created(),
             'Classification': 'UNCLASSIFIED',
@@ -70,23 +88,10 @@ class WebsiteParser(object):
             's3_filename': self.get_s3_filename(),
             'external_domains': self.external_links,
             'links': self.internal_links,
-            'keywords': self.get_keywords(soup)
+            'keywords': self.analysis.get_keywords()
         }
         return result
 
-    def _get_description(self, soup):
-        all_paragraphs = [s.extract().text for s in soup('p')]
-        ret = ''
-        for t in all_paragraphs:
-            l = len(t)
-            if l > 150 and 'script' not in t.lower():
-                return t
-            if l > len(ret):
-                ret = t
-        if not ret:
-            ret = soup.get_text(strip=True)
-        return ret[:300].strip()
-
     def _get_mimetype(self):
         result = self.resp.get('content-type')
         return result or 'text/html'
@@ -99,14 +104,5 @@ class WebsiteParser(object):
                 lm = lm.isoformat()
         return lm
 
-    def get_keywords(self, soup):
-        kws = set()
-        for tag in ['h1', 'h2', 'h3', 'h4']:
-            for header in soup.find_all(tag):
-                words = [w for w in header.text.split() if len(w) > 6]
-                for w in words:
-                    kws.add(w)
-        return list(kws)
-
     def _get_language(self):
         return 'en-us'
@@ -0,0 +1,190 @@
+import time
+from urllib.parse import urlparse
+
+from my_metrics import metrics
+
+
+class TokenBucket(object):
+    """
+    Token bucket of a single host: `rate` requests per second with bursts
+    up to `capacity` requests.
+
+    A token is taken only when the request is actually sent, so requests
+    which had to wait for something else (a pool slot, the host's
+    concurrency window) don't go out back to back.
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.time()
+
+    def _refill(self, now):
+        # `now` may be a bit older than the bucket when it's shared by a loop
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def set_rate(self, rate, now=None):
+        """Change the rate, tokens earned until now are kept"""
+        if rate != self.rate:
+            self._refill(now or time.time())
+            self.rate = rate
+
+    def wait(self, now=None):
+        """Seconds until a token is available, 0 if there is one now"""
+        self._refill(now or time.time())
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now=None):
+        """Take a token, the bucket goes into debt if there is none"""
+        self._refill(now or time.time())
+        self.tokens -= 1
+
+
+class HostBuckets(object):
+    """
+    Token buckets by host, `get_delay(host)` returns seconds between
+    requests to the host (from its robots.txt crawl delay or request rate,
+    scaled by its concurrency window), it's asked every time the bucket
+    is used, so the rate follows it
+    """
+
+    def __init__(self, get_delay, capacity=1):
+        self.get_delay = get_delay
+        self.capacity = capacity
+        self.buckets = {}
+
+    def get(self, host, now=None):
+        rate = 1.0 / max(self.get_delay(host), 0.001)
+        bucket = self.buckets.get(host)
+        if bucket is None:
+            bucket = self.buckets[host] = TokenBucket(rate=rate, capacity=self.capacity)
+        else:
+            bucket.set_rate(rate, now)
+        return bucket
+
+    def wait(self, url, now=None):
+        return self.get(urlparse(url).netloc, now).wait(now)
+
+    def take(self, url, now=None):
+        self.get(urlparse(url).netloc, now).take(now)
+
+
+class ConcurrencyWindow(object):
+    """
+    Requests allowed in flight to a single host, adjusted by AIMD.
+
+    The window grows by `increase` per window-full of healthy responses
+    (no error, faster than `latency_target` seconds), so by about one
+    request per round trip, up to `ceiling`. A timeout, connection error,
+    5xx or 429 multiplies it by `decrease`, at most once per `cooldown`
+    seconds: the requests sent together often fail together, and that's
+    one congestion signal, not several. It's never below one request.
+
+    A request is sent when the host has both a free slot in the window
+    and a token in its bucket. The window limits the requests in flight
+    and also scales the rate of the bucket (see `HostWindows.scale`), so a
+    fast and healthy host is crawled faster than a slow or failing one.
+    """
+
+    def __init__(self, initial=2, ceiling=8, latency_target=2.0, increase=1.0, decrease=0.5,
+                 cooldown=None):
+        self.ceiling = ceiling
+        self.limit = float(max(1, min(initial, ceiling)))
+        self.latency_target = latency_target
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = latency_target if cooldown is None else cooldown
+        self.in_flight = 0
+        # consecutive failures, the host is given up after too many
+        self.failures = 0
+        self.decreased_at = 0
+
+    @property
+    def size(self):
+        return max(1, int(self.limit))
+
+    def available(self):
+        return self.in_flight < self.size
+
+    def acquire(self):
+        self.in_flight += 1
+
+    def release(self, latency=None, failed=False, now=None):
+        now = now or time.time()
+        self.in_flight -= 1
+        if failed:
+            self.failures += 1
+            if now - self.decreased_at >= self.cooldown:
+                self.limit = max(1.0, self.limit * self.decrease)
+                self.decreased_at = now
+            return
+        self.failures = 0
+        if latency is not None and latency <= self.latency_target:
+            self.limit = min(float(self.ceiling), self.limit + self.increase / self.size)
+
+
+class HostWindows(object):
+    """
+    Concurrency windows by host, their sizes and requests in flight are
+    exported as host_window and host_in_flight gauges
+    """
+
+    def __init__(self, initial=2, ceiling=8, latency_target=2.0):
+        self.initial = initial
+        self.ceiling = ceiling
+        self.latency_target = latency_target
+        self.windows = {}
+
+    def get(self, url):
+        return self.get_host(urlparse(url).netloc)
+
+    def get_host(self, host):
+        window = self.windows.get(host)
+        if window is None:
+            window = self.windows[host] = ConcurrencyWindow(
+                initial=self.initial,
+                ceiling=self.ceiling,
+                latency_target=self.latency_target,
+            )
+        return window
+
+    def available(self, url):
+        return self.get(url).available()
+
+    def acquire(self, url):
+        window = self.get(url)
+        window.acquire()
+        self._export(url, window)
+
+    def release(self, url, latency=None, failed=False):
+        window = self.get(url)
+        window.release(latency=latency, failed=failed)
+        self._export(url, window)
+
+    def scale(self, host):
+        """
+        How many times faster than its base rate the host may be crawled:
+        the window's size relative to the initial one, so an unknown host
+        gets the base rate, a healthy one up to ceiling / initial times that
+        """
+        return float(self.get_host(host).size) / max(1, min(self.initial, self.ceiling))
+
+    def failures(self, url):
+        """Consecutive failed requests to the host"""
+        return self.get(url).failures
+
+    def _export(self, url, window):
+        host = urlparse(url).netloc
+        metrics.set('host_window', window.size, host=host)
+        metrics.set('host_in_flight', window.in_flight, host=host)
+
+    def close(self):
+        """The crawl is over, forget the gauges of its hosts"""
+        for host in self.windows:
+            metrics.remove('host_window', host=host)
+            metrics.remove('host_in_flight', host=host)
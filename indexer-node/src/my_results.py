@@ -0,0 +1,177 @@
+import json
+import logging
+import time
+import zlib
+
+from my_envelope import make_envelope
+from my_metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# SQS limits: 256 KiB per message and per batch request, 10 messages per batch
+SQS_MAX_BYTES = 256 * 1024
+SQS_BATCH_SIZE = 10
+# reserved for the end of zlib stream and the closing bracket
+ZLIB_RESERVE = 64
+
+
+class ResultBatcher(object):
+    """
+    Pack result records into as few SQS messages as possible.
+
+    Records are compressed one by one into the current envelope (with a sync
+    flush, so its exact compressed size is always known) until the next one
+    doesn't fit into `max_message_bytes`. Finished envelopes are sent with
+    SendMessageBatch. An envelope which is still too big (a single huge
+    record) is passed to `spill(compressed)`, which should save it somewhere
+    (S3) and return a pointer message body to send instead.
+    """
+
+    def __init__(self, queue, spill=None, max_message_bytes=250000):
+        self.queue = queue
+        self.spill = spill
+        self.max_message_bytes = max_message_bytes
+        # compressed bytes limit, given base64 expands them by 4/3
+        self.max_compressed = (max_message_bytes - 16) * 3 // 4 - ZLIB_RESERVE
+        self.compressor = None
+        self.chunks = []
+        self.size = 0
+        self.count = 0
+        self.pending = []
+        self.pending_size = 0
+        self.stats = {'records': 0, 'messages': 0, 'requests': 0, 'spilled': 0, 'failed': 0}
+
+    def _start(self):
+        self.compressor = zlib.compressobj()
+        self.chunks = [self.compressor.compress(b'[')]
+        self.size = len(self.chunks[0])
+        self.count = 0
+
+    def add(self, record):
+        """Add the record, return its encoded size"""
+        data = json.dumps(record).encode('utf-8')
+        if self.compressor is None:
+            self._start()
+        backup = self.compressor.copy()
+        chunk = self.compressor.compress(b',' + data if self.count else data)
+        chunk += self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        if self.count and self.size + len(chunk) > self.max_compressed:
+            # doesn't fit, close the envelope without this record
+            self.compressor = backup
+            self._finish()
+            return self.add(record)
+        self.chunks.append(chunk)
+        self.size += len(chunk)
+        self.count += 1
+        self.stats['records'] += 1
+        return len(data)
+
+    def _finish(self):
+        if self.compressor is None:
+            return
+        self.chunks.append(self.compressor.compress(b']') + self.compressor.flush())
+        compressed = b''.join(self.chunks)
+        self.compressor = None
+        self.chunks = []
+        self.size = 0
+        self.count = 0
+
+        body = make_envelope(compressed)
+        if len(body) > self.max_message_bytes:
+            if self.spill is None:
+                logger.error("Dropped result envelope of %s bytes", len(body))
+                self.stats['failed'] += 1
+                return
+            body = self.spill(compressed)
+            self.stats['spilled'] += 1
+        self._queue_message(body)
+
+    def _queue_message(self, body):
+        size = len(body.encode('utf-8'))
+        if self.pending and (
+            len(self.pending) >= SQS_BATCH_SIZE or self.pending_size + size > SQS_MAX_BYTES
+        ):
+            self._send_pending()
+        self.pending.append(body)
+        self.pending_size += size
+
+    def _send_pending(self):
+        if not self.pending:
+            return
+        entries = [
+            {'Id': str(i), 'MessageBody': body}
+            for i, body in enumerate(self.pending)
+        ]
+        self.pending = []
+        self.pending_size = 0
+        self.stats['requests'] += 1
+        try:
+            with metrics.timer('sqs_send_seconds', queue='results'):
+                resp = self.queue.send_messages(Entries=entries)
+        except Exception as e:
+            logger.exception(e)
+            failed = entries
+        else:
+            failed = [entries[int(x['Id'])] for x in resp.get('Failed', [])]
+        self.stats['messages'] += len(entries) - len(failed)
+        metrics.inc('result_messages_total', len(entries) - len(failed))
+        for entry in failed:
+            # one more chance for each of them
+            try:
+                self.queue.send_message(MessageBody=entry['MessageBody'])
+                self.stats['messages'] += 1
+            except Exception as e:
+                self.stats['failed'] += 1
+                metrics.inc('result_messages_failed_total')
+                logger.exception(e)
+
+    def flush(self):
+        """Send everything added so far"""
+        self._finish()
+        self._send_pending()
+
+
+class ResultStream(object):
+    """
+    Send records downstream in micro-batches while the domain is crawled,
+    instead of keeping all of them until the end.
+
+    A batch is sent when it has `max_records` records or `max_bytes` of
+    encoded records, or (checked by `flush_if_due`) it's older than
+    `max_seconds`. `before_flush` is called before sending, e.g. to wait
+    for the uploads the records refer to.
+    """
+
+    def __init__(self, batcher, max_records=100, max_bytes=256 * 1024, max_seconds=30,
+                 before_flush=None):
+        self.batcher = batcher
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.before_flush = before_flush
+        self.records = 0
+        self.bytes = 0
+        self.started_at = None
+
+    def add(self, record):
+        self.bytes += self.batcher.add(record)
+        self.records += 1
+        if self.started_at is None:
+            self.started_at = time.time()
+        if self.records >= self.max_records or self.bytes >= self.max_bytes:
+            self.flush()
+
+    def flush_if_due(self):
+        if self.started_at is not None and time.time() - self.started_at >= self.max_seconds:
+            self.flush()
+
+    def flush(self):
+        if not self.records:
+            return
+        if self.before_flush is not None:
+            self.before_flush()
+        # records added while the batch is sent belong to the next one
+        self.records = 0
+        self.bytes = 0
+        self.started_at = None
+        self.batcher.flush()
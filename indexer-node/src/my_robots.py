@@ -0,0 +1,156 @@
+import json
+import logging
+import time
+from collections import OrderedDict
+from urllib.robotparser import RobotFileParser
+
+import gevent
+from gevent.event import AsyncResult
+import httplib2
+
+logger = logging.getLogger(__name__)
+
+# robots.txt bigger than that is truncated (Google uses 500 KiB too)
+MAX_ROBOTS_SIZE = 500 * 1024
+
+
+class RobotsRules(object):
+    """
+    robots.txt of a single domain.
+
+    status is one of:
+     * ok - parsed robots.txt
+     * allow_all - there is no robots.txt (4xx)
+     * disallow_all - access to robots.txt is forbidden (401, 403)
+     * unreachable - it couldn't be fetched (timeout, DNS, 5xx); cached as a
+       negative entry for a shorter time, the domain shouldn't be crawled
+    """
+
+    def __init__(self, status, body=''):
+        self.status = status
+        self.body = body
+        self.parser = None
+        if status == 'ok':
+            self.parser = RobotFileParser()
+            self.parser.parse(body.splitlines())
+
+    def can_fetch(self, useragent, url):
+        if self.status == 'ok':
+            return self.parser.can_fetch(useragent, url)
+        return self.status == 'allow_all'
+
+    def delay(self, useragent='*'):
+        """Seconds between requests the website asks for, or None"""
+        if self.parser is None:
+            return None
+        delay = self.parser.crawl_delay(useragent)
+        if delay:
+            return float(delay)
+        rate = self.parser.request_rate(useragent)
+        if rate and rate.requests:
+            return float(rate.seconds) / rate.requests
+        return None
+
+    def dumps(self):
+        return json.dumps({'status': self.status, 'body': self.body})
+
+    @classmethod
+    def loads(cls, value):
+        data = json.loads(value)
+        return cls(data['status'], data['body'])
+
+
+class RobotsCache(object):
+    """
+    Parsed robots.txt files, cached in process and in the shared Redis,
+    so every domain's robots.txt is fetched once per TTL by the whole fleet.
+    Fetching is cooperative (gevent) and limited by a timeout.  Greenlets
+    asking for a domain which is being fetched wait for that fetch instead
+    of starting their own.
+    """
+
+    def __init__(self, redis_db=None, ttl=24 * 3600, negative_ttl=3600, timeout=10,
+                 user_agent=None, size=1000, prefix='robots:'):
+        self.redis_db = redis_db
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.timeout = timeout
+        self.user_agent = user_agent
+        self.size = size
+        self.prefix = prefix
+        self.local = OrderedDict()
+        # domain: AsyncResult of the lookup in progress
+        self.inflight = {}
+
+    def get(self, domain):
+        now = time.time()
+        cached = self.local.get(domain)
+        if cached and cached[0] > now:
+            return cached[1]
+
+        inflight = self.inflight.get(domain)
+        if inflight is not None:
+            return inflight.get()
+        inflight = self.inflight[domain] = AsyncResult()
+        try:
+            rules = self._get_shared(domain)
+            if rules is None:
+                rules = self.fetch(domain)
+                self._set_shared(domain, rules)
+            self._remember(domain, rules)
+        except BaseException as e:
+            inflight.set_exception(e)
+            raise
+        else:
+            inflight.set(rules)
+        finally:
+            del self.inflight[domain]
+        return rules
+
+    def _ttl(self, rules):
+        return self.negative_ttl if rules.status == 'unreachable' else self.ttl
+
+    def _remember(self, domain, rules):
+        self.local[domain] = (time.time() + self._ttl(rules), rules)
+        self.local.move_to_end(domain)
+        while len(self.local) > self.size:
+            self.local.popitem(last=False)
+
+    def _get_shared(self, domain):
+        if self.redis_db is None:
+            return None
+        try:
+            value = self.redis_db.get(self.prefix + domain)
+        except Exception as e:
+            logger.warning("Redis robots cache is unavailable: %s", e)
+            return None
+        if not value:
+            return None
+        return RobotsRules.loads(value)
+
+    def _set_shared(self, domain, rules):
+        if self.redis_db is None:
+            return
+        try:
+            self.redis_db.set(self.prefix + domain, rules.dumps(), ex=self._ttl(rules))
+        except Exception as e:
+            logger.warning("Redis robots cache is unavailable: %s", e)
+
+    def fetch(self, domain):
+        url = 'http://{}/robots.txt'.format(domain)
+        headers = {'User-Agent': self.user_agent} if self.user_agent else {}
+        try:
+            with gevent.Timeout(self.timeout):
+                resp, body = httplib2.Http(timeout=self.timeout).request(url, headers=headers)
+        except (Exception, gevent.Timeout) as e:
+            logger.error("Can't fetch %s: %r", url, e)
+            return RobotsRules('unreachable')
+
+        if resp.status in (401, 403):
+            return RobotsRules('disallow_all')
+        if 400 <= resp.status < 500:
+            return RobotsRules('allow_all')
+        if resp.status >= 500:
+            logger.error("Can't fetch %s: HTTP %s", url, resp.status)
+            return RobotsRules('unreachable')
+        return RobotsRules('ok', body[:MAX_ROBOTS_SIZE].decode('utf-8', 'replace'))
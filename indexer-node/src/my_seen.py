@@ -0,0 +1,160 @@
+import math
+
+from my_urls import url_fingerprint  # NOQA, 64-bit keys of the seen-set
+
+
+class BloomFilter(object):
+    """
+    Plain fixed-size Bloom filter over 64-bit fingerprints.
+    Bit positions are derived from the two 32-bit halves of the fingerprint
+    (Kirsch-Mitzenmacher double hashing), so no extra hashing is needed.
+    """
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(math.ceil(
+            -capacity * math.log(error_rate) / (math.log(2) ** 2)
+        )))
+        self.num_hashes = max(1, int(round(self.num_bits / capacity * math.log(2))))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, fp):
+        h1 = fp & 0xffffffff
+        h2 = (fp >> 32) | 1
+        m = self.num_bits
+        return [(h1 + i * h2) % m for i in range(self.num_hashes)]
+
+    def __contains__(self, fp):
+        bits = self.bits
+        for pos in self._positions(fp):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def add(self, fp):
+        """Set the bits for fp, return True if the fingerprint wasn't there"""
+        bits = self.bits
+        new = False
+        for pos in self._positions(fp):
+            mask = 1 << (pos & 7)
+            if not bits[pos >> 3] & mask:
+                bits[pos >> 3] |= mask
+                new = True
+        if new:
+            self.count += 1
+        return new
+
+    @property
+    def is_full(self):
+        return self.count >= self.capacity
+
+    @property
+    def memory_bytes(self):
+        return len(self.bits)
+
+
+class ScalableBloomFilter(object):
+    """
+    Bloom filter which grows when it's full instead of degrading
+    (Almeida et al., "Scalable Bloom Filters").
+
+    Every new slice is `growth` times bigger than the previous one and has
+    a tighter error rate, so the compound false positive rate never exceeds
+    `error_rate` no matter how many items are added.
+    """
+
+    def __init__(self, initial_capacity=1000, error_rate=0.001, growth=2, tightening=0.85):
+        self.initial_capacity = initial_capacity
+        self.error_rate = error_rate
+        self.growth = growth
+        self.tightening = tightening
+        self.filters = []
+        self._add_filter()
+
+    def _add_filter(self):
+        n = len(self.filters)
+        self.filters.append(BloomFilter(
+            capacity=self.initial_capacity * (self.growth ** n),
+            error_rate=self.error_rate * (1 - self.tightening) * (self.tightening ** n),
+        ))
+
+    def __contains__(self, fp):
+        # the most recent (biggest) slice is the most likely to hold it
+        for f in reversed(self.filters):
+            if fp in f:
+                return True
+        return False
+
+    def __len__(self):
+        return sum(f.count for f in self.filters)
+
+    def add(self, fp):
+        """Add the fingerprint, return False if it has been seen before"""
+        if fp in self:
+            return False
+        if self.filters[-1].is_full:
+            self._add_filter()
+        self.filters[-1].add(fp)
+        return True
+
+    @property
+    def memory_bytes(self):
+        return sum(f.memory_bytes for f in self.filters)
+
+
+class SeenUrls(object):
+    """
+    Compact set of visited urls for a single crawl.
+
+    Keeps only 64-bit fingerprints in a scalable Bloom filter, so memory
+    is a couple of bytes per url instead of the whole url string.
+    False positives mean that some url is (rarely) treated as already
+    visited and skipped, which is fine for a crawler.
+    Lookups and hits are counted to help sizing the filter.
+    """
+
+    def __init__(self, initial_capacity=1000, error_rate=0.001):
+        self.filter = ScalableBloomFilter(
+            initial_capacity=initial_capacity,
+            error_rate=error_rate,
+        )
+        self.lookups = 0
+        self.hits = 0
+
+    def __contains__(self, url):
+        self.lookups += 1
+        if url_fingerprint(url) in self.filter:
+            self.hits += 1
+            return True
+        return False
+
+    def __len__(self):
+        return len(self.filter)
+
+    def add(self, url):
+        """Add the url, return False if it has been seen before"""
+        self.lookups += 1
+        if self.filter.add(url_fingerprint(url)):
+            return True
+        self.hits += 1
+        return False
+
+    @property
+    def memory_bytes(self):
+        return self.filter.memory_bytes
+
+    @property
+    def hit_rate(self):
+        return float(self.hits) / self.lookups if self.lookups else 0.0
+
+    def stats(self):
+        return {
+            'urls': len(self),
+            'slices': len(self.filter.filters),
+            'memory_bytes': self.memory_bytes,
+            'lookups': self.lookups,
+            'hits': self.hits,
+            'hit_rate': round(self.hit_rate, 4),
+        }
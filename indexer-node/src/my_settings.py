@@ -1,5 +1,6 @@
 import os
 
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 class AttrDict(dict):
     def __init__(self, *args, **kwargs):
@@ -19,7 +20,82 @@ SYS_SETTINGS = AttrDict({
         'arn:aws:sqs:ap-southeast-2:736288480287:difchain-digitalrecords-results-localdev'
     ),
     'AWS_REGION': os.environ.get('AWS_REGION', 'ap-southeast-2'),
+
+    # single host mode: SQS, S3 and Redis are replaced by files in this directory
+    'LOCAL_DATA_DIR': os.environ.get('LOCAL_DATA_DIR', ''),
     'DOMAINS_PER_ITERATION': int(os.environ.get('DOMAINS_PER_ITERATION') or 10),
+    # domains crawled at once by one process, and fetches in flight for all of them
+    'MAX_CONCURRENT_DOMAINS': int(os.environ.get('MAX_CONCURRENT_DOMAINS') or 20),
+    'MAX_CONCURRENT_FETCHES': int(os.environ.get('MAX_CONCURRENT_FETCHES') or 50),
+    # requests in flight to a single host start at HOST_INITIAL_CONCURRENCY, grow while
+    # responses are faster than HOST_LATENCY_TARGET seconds, up to HOST_MAX_CONCURRENCY,
+    # and are halved on timeouts, connection errors, 5xx and 429.  The request rate of the
+    # host (one per 2 seconds) is scaled by the window / HOST_INITIAL_CONCURRENCY, but it's
+    # never above the robots.txt Crawl-delay
+    'HOST_INITIAL_CONCURRENCY': int(os.environ.get('HOST_INITIAL_CONCURRENCY') or 2),
+    'HOST_MAX_CONCURRENCY': int(os.environ.get('HOST_MAX_CONCURRENCY') or 4),
+    'HOST_LATENCY_TARGET': float(os.environ.get('HOST_LATENCY_TARGET') or 2.0),
+    # domains received ahead of the running crawls
+    'DOMAINS_PREFETCH': int(os.environ.get('DOMAINS_PREFETCH') or 10),
+    # the process is restarted after that many domains to release memory
+    'DOMAINS_BEFORE_RESTART': int(os.environ.get('DOMAINS_BEFORE_RESTART') or 200),
+    # domain requests are hidden from other nodes that long, and extended while crawled
+    'DOMAINS_VISIBILITY_TIMEOUT': int(os.environ.get('DOMAINS_VISIBILITY_TIMEOUT') or 300),
+    # worker processes parsing pages (0 - parse in the crawler greenlets)
+    'PARSE_PROCESSES': int(os.environ.get('PARSE_PROCESSES') or 0),
+    # pages being parsed at once, 0 - twice the number of processes
+    'PARSE_WINDOW': int(os.environ.get('PARSE_WINDOW') or 0),
+    # page fetching: read timeout, body size cap and DNS cache lifetime, seconds
+    'FETCH_TIMEOUT': int(os.environ.get('FETCH_TIMEOUT') or 20),
+    'FETCH_MAX_BYTES': int(os.environ.get('FETCH_MAX_BYTES') or 100 * 1024),
+    'DNS_CACHE_TTL': int(os.environ.get('DNS_CACHE_TTL') or 300),
+    # result envelope size limit, SQS doesn't accept messages over 256 KiB
+    'RESULTS_MAX_MESSAGE_BYTES': int(os.environ.get('RESULTS_MAX_MESSAGE_BYTES') or 250000),
+    # send results while the domain is crawled, in micro-batches limited by
+    # number of records, their encoded size and age
+    'RESULTS_STREAMING': os.environ.get('RESULTS_STREAMING', '1') == '1',
+    'RESULTS_BATCH_RECORDS': int(os.environ.get('RESULTS_BATCH_RECORDS') or 100),
+    'RESULTS_BATCH_BYTES': int(os.environ.get('RESULTS_BATCH_BYTES') or 256 * 1024),
+    'RESULTS_BATCH_SECONDS': int(os.environ.get('RESULTS_BATCH_SECONDS') or 30),
+
+    # archive mode: page bodies are appended to WARC-like segments in ARCHIVE_DIR,
+    # uploaded when they reach ARCHIVE_SEGMENT_BYTES or ARCHIVE_SEGMENT_SECONDS
+    'ARCHIVE_ENABLED': os.environ.get('ARCHIVE_ENABLED', '0') == '1',
+    'ARCHIVE_DIR': os.environ.get('ARCHIVE_DIR', 'segments'),
+    'ARCHIVE_SEGMENT_BYTES': int(os.environ.get('ARCHIVE_SEGMENT_BYTES') or 64 * 1024 * 1024),
+    'ARCHIVE_SEGMENT_SECONDS': int(os.environ.get('ARCHIVE_SEGMENT_SECONDS') or 300),
+
+    # optional, used to share the S3 key cache between nodes
+    'REDIS_CONNECTION': os.environ.get('REDIS_CONNECTION', ''),
+    'S3_UPLOAD_CONCURRENCY': int(os.environ.get('S3_UPLOAD_CONCURRENCY') or 10),
+    'S3_KEY_CACHE_SIZE': int(os.environ.get('S3_KEY_CACHE_SIZE') or 100000),
+
+    # excluded domains and urls, page limits, see my_rules.py
+    'CRAWL_RULES': os.environ.get('CRAWL_RULES', os.path.join(BASE_DIR, 'crawl_rules.txt')),
+
+    # query parameters removed from crawled urls, "prefix*" matches by prefix
+    'URL_STRIP_PARAMS': os.environ.get(
+        'URL_STRIP_PARAMS', 'utm_*,gclid,fbclid,msclkid,mc_cid,mc_eid,_ga'
+    ),
+
+    # per-crawl seen urls filter: initial size and acceptable false positive rate
+    'SEEN_URLS_CAPACITY': int(os.environ.get('SEEN_URLS_CAPACITY') or 1000),
+    'SEEN_URLS_ERROR_RATE': float(os.environ.get('SEEN_URLS_ERROR_RATE') or 0.001),
+    # pages with SimHash within that many bits of a processed one are duplicates
+    'NEAR_DUPLICATE_DISTANCE': int(os.environ.get('NEAR_DUPLICATE_DISTANCE') or 3),
+    # ETag/Last-Modified store for conditional recrawls (used when there is no Redis)
+    'VALIDATORS_DB': os.environ.get('VALIDATORS_DB', 'validators.sqlite'),
+    'VALIDATORS_TTL': int(os.environ.get('VALIDATORS_TTL') or 30 * 24 * 3600),
+    # robots.txt cache, failures are cached for ROBOTS_NEGATIVE_TTL seconds
+    'ROBOTS_TTL': int(os.environ.get('ROBOTS_TTL') or 24 * 3600),
+    'ROBOTS_NEGATIVE_TTL': int(os.environ.get('ROBOTS_NEGATIVE_TTL') or 3600),
+    'ROBOTS_TIMEOUT': int(os.environ.get('ROBOTS_TIMEOUT') or 10),
+
+    # Prometheus metrics on http://<host>:METRICS_PORT/metrics and in the log
+    # every METRICS_LOG_SECONDS (0 - don't log), nothing is collected if disabled
+    'METRICS_ENABLED': os.environ.get('METRICS_ENABLED', '0') == '1',
+    'METRICS_PORT': int(os.environ.get('METRICS_PORT') or 9100),
+    'METRICS_LOG_SECONDS': int(os.environ.get('METRICS_LOG_SECONDS') or 60),
 })
 
 
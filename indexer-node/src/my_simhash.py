@@ -0,0 +1,83 @@
+import hashlib
+import re
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+SHINGLE_SIZE = 3
+# pages with less text than that are too small to compare reliably
+MIN_WORDS = 20
+
+
+def get_features(text):
+    """Lowercased word shingles of the text"""
+    words = WORD_RE.findall(text.lower())
+    if len(words) < MIN_WORDS:
+        return []
+    return [
+        ' '.join(words[i:i + SHINGLE_SIZE])
+        for i in range(len(words) - SHINGLE_SIZE + 1)
+    ]
+
+
+def simhash(features):
+    """
+    64-bit SimHash (Charikar) of the features.
+    Bits are counted through per-byte histograms of feature hashes, so every
+    feature costs 8 additions instead of 64.
+    """
+    hist = [[0] * 256 for _ in range(8)]
+    total = 0
+    for feature in features:
+        digest = hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest()
+        for j, b in enumerate(digest):
+            hist[j][b] += 1
+        total += 1
+
+    fp = 0
+    for j in range(8):
+        for bit in range(8):
+            ones = sum(count for b, count in enumerate(hist[j]) if b >> bit & 1)
+            if ones * 2 > total:
+                fp |= 1 << (j * 8 + bit)
+    return fp
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+class SimHashIndex(object):
+    """
+    Banded index of 64-bit SimHash fingerprints.
+
+    Fingerprints are split into max_distance + 1 bands, two fingerprints
+    within max_distance bits differ in at most max_distance bands, so they
+    share at least one of them exactly and only the fingerprints from the
+    same band buckets have to be compared.
+    """
+
+    def __init__(self, max_distance=3):
+        self.max_distance = max_distance
+        bands = max_distance + 1
+        width = 64 // bands
+        self.bands = []
+        for i in range(bands):
+            shift = i * width
+            bits = width if i < bands - 1 else 64 - shift
+            self.bands.append((shift, (1 << bits) - 1))
+        self.tables = [{} for _ in self.bands]
+
+    def _keys(self, fp):
+        for shift, mask in self.bands:
+            yield (fp >> shift) & mask
+
+    def find(self, fp):
+        """Return the value of some fingerprint close to fp or None"""
+        for table, key in zip(self.tables, self._keys(fp)):
+            for other, value in table.get(key, ()):
+                if hamming_distance(fp, other) <= self.max_distance:
+                    return value
+        return None
+
+    def add(self, fp, value):
+        for table, key in zip(self.tables, self._keys(fp)):
+            table.setdefault(key, []).append((fp, value))
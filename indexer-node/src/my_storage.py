@@ -0,0 +1,140 @@
+import logging
+from collections import OrderedDict
+
+from botocore.exceptions import ClientError
+import gevent
+from gevent import pool
+
+from my_metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class KeyCache(object):
+    """
+    Keys known to exist in the bucket.
+    Local LRU, optionally backed by Redis so all nodes share it.
+    """
+
+    def __init__(self, size=100000, redis_db=None, redis_prefix='s3:'):
+        self.size = size
+        self.redis_db = redis_db
+        self.redis_prefix = redis_prefix
+        self.local = OrderedDict()
+
+    def _remember(self, key):
+        self.local[key] = True
+        self.local.move_to_end(key)
+        while len(self.local) > self.size:
+            self.local.popitem(last=False)
+
+    def is_known_locally(self, key):
+        return key in self.local
+
+    def __contains__(self, key):
+        if key in self.local:
+            self.local.move_to_end(key)
+            return True
+        if self.redis_db is not None:
+            try:
+                if self.redis_db.exists(self.redis_prefix + key):
+                    self._remember(key)
+                    return True
+            except Exception as e:
+                logger.warning("Redis key cache is unavailable: %s", e)
+        return False
+
+    def add(self, key):
+        self._remember(key)
+        if self.redis_db is not None:
+            try:
+                self.redis_db.set(self.redis_prefix + key, 1)
+            except Exception as e:
+                logger.warning("Redis key cache is unavailable: %s", e)
+
+
+class S3Uploader(object):
+    """
+    Upload content-addressed objects on a bounded pool of greenlets.
+
+    Keys are content hashes, so an existing key never has to be uploaded
+    again: it's skipped if it's in the key cache or HEAD finds it in the
+    bucket, and the same key requested twice in a run is uploaded once.
+    `upload` blocks when the pool is busy, which slows down the caller
+    (and the crawl behind it) until uploads catch up.  It returns the
+    greenlet which uploads the key (None if the key is known to exist), so
+    callers can wait for their uploads: its value is False if the object
+    isn't uploaded after `retries` attempts.
+    """
+
+    def __init__(self, s3_client, bucket, concurrency=10, key_cache=None, retries=3):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.retries = retries
+        self.pool = pool.Pool(concurrency)
+        self.key_cache = key_cache if key_cache is not None else KeyCache()
+        self.inflight = {}
+        self.stats = {
+            'uploaded': 0,
+            'exists': 0,
+            'coalesced': 0,
+            'failed': 0,
+        }
+
+    def upload(self, key, body):
+        if isinstance(key, bytes):
+            key = key.decode('ascii')
+        self.pool.wait_available()
+        if key in self.inflight or self.key_cache.is_known_locally(key):
+            self.stats['coalesced'] += 1
+            metrics.inc('s3_objects_total', result='coalesced')
+            return self.inflight.get(key)
+        greenlet = self.inflight[key] = self.pool.spawn(self._upload, key, body)
+        return greenlet
+
+    def _upload(self, key, body):
+        try:
+            for attempt in range(1, self.retries + 1):
+                try:
+                    if key in self.key_cache or self._exists(key):
+                        self.stats['exists'] += 1
+                        metrics.inc('s3_objects_total', result='exists')
+                    else:
+                        with metrics.timer('s3_seconds', op='put'):
+                            self.s3_client.put_object(
+                                ACL='private',  # 'public-read'
+                                Body=body,
+                                Bucket=self.bucket,
+                                ContentLength=len(body),
+                                Key=key,
+                            )
+                        self.stats['uploaded'] += 1
+                        metrics.inc('s3_objects_total', result='uploaded')
+                except Exception as e:
+                    logger.warning("Upload of %s failed (attempt %s): %s", key, attempt, e)
+                    if attempt < self.retries:
+                        gevent.sleep(2 ** attempt)
+                    continue
+                self.key_cache.add(key)
+                return True
+            self.stats['failed'] += 1
+            metrics.inc('s3_objects_total', result='failed')
+            logger.error("Upload of %s failed", key)
+            return False
+        finally:
+            self.inflight.pop(key, None)
+
+    def _exists(self, key):
+        try:
+            with metrics.timer('s3_seconds', op='head'):
+                self.s3_client.head_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+        return True
+
+    def join(self):
+        """Wait for all pending uploads"""
+        self.pool.join()
+        logger.info("S3 uploads: %s", self.stats)
@@ -0,0 +1,144 @@
+"""
+URL canonicalization and fingerprints.
+
+Links are resolved against the page URL (RFC 3986, so "..", "./" and
+relative paths work) and normalized, so different spellings of the same
+page are crawled once:
+ * scheme and host are lowercased, the host is IDNA-encoded and loses its
+   trailing dot, default ports are dropped
+ * dot segments are removed from the path, empty path becomes "/"
+ * percent-escapes are uppercased, escaped unreserved characters are
+   decoded, unsafe characters are escaped
+ * query parameters are sorted by name (repeated ones keep their order),
+   tracking ones can be stripped
+ * the fragment is dropped
+
+    strip = compile_params('utm_*,gclid')
+    canonicalize('../b/?utm_source=x&z=1&a=2#top', base='http://Example.com:80/a/c',
+                 strip_params=strip)
+    # 'http://example.com/b/?a=2&z=1'
+
+`url_fingerprint()` is a stable 64-bit hash of the canonical URL (scheme
+and trailing slash of the path ignored, http and https are the same page),
+used as the seen-set and storage key. The URL itself is fetched as it is.
+"""
+import hashlib
+import re
+import struct
+from urllib.parse import quote, urljoin, urlsplit, urlunsplit
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+DEFAULT_STRIP_PARAMS = 'utm_*,gclid,fbclid,msclkid,mc_cid,mc_eid,_ga'
+
+UNRESERVED = frozenset('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-._~')
+ESCAPE_RE = re.compile('%([0-9A-Fa-f]{2})')
+# characters kept as they are, everything else is percent-encoded
+PATH_SAFE = "/%:@!$&'()*+,;=~"
+QUERY_SAFE = "/?%:@!$&'()*+,;=~"
+
+
+def compile_params(value):
+    """
+    Function telling if a query parameter should be stripped, from a comma
+    separated list of names, "name*" matches the prefix
+    """
+    names = set()
+    prefixes = []
+    for name in value.split(','):
+        name = name.strip().lower()
+        if name.endswith('*'):
+            prefixes.append(name[:-1])
+        elif name:
+            names.add(name)
+    prefixes = tuple(prefixes)
+
+    def is_stripped(param):
+        param = param.lower()
+        return param in names or bool(prefixes and param.startswith(prefixes))
+    return is_stripped
+
+
+def normalize_escapes(value, safe):
+    def replace(match):
+        char = chr(int(match.group(1), 16))
+        return char if char in UNRESERVED else '%' + match.group(1).upper()
+    return quote(ESCAPE_RE.sub(replace, value), safe=safe)
+
+
+def remove_dot_segments(path):
+    output = []
+    for segment in path.split('/'):
+        if segment == '..':
+            if len(output) > 1:
+                output.pop()
+        elif segment != '.':
+            output.append(segment)
+    if path.endswith(('/.', '/..')):
+        output.append('')
+    return '/'.join(output)
+
+
+def normalize_host(host):
+    host = host.lower().rstrip('.')
+    if host.startswith('['):
+        return host
+    try:
+        return host.encode('idna').decode('ascii')
+    except UnicodeError:
+        return host
+
+
+def canonicalize(url, base=None, strip_params=None):
+    """
+    Canonical absolute form of the url, None if it's not a http(s) url.
+    `strip_params` is a function from `compile_params()`.
+    """
+    url = url.strip()
+    if base:
+        url = urljoin(base, url)
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        # invalid port or IPv6 address
+        return None
+    scheme = parts.scheme.lower()
+    if scheme not in DEFAULT_PORTS or not parts.hostname:
+        return None
+
+    netloc = normalize_host(parts.hostname)
+    if ':' in netloc:
+        netloc = '[{}]'.format(netloc.strip('[]'))
+    if port and port != DEFAULT_PORTS[scheme]:
+        netloc = '{}:{}'.format(netloc, port)
+    if parts.username:
+        userinfo = parts.username + (':' + parts.password if parts.password else '')
+        netloc = '{}@{}'.format(userinfo, netloc)
+
+    path = normalize_escapes(remove_dot_segments(parts.path), PATH_SAFE) or '/'
+
+    params = [param for param in parts.query.split('&') if param]
+    if strip_params is not None:
+        params = [param for param in params if not strip_params(param.split('=', 1)[0])]
+    params = [normalize_escapes(param, QUERY_SAFE) for param in params]
+    query = '&'.join(sorted(params, key=lambda param: param.split('=', 1)[0]))
+
+    return urlunsplit((scheme, netloc, path, query, ''))
+
+
+def url_key(url):
+    """
+    Canonical url without the scheme, trailing slash ignored: "/about" and
+    "/about/", http:// and https:// are the same page
+    """
+    url = canonicalize(url) or url
+    _, netloc, path, query, _ = urlsplit(url)
+    if len(path) > 1 and path.endswith('/'):
+        path = path[:-1]
+    return urlunsplit(('', netloc, path, query, ''))
+
+
+def url_fingerprint(url):
+    """Stable 64-bit fingerprint of the canonical url"""
+    digest = hashlib.blake2b(url_key(url).encode('utf-8'), digest_size=8).digest()
+    return struct.unpack('<Q', digest)[0]
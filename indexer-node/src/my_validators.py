@@ -0,0 +1,85 @@
+import json
+import logging
+import sqlite3
+import time
+
+from my_urls import url_fingerprint
+
+logger = logging.getLogger(__name__)
+
+
+def get_key(url):
+    """Store key of the url, the fingerprint of its canonical form"""
+    return '{:016x}'.format(url_fingerprint(url))
+
+
+class SqliteValidatorStore(object):
+    """
+    ETag and Last-Modified of crawled pages (plus the list of links found on
+    them) in a local SQLite file, so recrawls can use conditional requests.
+    """
+
+    def __init__(self, path, ttl=None):
+        self.ttl = ttl
+        self.db = sqlite3.connect(path, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=OFF')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS validators '
+            '(url TEXT PRIMARY KEY, value TEXT, updated_at REAL)'
+        )
+
+    def get(self, url):
+        row = self.db.execute(
+            'SELECT value, updated_at FROM validators WHERE url = ?', (get_key(url),)
+        ).fetchone()
+        if not row:
+            return None
+        if self.ttl and row[1] < time.time() - self.ttl:
+            return None
+        return json.loads(row[0])
+
+    def set(self, url, etag=None, last_modified=None, links=None):
+        self.db.execute(
+            'INSERT OR REPLACE INTO validators (url, value, updated_at) VALUES (?, ?, ?)',
+            (get_key(url), json.dumps(make_value(etag, last_modified, links)), time.time())
+        )
+
+
+class RedisValidatorStore(object):
+    """
+    The same as SqliteValidatorStore, but shared by all nodes through Redis
+    """
+
+    def __init__(self, redis_db, ttl=None, prefix='validators:'):
+        self.redis_db = redis_db
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, url):
+        try:
+            value = self.redis_db.get(self.prefix + get_key(url))
+        except Exception as e:
+            logger.warning("Redis validators store is unavailable: %s", e)
+            return None
+        if not value:
+            return None
+        return json.loads(value)
+
+    def set(self, url, etag=None, last_modified=None, links=None):
+        try:
+            self.redis_db.set(
+                self.prefix + get_key(url),
+                json.dumps(make_value(etag, last_modified, links)),
+                ex=self.ttl
+            )
+        except Exception as e:
+            logger.warning("Redis validators store is unavailable: %s", e)
+
+
+def make_value(etag, last_modified, links):
+    return {
+        'etag': etag,
+        'last_modified': last_modified,
+        'links': links or [],
+    }
@@ -3,12 +3,18 @@ import random
 
 BASE_DIR = os.path.dirname(__file__)
 
-firstnames = open('{}/firstname.txt'.format(BASE_DIR), 'r').read().splitlines()
-lastnames = open('{}/lastname.txt'.format(BASE_DIR), 'r').read().splitlines()
+# name lists are read when the first name is generated, not at import
+names = {}
+
+
+def get_names(kind):
+    if kind not in names:
+        names[kind] = open('{}/{}.txt'.format(BASE_DIR, kind), 'r').read().splitlines()
+    return names[kind]
 
 
 def get_random_name():
     return "{} {}".format(
-        random.choice(firstnames).capitalize(),
-        random.choice(lastnames).capitalize(),
+        random.choice(get_names('firstname')).capitalize(),
+        random.choice(get_names('lastname')).capitalize(),
     )
@@ -1,75 +1,152 @@
 #!/usr/bin/env python
-import json
+import collections
 import pprint
+import time
 import traceback
-import random
+import uuid
 import sys
-import signal
 import logging
-import httplib2
-from contextlib import contextmanager
-from urllib.parse import urlparse
-from urllib.robotparser import RobotFileParser
+from urllib.parse import urljoin, urlsplit
 
 import gevent
-from gevent import monkey, queue, event, pool, sleep
+from gevent import monkey, queue, event, pool, lock
 monkey.patch_all()  # NOQA
 
+from my_lazy import Lazy, startup_report, track_imports, warm_up  # NOQA
+if '--startup-time' in sys.argv:
+    track_imports()
+
 import boto3
-from bs4 import BeautifulSoup
+import redis
 from my_settings import SYS_SETTINGS
-from my_parser import WebsiteParser
+from my_archive import SegmentWriter
+from my_envelope import make_pointer
+from my_fetch import FetchEngine
+from my_local import LocalQueues, LocalRedis, LocalS3
+from my_metrics import metrics
+from my_parse_pool import ParsePool
+from my_parser import get_duplicate_result, get_unchanged_result
+from my_politeness import HostBuckets, HostWindows
+from my_results import ResultBatcher, ResultStream
+from my_robots import RobotsCache
+from my_rules import CrawlRules
+from my_seen import SeenUrls
+from my_simhash import SimHashIndex
+from my_storage import KeyCache, S3Uploader
+from my_urls import canonicalize, compile_params
+from my_validators import RedisValidatorStore, SqliteValidatorStore
 
 
 MAX_ERRORS_NUMBER = 10
-extensions_blacklist = ('.gif', '.jpeg', '.png', '.docx', '.zip', '.tar', '.svg', '.exe')
+crawl_rules = CrawlRules.from_file(SYS_SETTINGS.CRAWL_RULES)
+strip_params = compile_params(SYS_SETTINGS.URL_STRIP_PARAMS)
 
 
-class TimeoutException(Exception):
-    pass
+logger = logging.getLogger(__name__)
 
 
-@contextmanager
-def time_limit(seconds):
-    def signal_handler(signum, frame):
-        raise TimeoutException("Timed out!")
-    signal.signal(signal.SIGALRM, signal_handler)
-    signal.alarm(seconds)
-    try:
-        yield
-    finally:
-        signal.alarm(0)
+def get_s3_client():
+    if SYS_SETTINGS.LOCAL_DATA_DIR:
+        return LocalS3(SYS_SETTINGS.LOCAL_DATA_DIR)
+    return boto3.client('s3', region_name=SYS_SETTINGS.AWS_REGION)
 
 
-logger = logging.getLogger(__name__)
-s3_client = boto3.client('s3', region_name=SYS_SETTINGS.AWS_REGION)
-sqs_resource = boto3.resource('sqs', region_name=SYS_SETTINGS.AWS_REGION)
+def get_sqs_resource():
+    if SYS_SETTINGS.LOCAL_DATA_DIR:
+        return LocalQueues(SYS_SETTINGS.LOCAL_DATA_DIR)
+    return boto3.resource('sqs', region_name=SYS_SETTINGS.AWS_REGION)
 
-requests_queue = sqs_resource.get_queue_by_name(
-    QueueName=SYS_SETTINGS.QUEUE_REQUESTS.split(':')[-1],
-    QueueOwnerAWSAccountId=SYS_SETTINGS.QUEUE_REQUESTS.split(':')[-2]
-)
-results_queue = sqs_resource.get_queue_by_name(
-    QueueName=SYS_SETTINGS.QUEUE_RESULTS.split(':')[-1],
-    QueueOwnerAWSAccountId=SYS_SETTINGS.QUEUE_RESULTS.split(':')[-2]
+
+def get_queue(arn):
+    return sqs_resource.get_queue_by_name(
+        QueueName=arn.split(':')[-1],
+        QueueOwnerAWSAccountId=arn.split(':')[-2]
+    )
+
+
+# AWS clients and queues are created when they are used first time, so
+# restarted workers don't wait for them before they have anything to do
+s3_client = Lazy('s3_client', get_s3_client)
+sqs_resource = Lazy('sqs_resource', get_sqs_resource)
+requests_queue = Lazy('requests_queue', lambda: get_queue(SYS_SETTINGS.QUEUE_REQUESTS))
+results_queue = Lazy('results_queue', lambda: get_queue(SYS_SETTINGS.QUEUE_RESULTS))
+
+
+def get_redis_db():
+    if not SYS_SETTINGS.REDIS_CONNECTION:
+        # indexers of the host still share robots, validators and S3 keys
+        return LocalRedis(SYS_SETTINGS.LOCAL_DATA_DIR) if SYS_SETTINGS.LOCAL_DATA_DIR else None
+    return redis.StrictRedis.from_url(SYS_SETTINGS.REDIS_CONNECTION)
+
+
+redis_db = get_redis_db()
+
+s3_uploader = S3Uploader(
+    s3_client,
+    SYS_SETTINGS.STORAGE_BUCKET,
+    concurrency=SYS_SETTINGS.S3_UPLOAD_CONCURRENCY,
+    key_cache=KeyCache(size=SYS_SETTINGS.S3_KEY_CACHE_SIZE, redis_db=redis_db),
 )
 
+# page bodies go to WARC-like segments instead of an object per page
+if SYS_SETTINGS.ARCHIVE_ENABLED:
+    archive = SegmentWriter(
+        s3_client,
+        SYS_SETTINGS.STORAGE_BUCKET,
+        SYS_SETTINGS.ARCHIVE_DIR,
+        prefix=SYS_SETTINGS.STORAGE_BUCKET_PREFIX,
+        max_bytes=SYS_SETTINGS.ARCHIVE_SEGMENT_BYTES,
+        max_seconds=SYS_SETTINGS.ARCHIVE_SEGMENT_SECONDS,
+    )
+else:
+    archive = None
+
+
+def get_validator_store():
+    # ETag/Last-Modified of crawled pages, shared by the fleet if Redis is configured
+    if redis_db is not None:
+        return RedisValidatorStore(redis_db, ttl=SYS_SETTINGS.VALIDATORS_TTL)
+    return SqliteValidatorStore(SYS_SETTINGS.VALIDATORS_DB, ttl=SYS_SETTINGS.VALIDATORS_TTL)
+
+
+validator_store = Lazy('validator_store', get_validator_store)
+
 
 def save_s3_file(filename, body):
-    # use SYS_SETTINGS to get the bucket and the prefix
-    s3_client.put_object(
-        ACL='private',  # 'public-read'
-        Body=body,
-        Bucket=SYS_SETTINGS.STORAGE_BUCKET,
-        ContentEncoding='utf-8',
-        ContentLength=len(body),
-        Key=filename,
-    )
+    # uploaded in background, unless the object is already there
+    return s3_uploader.upload(filename, body)
+
+
+# fetches in flight across all domains crawled by this process
+fetch_slots = lock.BoundedSemaphore(SYS_SETTINGS.MAX_CONCURRENT_FETCHES)
+
+fetch_engine = FetchEngine(
+    timeout=SYS_SETTINGS.FETCH_TIMEOUT,
+    max_bytes=SYS_SETTINGS.FETCH_MAX_BYTES,
+    dns_ttl=SYS_SETTINGS.DNS_CACHE_TTL,
+)
+
+
+# pages parsed in worker processes, if PARSE_PROCESSES is set; they are
+# forked when the first page is parsed
+parse_pool = Lazy('parse_pool', lambda: ParsePool(
+    processes=SYS_SETTINGS.PARSE_PROCESSES,
+    window=SYS_SETTINGS.PARSE_WINDOW or None,
+))
 
 
 def ua(): return "Mozilla/5.0 (X11; Fedora; Linux x86_64; rv:54.0) Gecko/20100101 Firefox/54.0"
 
 
+robots_cache = RobotsCache(
+    redis_db=redis_db,
+    ttl=SYS_SETTINGS.ROBOTS_TTL,
+    negative_ttl=SYS_SETTINGS.ROBOTS_NEGATIVE_TTL,
+    timeout=SYS_SETTINGS.ROBOTS_TIMEOUT,
+    user_agent=ua(),
+)
+
+
 class Job(object):
     """Encapsulation of a job to put in the job queue.  Contains at least
     a URL, but can also have custom headers or entirely custom meta
@@ -88,6 +165,22 @@ class Job(object):
         self.headers.update(headers or {})
         self.headers['User-Agent'] = ua()
         self.meta = meta
+        self.validators = None
+
+    def add_validators(self, validators):
+        """Make the request conditional, using validators from the previous visit"""
+        if not validators:
+            return
+        self.validators = validators
+        if validators.get('etag'):
+            self.headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            self.headers['If-Modified-Since'] = validators['last_modified']
+
+    @property
+    def not_modified(self):
+        response = getattr(self, 'response', None)
+        return response is not None and response.status == 304
 
     def __hash__(self):
         return hash(self.url)
@@ -108,22 +201,61 @@ class Crawler(object):
     """Simple crawler based on gcrawler, but with a rolling inq that can be
     added to.  The crawler is done when the workers have no more jobs and
     there are no more urls in the queue."""
-    seen_jobs = set()
 
-    def __init__(self, spider, timeout=2, worker_count=4, pipeline_size=100):
+    def __init__(self, spider, timeout=2, worker_count=None, pipeline_size=100, validators=None,
+                 fetch_slots=None, fetcher=None, parser=None):
+        # the politeness ceiling, no host gets more requests at once
+        worker_count = worker_count or SYS_SETTINGS.HOST_MAX_CONCURRENCY
         self.spider = spider
         self.spider.crawler = self
+        # keep-alive connections are reused by all the workers
+        self.fetcher = fetcher or FetchEngine()
+        # parse stage, shared by crawlers running in the same process
+        self.parser = parser or ParsePool()
+        self.parsing = pool.Group()
+        self.validators = validators
+        # semaphore shared by crawlers running in the same process
+        self.fetch_slots = fetch_slots
+        # urls already queued during this crawl, shared with the spider
+        self.seen_jobs = SeenUrls(
+            initial_capacity=SYS_SETTINGS.SEEN_URLS_CAPACITY,
+            error_rate=SYS_SETTINGS.SEEN_URLS_ERROR_RATE,
+        )
         self.timeout = timeout
         self.count = worker_count
         self.inq = queue.Queue(0)
         self.outq = queue.Queue(pipeline_size)
         self.jobq = queue.Queue()
         self.pool = pool.Pool(worker_count)
+        # set when a worker or the pipeline finishes a job or a new job is added
         self.worker_finished = event.Event()
+        # jobs fetched but not post-processed yet, they can add new jobs
+        self.pending = 0
+        # politeness: jobs wait in their host's queue for a token of its
+        # bucket and room in its window of requests in flight (adapted to
+        # the host's latency and errors, it scales the bucket's rate too)
+        self.buckets = HostBuckets(self.host_delay)
+        self.windows = HostWindows(
+            initial=SYS_SETTINGS.HOST_INITIAL_CONCURRENCY,
+            ceiling=worker_count,
+            latency_target=SYS_SETTINGS.HOST_LATENCY_TARGET,
+        )
+        self.host_jobs = collections.OrderedDict()
 
         for job in getattr(self.spider, 'jobs', []):
             self.add_job(job)
 
+    def host_delay(self, host):
+        """
+        Seconds between requests to the host: the spider's delay divided by
+        the scale of the host's window, but never shorter than the delay
+        the host asks for in its robots.txt
+        """
+        delay = self.spider.sleep_seconds / self.windows.scale(host)
+        if getattr(self.spider, 'robots_delay', None):
+            delay = max(delay, self.spider.sleep_seconds)
+        return delay
+
     def start(self):
         """Start the crawler.  Starts the scheduler and pipeline first, then
         adds jobs to the pool and waits for the scheduler and pipeline to
@@ -143,43 +275,91 @@ class Crawler(object):
         if isinstance(job, str):
             job = Job(job, **kwargs)
         # do not visit previously viewed urls
-        if job in self.seen_jobs:
-            return
+        if not self.seen_jobs.add(job.url):
+            return False
+        self.put_job(job)
+        return True
+
+    def put_job(self, job):
+        """Queue the job, its url is already added to `seen_jobs`"""
         self.jobq.put(job)
+        self.worker_finished.set()
+
+    def next_job(self):
+        """Return (job, None) for a job which host has a token and room in
+        its concurrency window now, or (None, seconds until some host has a
+        token; None if all of them wait for their windows).  New jobs are
+        moved from the job queue to the FIFO queues of their hosts, there
+        are only a few hosts per crawl.  The token isn't taken here, see
+        `scheduler`."""
+        while True:
+            try:
+                job = self.jobq.get_nowait()
+            except queue.Empty:
+                break
+            self.host_jobs.setdefault(urlsplit(job.url).netloc, collections.deque()).append(job)
+        now = time.time()
+        timeout = None
+        for host, jobs in list(self.host_jobs.items()):
+            if not jobs:
+                del self.host_jobs[host]
+                continue
+            if not self.windows.available(jobs[0].url):
+                continue
+            wait = self.buckets.wait(jobs[0].url, now)
+            if not wait:
+                return jobs.popleft(), None
+            timeout = wait if timeout is None else min(timeout, wait)
+        return None, timeout
+
+    def has_jobs(self):
+        return not self.jobq.empty() or any(self.host_jobs.values())
+
+    def is_idle(self):
+        return self.pool.free_count() == self.pool.size and not self.pending
 
     def scheduler(self):
-        """A simple job scheduler.  Presuming it's started after there is at
-        least one job, it feeds jobs to the job queue to a synchronous worker
-        job queue one at a time.  When the worker queue fills up, the
-        scheduler will block on the put() operation.  When job queue is empty,
-        the scheduler will wait for the workers to finish.  If the job queue
-        is empty and no workers are active, the pool's stopped."""
+        """Job scheduler with per-host politeness.  A job is given to the
+        worker pool only when its host's token bucket allows the request,
+        so workers never sleep while holding a pool slot.  When the pool
+        is full, the scheduler blocks on spawn().  When there are no jobs
+        ready, the scheduler waits for the workers, the pipeline or the
+        next token.  If there are no jobs at all and nothing is being
+        fetched or processed, the pool's stopped."""
         logger = logging.getLogger(__name__ + '.scheduler')
         while True:
             # join dead greenlets
             for greenlet in list(self.pool):
                 if greenlet.dead:
                     self.pool.discard(greenlet)
-            try:
-                logger.debug("Fetching job from job queue.")
-                job = self.jobq.get_nowait()
-            except queue.Empty:
-                logger.debug("No jobs remaining.")
-                if self.pool.free_count() != self.pool.size:
-                    logger.debug("%d workers remaining, waiting..." % (self.pool.size - self.pool.free_count()))
-                    self.worker_finished.wait()
-                    self.worker_finished.clear()
-                    continue
-                else:
-                    logger.debug("No workers left, shutting down.")
-                    return self.shutdown()
-            self.pool.spawn(self.worker, job)
+            job, timeout = self.next_job()
+            if job is not None:
+                # waiting for the global slot in order with other crawlers
+                # keeps domains crawled by the same process fair
+                self.pool.wait_available()
+                if self.fetch_slots is not None:
+                    self.fetch_slots.acquire()
+                # the token is taken when the request is sent, only this
+                # greenlet takes them, so it's still there after the wait
+                self.buckets.take(job.url)
+                self.windows.acquire(job.url)
+                self.pool.spawn(self.worker, job)
+                continue
+            if timeout is None and self.is_idle() and not self.has_jobs():
+                logger.debug("No workers left, shutting down.")
+                return self.shutdown()
+            logger.debug("%d workers remaining, waiting..." % (self.pool.size - self.pool.free_count()))
+            self.worker_finished.wait(timeout)
+            self.worker_finished.clear()
 
     def shutdown(self):
         """Shutdown the crawler after the pool has finished."""
         self.pool.join()
         self.outq.put(StopIteration)
         self.pipeline_greenlet.join()
+        self.windows.close()
+        logger.info("Seen urls for %s: %s", self.spider.domain_name, self.seen_jobs.stats())
+        logger.info("Fetch stats: %s", self.fetcher.get_stats())
         return True
 
     def worker(self, job, logger=logging.getLogger(__name__ + '.worker')):
@@ -190,42 +370,82 @@ class Crawler(object):
         is its opportunity to add urls to the job queue.  Heavy processing
         should be done via the pipeline in postprocess."""
         logger.debug("starting: %r" % job)
-        # you need to create a new Http instance per greenlet, see ticket:
-        #   http://code.google.com/p/httplib2/issues/detail?id=5
-        h = httplib2.Http()
+        latency = None
+        failed = False
         try:
-            sleep(self.spider.sleep_seconds + random.randint(1, 3))
-            job.response, job.data = h.request(job.url, method=job.method, headers=job.headers)
+            if self.validators is not None:
+                job.add_validators(self.validators.get(job.url))
+            metrics.add('fetches_in_flight', 1)
+            started_at = time.time()
+            try:
+                with metrics.timer('fetch_seconds'):
+                    job.response, job.data = self.fetcher.request(job.url, method=job.method, headers=job.headers)
+            finally:
+                metrics.add('fetches_in_flight', -1)
+            latency = time.time() - started_at
+            metrics.inc('fetches_total', status=job.response.status)
+            # the host is overloaded or asks us to slow down
+            failed = job.response.status >= 500 or job.response.status == 429
             self.spider.preprocess(job)
         except Exception as e:
-            formatted = traceback.format_exc()
-            if 'ssl.CertificateError' in formatted or 'socket.gaierror' in formatted or 'httplib2.' in formatted:
-                self.spider.errors += 1
-            logger.error("Preprocessing error:\n%s" % formatted)
+            metrics.inc('fetch_errors_total')
+            # timeouts, connection, TLS and DNS errors
+            failed = latency is None
+            logger.error("Preprocessing error:\n%s" % traceback.format_exc())
         else:
+            self.pending += 1
             self.outq.put(job)
-            self.worker_finished.set()
             # logger.debug("finished: %r" % job)
+        finally:
+            self.windows.release(job.url, latency=latency, failed=failed)
+            if self.fetch_slots is not None:
+                self.fetch_slots.release()
+            self.worker_finished.set()
         raise gevent.GreenletExit('success')
 
     def pipeline(self):
         """A post-processing pipeline greenlet which keeps post-processing from
         interfering with network wait parallelization of the worker pool."""
         logger = logging.getLogger(__name__ + '.pipeline')
-        for job in self.outq:
+        while True:
             try:
-                self.spider.postprocess(job)
-            except:
-                logger.error("error:\n%s" % traceback.format_exc())
+                job = self.outq.get(timeout=1)
+            except queue.Empty:
+                # let the spider send results which waited for too long
+                self.spider.flush_results()
+                continue
+            if job is StopIteration:
+                break
+            if self.parser.enabled:
+                # blocks while the parse window is full
+                self.parsing.add(self.parser.spawn(self.postprocess, job))
+            else:
+                self.postprocess(job)
+            self.spider.flush_results()
+        self.parsing.join()
+        self.spider.flush_results(final=True)
         logger.debug("finished processing.")
 
+    def postprocess(self, job, logger=logging.getLogger(__name__ + '.pipeline')):
+        try:
+            self.spider.postprocess(job)
+        except:
+            logger.error("error:\n%s" % traceback.format_exc())
+        finally:
+            self.pending -= 1
+            self.worker_finished.set()
+
 
 def run(spider, **kwargs):
+    kwargs.setdefault('validators', validator_store)
+    kwargs.setdefault('fetch_slots', fetch_slots)
+    kwargs.setdefault('fetcher', fetch_engine)
+    kwargs.setdefault('parser', parse_pool)
     Crawler(spider, **kwargs).start()
 
 
 class MySpider(object):
-    def __init__(self, domain_name):
+    def __init__(self, domain_name, result_stream=None):
         self.domain_name = domain_name
         self.pure_domain = domain_name[len('www.'):] if domain_name.startswith('www.') else domain_name
         self.www_domain = 'www.' + domain_name if not domain_name.startswith('www.') else domain_name
@@ -234,35 +454,37 @@ class MySpider(object):
         if self.www_domain.endswith('/'):
             self.www_domain = self.www_domain[:-1]
         self.first_url = "http://" + domain_name
-        self.urls = set()
-        self.urls.add(self.first_url)
+        # start urls only, visited urls are tracked by the crawler
+        self.urls = [self.first_url]
+        # results are either sent downstream as they are produced or collected
+        self.result_stream = result_stream
         self.results = []
-        self.errors = 0
-
-        # fetch robots.txt file and parse it
-        self.robots = None
+        self.results_count = 0
+        self.uploads = []
+        # near-duplicate pages of this domain, url: url of the original page
+        self.fingerprints = SimHashIndex(max_distance=SYS_SETTINGS.NEAR_DUPLICATE_DISTANCE)
+        self.max_pages = crawl_rules.max_pages(self.pure_domain)
+        # seconds between requests, the robots.txt one is a lower bound
         self.sleep_seconds = 2
+        self.robots_delay = None
 
-        try:
-            with time_limit(10):
-                self.robots = RobotFileParser(
-                    'http://' + self.domain_name + '/robots.txt'
-                )
-                self.robots.read()
-        except TimeoutException:
-            logger.error("Timeout fetching the robots.txt file, ignoring the website")
-            exit(10)
-        except Exception as e:
-            # logger.exception(e)
-            logger.error("Corrupted robots.txt file")
+        if crawl_rules.is_excluded_domain(self.pure_domain):
+            logger.warning("%s is excluded by the crawl rules, ignoring the website", domain_name)
+            self.urls = []
+            self.robots = None
+            return
+
+        # get robots.txt rules, fetched or cached
+        self.robots = robots_cache.get(self.domain_name)
+
+        if self.robots.status == 'unreachable':
+            logger.error("Can't fetch the robots.txt file, ignoring the website")
+            self.urls = []
         else:
-            try:
-                if self.robots:
-                    self.rrate = self.robots.request_rate("*")
-                    if self.rrate:
-                        self.sleep_seconds = max(self.rrate.seconds or 1, 1)
-            except Exception as e:
-                pass
+            delay = self.robots.delay("*")
+            if delay:
+                self.robots_delay = delay
+                self.sleep_seconds = max(delay, 1)
 
         if self.sleep_seconds > 30:
             logger.error("too slow website (expects timeout %s), ignoring", self.sleep_seconds)
@@ -282,6 +504,10 @@ class MySpider(object):
     def postprocess(self, job):
         extra_domains = set()
         internal_links = set()
+        page_links = []
+
+        if job.not_modified:
+            return self.process_unchanged(job)
 
         if not hasattr(job, 'data') or not job.data:
             return
@@ -297,114 +523,320 @@ class MySpider(object):
 
         print("Processing {}".format(job.url))
 
-        soup = BeautifulSoup(job.data.decode('utf-8'), "lxml")
-        for link in soup.find_all('a'):
-            link = link.get('href')
-            if not link:
-                continue
-            if link.startswith('mailto') or link.startswith('tel:'):
+        # parsed in a worker process if the parse pool has them
+        with metrics.timer('parse_seconds'):
+            page = self.crawler.parser.analyse(job.url, job.data, job.response)
+        original = self.find_near_duplicate(job.url, page['fingerprint'])
+        if original is not None:
+            # not expanded and not uploaded, the index only learns what it's a copy of
+            metrics.inc('near_duplicates_total')
+            self.add_result(get_duplicate_result(job.url, original))
+            return
+
+        # links are relative to the url we were redirected to and to <base href>
+        base_url = job.response.url or job.url
+        if page.get('base_url'):
+            base_url = urljoin(base_url, page['base_url'])
+        for link in page['links']:
+            if link.startswith('#'):
                 continue
-            if link.startswith('#') or link.startswith('javascript:'):
+            # mailto:, tel:, javascript: and others are None
+            url = canonicalize(link, base=base_url, strip_params=strip_params)
+            if url is None:
                 continue
-            parsed_url = urlparse(link)
-            if self.is_domain_local(parsed_url.netloc):
+            netloc = urlsplit(url).netloc
+            if self.is_domain_local(netloc):
                 # local link
-                noslash_link = link[:-1] if link.endswith('/') else link
-                if link not in self.urls and noslash_link not in self.urls:
-                    internal_links.add(link)
-                    self.urls.add(link)
-                    self.crawl_sublink(link)
+                page_links.append(url)
+                if self.crawl_sublink(url):
+                    internal_links.add(url)
                 # else - ignore duplicate
             else:
                 # external link
-                extra_domains.add(parsed_url.netloc)
-        parser = WebsiteParser(
-            url=job.url,
-            body=job.data,
-            external_links=list(extra_domains),
-            internal_links=list(internal_links),
-            resp=job.response
-        )
-
-        # save response.body to S3
-        save_s3_file(
-            parser.get_s3_filename(),
-            parser.get_body()
-        )
+                extra_domains.add(netloc)
+        result = page['record']
+        result['external_domains'] = list(extra_domains)
+        result['links'] = list(internal_links)
+
+        if archive is not None:
+            # the body is in a segment, the record points to it and is
+            # reported when the segment is uploaded
+            result['archive'], upload = archive.append(job.url, job.response, job.data)
+            del result['s3_filename']
+            self.add_result(result, upload=upload)
+        else:
+            # save response.body to S3, the record is reported when it's there
+            self.add_result(result, upload=save_s3_file(page['s3_filename'], job.data))
+
+        etag = job.response.get('etag')
+        last_modified = job.response.get('last-modified')
+        if (etag or last_modified) and self.crawler.validators is not None:
+            self.crawler.validators.set(job.url, etag, last_modified, page_links)
+
+    def process_unchanged(self, job):
+        """
+        Page didn't change since the last visit (304): follow the links we
+        found on it then and only tell the index that it's still there
+        """
+        for link in (job.validators or {}).get('links', []):
+            self.crawl_sublink(link)
+        self.add_result(get_unchanged_result(job.url))
+
+    def add_result(self, result, upload=None):
+        """Report the record, or keep it until `upload` of its body is finished"""
+        if upload is not None:
+            self.uploads.append((upload, result))
+            return
+        self.results_count += 1
+        metrics.inc('records_total', unchanged=bool(result.get('unchanged')))
+        if self.result_stream is not None:
+            self.result_stream.add(result)
+        else:
+            self.results.append(result)
+
+    def release_results(self, wait=False):
+        """
+        Report the records whose bodies are uploaded, the ones whose upload
+        failed are dropped: they would point to a missing S3 object.
+        """
+        if wait:
+            # postprocess greenlets keep adding uploads while we wait
+            while any(not upload.ready() for upload, _ in self.uploads):
+                uploads = [upload for upload, _ in self.uploads]
+                if archive is not None:
+                    # don't wait for the current segment to fill up
+                    archive.roll_if_pending(uploads)
+                gevent.joinall(uploads)
+        ready = [(upload, result) for upload, result in self.uploads if upload.ready()]
+        if not ready:
+            return
+        self.uploads = [(upload, result) for upload, result in self.uploads if not upload.ready()]
+        for upload, result in ready:
+            if upload.value:
+                self.add_result(result)
+            else:
+                metrics.inc('records_dropped_total', reason='upload')
+                logger.error("Body of %s isn't uploaded, the record is dropped", result['identifier'])
 
-        self.results.append(parser.get_result())
+    def flush_results(self, final=False):
+        # records reference the uploaded bodies, so they aren't sent earlier
+        self.release_results(wait=final)
+        if self.result_stream is None:
+            return
+        if final:
+            self.result_stream.flush()
+        else:
+            self.result_stream.flush_if_due()
+
+    def find_near_duplicate(self, url, fp):
+        """
+        Check SimHash of the page text against already processed pages of
+        the domain, session ids, print views and sort orders shouldn't be
+        crawled twice. Return the url of the original page or None.
+        """
+        if fp is None:
+            return None
+        original = self.fingerprints.find(fp)
+        if original is not None:
+            logger.info("Ignore %s, near duplicate of %s", url, original)
+            return original
+        self.fingerprints.add(fp, url)
+        return None
 
     def crawl_sublink(self, url):
-        for blacklisted in extensions_blacklist:
-            if url.endswith(blacklisted):
-                return
-        if self.pure_domain.endswith('.gov.au'):
-            if len(self.urls) > 3000:
-                return
+        """Queue the url if it's crawlable, return False for already seen urls"""
+        url = canonicalize(url, base=self.first_url, strip_params=strip_params)
+        if url is None:
+            return False
+        seen_jobs = self.crawler.seen_jobs
+        # a single lookup, rejected urls are remembered too, so they are not checked on every page
+        if not seen_jobs.add(url):
+            return False
+        if self.can_crawl(url, len(seen_jobs) - 1):
+            self.crawler.put_job(Job(url))
+        return True
+
+    def can_crawl(self, url, urls_count):
+        # cheap checks first, excluded urls and extensions are a single regex search
+        if not crawl_rules.can_queue(url):
+            return False
+        if urls_count > self.max_pages:
+            return False
+
+        if not self.robots.can_fetch("*", url):
+            return False
+
+        failures = self.crawler.windows.failures(url)
+        if failures > MAX_ERRORS_NUMBER:
+            logger.error("Reached %s failed requests in a row for %s", failures, self.pure_domain)
+            return False
+        return True
+
+
+def spill_results(compressed):
+    # the envelope is too big for SQS, save it to S3 and send the pointer
+    key = '{}results/{}.json.zlib'.format(SYS_SETTINGS.STORAGE_BUCKET_PREFIX, uuid.uuid4())
+    s3_client.put_object(
+        ACL='private',
+        Body=compressed,
+        Bucket=SYS_SETTINGS.STORAGE_BUCKET,
+        ContentLength=len(compressed),
+        Key=key,
+    )
+    return make_pointer(SYS_SETTINGS.STORAGE_BUCKET, key)
+
+
+def get_result_batcher():
+    return ResultBatcher(
+        results_queue,
+        spill=spill_results,
+        max_message_bytes=SYS_SETTINGS.RESULTS_MAX_MESSAGE_BYTES
+    )
+
+
+def send_results(spider):
+    # send SQS message about S3 saved object with the list of external links
+    # send them in bulk, packed into compressed envelopes
+    batcher = get_result_batcher()
+    for result in spider.results:
+        batcher.add(result)
+    batcher.flush()
+    logger.info("Results of %s sent: %s", spider.domain_name, batcher.stats)
+
+
+def crawl_domain(domain_name):
+    """Crawl the domain and send its results, return False if that failed"""
+    print("Going to crawl {}".format(domain_name))
+    metrics.add('crawls_active', 1)
+    try:
+        if SYS_SETTINGS.RESULTS_STREAMING:
+            spider = MySpider(domain_name, result_stream=ResultStream(
+                get_result_batcher(),
+                max_records=SYS_SETTINGS.RESULTS_BATCH_RECORDS,
+                max_bytes=SYS_SETTINGS.RESULTS_BATCH_BYTES,
+                max_seconds=SYS_SETTINGS.RESULTS_BATCH_SECONDS,
+            ))
+            run(spider)
         else:
-            # non-gov-au website
-            if len(self.urls) > 500:
-                return
+            spider = MySpider(domain_name)
+            run(spider)
+            send_results(spider)
+    except Exception as e:
+        logger.exception(e)
+        return False
+    else:
+        print("Done: {}, {} pages".format(domain_name, spider.results_count))
+        return True
+    finally:
+        metrics.add('crawls_active', -1)
+        metrics.inc('domains_total')
+
+
+class DomainRequests(object):
+    """
+    Domain requests received from the requests queue and not crawled yet.
+
+    A message is deleted only when the crawl of its domain is finished,
+    until then its visibility timeout is extended, so if the node dies the
+    domains it had are received by another one.
+    """
+
+    def __init__(self, queue, visibility_timeout=300):
+        self.queue = queue
+        self.visibility_timeout = visibility_timeout
+        self.messages = set()
+
+    def receive(self, domains, limit):
+        """Long-poll the requests queue and put up to `limit` messages to the
+        domains queue.  Put blocks when the queue is full, so only a few
+        domains are prefetched ahead of the running crawls.  StopIteration
+        is put at the end, whatever happens."""
+        received = 0
+        errors = 0
+        try:
+            while received < limit:
+                try:
+                    messages = self.queue.receive_messages(
+                        MaxNumberOfMessages=min(10, limit - received),
+                        WaitTimeSeconds=20,
+                        VisibilityTimeout=self.visibility_timeout,
+                    )
+                except Exception as e:
+                    # throttling, network errors: back off and try again
+                    errors += 1
+                    logger.warning("Receiving domains failed (%s in a row): %s", errors, e)
+                    gevent.sleep(min(60, 2 ** errors))
+                    continue
+                errors = 0
+                for msg in messages:
+                    self.messages.add(msg)
+                    domains.put(msg)
+                    received += 1
+        finally:
+            domains.put(StopIteration)
+
+    def keep_visible(self):
+        """Extend the visibility of the messages being crawled, runs forever"""
+        while True:
+            gevent.sleep(self.visibility_timeout / 3)
+            for msg in list(self.messages):
+                try:
+                    msg.change_visibility(VisibilityTimeout=self.visibility_timeout)
+                except Exception as e:
+                    logger.warning("Can't extend visibility of %s: %s", msg.body, e)
+
+    def done(self, msg):
+        self.messages.discard(msg)
+        try:
+            msg.delete()
+        except Exception as e:
+            # the domain will be crawled again after the visibility timeout
+            logger.warning("Can't delete request %s: %s", msg.body, e)
 
-        if self.robots and not self.robots.can_fetch("*", url):
-            return
 
-        if self.errors > MAX_ERRORS_NUMBER:
-            logger.error("Reached %s errors for %s", self.errors, self.pure_domain)
-            return
-        if url.startswith('//'):
-            url = 'http:' + url
-        if not url.startswith('http://') and not url.startswith('https://'):
-            if not url.startswith('/'):
-                url = '/' + url
-            new_url = self.first_url + url
-            url = new_url
-        self.crawler.add_job(url)
+def crawl_request(requests, msg):
+    try:
+        crawl_domain(msg.body)
+    finally:
+        requests.done(msg)
 
 
 if __name__ == "__main__":
     MODE = None
+    if '--startup-time' in sys.argv:
+        # import and initialization cost of every component, then exit
+        warm_up(s3_client, sqs_resource, requests_queue, results_queue, validator_store, parse_pool)
+        print(startup_report())
+        sys.exit(0)
+    if SYS_SETTINGS.METRICS_ENABLED:
+        metrics.enable(port=SYS_SETTINGS.METRICS_PORT, log_seconds=SYS_SETTINGS.METRICS_LOG_SECONDS)
     if len(sys.argv) == 2:
         MODE = 'domain'
         logger.info("Fetching domain by name...")
         domain_name = sys.argv[1]
         spider = MySpider(domain_name)
         run(spider)
+        if parse_pool.resolved:
+            parse_pool.shutdown()
+        if archive is not None:
+            archive.close()
         pprint.pprint(spider.results)
         logger.info("Domain %s fetch finished", domain_name)
     else:
         MODE = 'sqs'
 
-        before_restart = 3
-
-        while before_restart > 0:
-            # standard working cycle
-            # get up to 5 messages from the queue
-            for msg in requests_queue.receive_messages(
-                MaxNumberOfMessages=1, WaitTimeSeconds=5
-            ):
-                msg.delete()
-                domain_name = msg.body
-                print("Going to crawl {}".format(domain_name))
-                spider = MySpider(domain_name)
-                run(spider)
-                before_restart -= 1
-
-                # send SQS message about S3 saved object with the list of external links
-                # send them in bulk
-                if spider.results:
-                    rendered_results = json.dumps(spider.results)
-                    if len(rendered_results) < 1:  # 1024 * 256
-                        results_queue.send_message(
-                            MessageBody=rendered_results
-                        )
-                    else:
-                        for chunk in zip(*[iter(spider.results)]*128):
-                            # split to 2 parts, which will be fine in 99% cases
-                            try:
-                                results_queue.send_message(
-                                    MessageBody=json.dumps(list(chunk))
-                                )
-                            except Exception as e:
-                                logger.exception(e)
-                print("Done: {}, {} pages".format(domain_name, len(spider.results)))
+        # domains received from SQS but not started yet
+        domains = queue.Queue(SYS_SETTINGS.DOMAINS_PREFETCH)
+        requests = DomainRequests(requests_queue, SYS_SETTINGS.DOMAINS_VISIBILITY_TIMEOUT)
+        gevent.spawn(requests.receive, domains, SYS_SETTINGS.DOMAINS_BEFORE_RESTART)
+        heartbeat = gevent.spawn(requests.keep_visible)
+        crawls = pool.Pool(SYS_SETTINGS.MAX_CONCURRENT_DOMAINS)
+        for msg in domains:
+            crawls.spawn(crawl_request, requests, msg)
+        crawls.join()
+        heartbeat.kill()
+        if parse_pool.resolved:
+            parse_pool.shutdown()
+        s3_uploader.join()
+        if archive is not None:
+            archive.close()
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+from my_analysis import PageAnalysis
+
+PAGE = b'''<!DOCTYPE html>
+<html lang="en">
+<head>
+  <meta charset="utf-8">
+  <title>
+    Grants and funding | Department of Health
+  </title>
+  <base href="/health/">
+  <link rel="stylesheet" href="/static/site.css">
+  <style>body { color: #333; }</style>
+  <script>var links = '<a href="/from-script">no</a>';</script>
+</head>
+<body>
+  <!-- <a href="/commented-out">no</a> -->
+  <ul class="nav">
+    <li><a href="/">Home</a></li>
+    <li><a href="about.html">About us</a></li>
+    <li><a>No href</a></li>
+  </ul>
+  <h1>Grants and funding</h1>
+  <p>The department funds <a href="https://www.grants.gov.au/">community programs</a>
+     across   Australia.</p>
+  <h2>Apply for a grant</h2>
+  <p>Applications close on <b>30 June</b>.</p>
+  <table><tr><td><p>Grant round</p></td><td>2018&ndash;19</td></tr></table>
+  <form action="/search"><p>Search the site</p><input name="q"></form>
+  <p>Contact: <a href="mailto:grants@health.gov.au">grants@health.gov.au</a></p>
+  <a href="#top">Back to top</a>
+  <a href="">Empty</a>
+</body>
+</html>
+'''
+
+
+def test_links():
+    analysis = PageAnalysis(PAGE)
+    assert analysis.links == [
+        '/', 'about.html', 'https://www.grants.gov.au/', 'mailto:grants@health.gov.au', '#top',
+    ]
+    assert analysis.base_url == '/health/'
+
+
+def test_title():
+    assert PageAnalysis(PAGE).title == 'Grants and funding | Department of Health'
+    assert PageAnalysis(b'<html><body><p>No title</p></body></html>').title == ''
+    # only the first one
+    assert PageAnalysis(b'<title>One</title><title>Two</title>').title == 'One'
+
+
+def test_text():
+    analysis = PageAnalysis(PAGE)
+    # visible text only, whitespace collapsed
+    assert 'color' not in analysis.text
+    assert 'from-script' not in analysis.text
+    assert 'commented-out' not in analysis.text
+    assert analysis.text.startswith('Grants and funding | Department of Health Home About us')
+    assert 'The department funds community programs across Australia.' in analysis.text
+    assert 'Grant round 2018–19' in analysis.text
+    # lists, tables and forms aren't a part of the main text
+    assert analysis.main_text.startswith('Grants and funding | Department of Health Grants and funding')
+    assert 'About us' not in analysis.main_text
+    assert 'Grant round' not in analysis.main_text
+    assert 'Search the site' not in analysis.main_text
+    assert 'Apply for a grant Applications close on 30 June' in analysis.main_text
+
+
+def test_paragraphs_and_headings():
+    analysis = PageAnalysis(PAGE)
+    assert [' '.join(p.split()) for p in analysis.paragraphs] == [
+        'The department funds community programs across Australia.',
+        'Applications close on 30 June.',
+        'Contact: grants@health.gov.au',
+    ]
+    assert analysis.headings == ['Grants and funding', 'Apply for a grant']
+    assert sorted(analysis.get_keywords()) == ['funding']
+    # no paragraph is long enough, the longest one is used
+    assert ' '.join(analysis.get_description().split()) == (
+        'The department funds community programs across Australia.'
+    )
+
+
+def test_description():
+    long_paragraph = 'Medicare ' * 30
+    page = '<p>Short one.</p><p>{}</p><p>{}</p>'.format(long_paragraph, 'Later ' * 40)
+    assert PageAnalysis(page.encode('utf-8')).get_description() == long_paragraph
+    # no paragraphs at all
+    page = '<div>{}</div>'.format('word ' * 100)
+    assert PageAnalysis(page.encode('utf-8')).get_description() == ('word ' * 60).strip()
+
+
+def test_encodings():
+    page = u'<html><head><meta charset="windows-1252"><title>Caf\xe9</title></head>' \
+           u'<body><p>“Quoted”</p></body></html>'
+    analysis = PageAnalysis(page.encode('windows-1252'))
+    assert analysis.title == u'Caf\xe9'
+    assert analysis.paragraphs == [u'“Quoted”']
+    analysis = PageAnalysis(page.encode('utf-8'))
+    assert analysis.title == u'Caf\xe9'
+
+
+def test_broken_pages():
+    for body in (b'', b'   '):
+        analysis = PageAnalysis(body)
+        assert (analysis.links, analysis.title, analysis.text) == ([], '', '')
+    analysis = PageAnalysis(b'<p>Unclosed <a href="/a">link<p>Next <div></span>')
+    assert analysis.links == ['/a']
+    assert analysis.text == 'Unclosed link Next'
@@ -0,0 +1,120 @@
+import gzip
+import io
+import os
+
+from my_archive import SegmentWriter, parse_record, read_record
+
+
+class Response(dict):
+    status = 200
+    reason = 'OK'
+
+
+class FakeS3(object):
+    def __init__(self, fail=0):
+        self.objects = {}
+        self.fail = fail
+
+    def put_object(self, Key, Body, **kwargs):
+        if self.fail:
+            self.fail -= 1
+            raise IOError('S3 is down')
+        self.objects[Key] = Body
+
+    def get_object(self, Bucket, Key, Range):
+        first, last = Range[len('bytes='):].split('-')
+        return {'Body': io.BytesIO(self.objects[Key][int(first):int(last) + 1])}
+
+
+def make_response(content_type):
+    return Response({'content-type': content_type, 'content-encoding': 'gzip'})
+
+
+def test_pointers_read_back_single_records(tmpdir):
+    s3 = FakeS3()
+    archive = SegmentWriter(s3, 'bucket', str(tmpdir), prefix='archive/')
+    pages = [
+        ('http://example.gov.au/', b'<html>home</html>'),
+        ('http://example.gov.au/a', b'<html>' + b'a' * 10000 + b'</html>'),
+        ('http://example.gov.au/data.json', b'{"key": "value"}\r\n\r\n'),
+    ]
+    appended = [archive.append(url, make_response('text/html'), body) for url, body in pages]
+    pointers = [pointer for pointer, upload in appended]
+    assert not any(upload.ready() for pointer, upload in appended)
+    archive.close()
+    assert all(upload.value is True for pointer, upload in appended)
+
+    assert len(s3.objects) == 1
+    key = pointers[0]['segment']
+    assert key.startswith('archive/segments/') and key.endswith('.warc.gz')
+    assert all(pointer['segment'] == key for pointer in pointers)
+    assert [pointer['offset'] for pointer in pointers] == [
+        0, pointers[0]['length'], pointers[0]['length'] + pointers[1]['length'],
+    ]
+    for pointer, (url, body) in zip(pointers, pages):
+        status, headers, read_body = read_record(s3, 'bucket', pointer)
+        assert (status, read_body) == (200, body)
+        assert headers['content-type'] == 'text/html'
+        # the body is stored decoded
+        assert 'content-encoding' not in headers
+        assert headers['content-length'] == str(len(body))
+    # uploaded segments are removed
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_segment_is_a_valid_warc_gz(tmpdir):
+    s3 = FakeS3()
+    archive = SegmentWriter(s3, 'bucket', str(tmpdir))
+    archive.append('http://example.gov.au/', make_response('text/html'), b'<html>home</html>')
+    archive.append('http://example.gov.au/a', make_response('text/html'), b'<html>a</html>')
+    archive.close()
+    data = gzip.decompress(list(s3.objects.values())[0])
+    assert data.count(b'WARC/1.0\r\n') == 2
+    assert b'WARC-Target-URI: http://example.gov.au/a\r\n' in data
+    status, headers, body = parse_record(data.split(b'WARC/1.0')[1])
+    assert body == b'<html>home</html>'
+
+
+def test_segments_roll_by_size(tmpdir):
+    s3 = FakeS3()
+    archive = SegmentWriter(s3, 'bucket', str(tmpdir), max_bytes=2000)
+    pointers = [
+        archive.append('http://example.gov.au/{}'.format(i), make_response('text/plain'), os.urandom(1200))[0]
+        for i in range(5)
+    ]
+    archive.close()
+    # every segment is closed by its second record
+    segments = [pointer['segment'] for pointer in pointers]
+    assert segments[0] == segments[1] != segments[2] == segments[3] != segments[4]
+    assert sorted(s3.objects) == sorted(set(segments))
+    assert archive.stats['segments'] == 3
+
+
+def test_failed_upload_keeps_the_file(tmpdir, monkeypatch):
+    monkeypatch.setattr('gevent.sleep', lambda seconds: None)
+    s3 = FakeS3(fail=3)
+    archive = SegmentWriter(s3, 'bucket', str(tmpdir), retries=3)
+    pointer, upload = archive.append('http://example.gov.au/', make_response('text/html'), b'<html>home</html>')
+    archive.close()
+    # records pointing to it are dropped
+    assert upload.value is False
+    assert s3.objects == {}
+    assert archive.stats['failed'] == 1
+    assert len(os.listdir(str(tmpdir))) == 1
+
+
+def test_roll_if_pending(tmpdir):
+    s3 = FakeS3()
+    archive = SegmentWriter(s3, 'bucket', str(tmpdir))
+    pointer, upload = archive.append('http://example.gov.au/', make_response('text/html'), b'<html>home</html>')
+    archive.roll_if_pending([])
+    assert archive.segment is not None
+    archive.roll_if_pending([upload])
+    assert archive.segment is None
+    assert upload.get(timeout=5) is True
+    # the next records go to a new segment
+    other, _ = archive.append('http://example.gov.au/a', make_response('text/html'), b'<html>a</html>')
+    archive.roll_if_pending([upload])
+    assert archive.segment is not None
+    archive.close()
+    assert other['segment'] != pointer['segment']
@@ -0,0 +1,45 @@
+import json
+import zlib
+
+import pytest
+
+from my_envelope import (
+    FetchError, compress_records, decode_envelope, get_pointer, make_envelope, make_pointer,
+)
+
+RECORDS = [{'url': 'http://example.gov.au/', 'title': 'Example – home'}, {'url': 'http://example.gov.au/a'}]
+
+
+def test_zlib_round_trip():
+    body = make_envelope(compress_records(RECORDS))
+    assert body.startswith('v1:zlib:')
+    assert get_pointer(body) is None
+    assert decode_envelope(body) == RECORDS
+
+
+def test_pointer_round_trip():
+    objects = {('bucket', 'results/1'): compress_records(RECORDS)}
+    body = make_pointer('bucket', 'results/1')
+    assert get_pointer(body) == {'bucket': 'bucket', 'key': 'results/1', 'codec': 'zlib'}
+    assert decode_envelope(body, lambda bucket, key: objects[bucket, key]) == RECORDS
+
+
+def test_plain_json():
+    assert decode_envelope(json.dumps(RECORDS)) == RECORDS
+    assert decode_envelope(json.dumps(RECORDS[0])) == RECORDS[0]
+
+
+def test_fetch_errors_are_separate_from_broken_bodies():
+    def fetch_object(bucket, key):
+        raise IOError('timeout')
+
+    with pytest.raises(FetchError):
+        decode_envelope(make_pointer('bucket', 'results/1'), fetch_object)
+    # the object is there but it's broken
+    with pytest.raises(zlib.error):
+        decode_envelope(make_pointer('bucket', 'results/1'), lambda bucket, key: b'junk')
+    with pytest.raises(ValueError):
+        decode_envelope(make_pointer('bucket', 'results/1'))
+    with pytest.raises(ValueError):
+        decode_envelope('v2:something')
+    assert not issubclass(FetchError, ValueError)
@@ -0,0 +1,155 @@
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import pytest
+
+import my_fetch
+from my_fetch import DNSCache, FetchEngine
+from my_metrics import Metrics
+
+PAGE = b'<html><body>' + b'x' * 1000 + b'</body></html>'
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path == '/image':
+            self.respond(b'\x89PNG' * 1000, content_type='image/png')
+        elif self.path == '/big':
+            self.respond(b'x' * 5000)
+        elif self.path == '/chunked':
+            # no Content-Length, the cap is hit while reading
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for _ in range(10):
+                self.wfile.write(b'3e8\r\n' + b'x' * 1000 + b'\r\n')
+            self.wfile.write(b'0\r\n\r\n')
+        elif self.path == '/redirect':
+            self.send_response(301)
+            self.send_header('Location', '/page')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        else:
+            self.respond(PAGE)
+
+    def respond(self, body, content_type='text/html; charset=utf-8'):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    # keep-alive connections of the engines are served in parallel
+    daemon_threads = True
+
+
+class Clock(object):
+    def __init__(self, now=1000000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture(scope='module')
+def server():
+    server = Server(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield 'http://localhost:{}'.format(server.server_port)
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    metrics = Metrics()
+    metrics.enable()
+    monkeypatch.setattr(my_fetch, 'metrics', metrics)
+    engine = FetchEngine(max_bytes=2000)
+    yield engine
+    engine.manager.clear()
+
+
+def test_dns_cache(monkeypatch):
+    lookups = []
+
+    def getaddrinfo(host, *args):
+        lookups.append(host)
+        return [(None, None, None, '', ('10.0.0.{}'.format(len(lookups)), 0))]
+
+    clock = Clock()
+    monkeypatch.setattr(my_fetch.socket, 'getaddrinfo', getaddrinfo)
+    monkeypatch.setattr(my_fetch, 'time', clock)
+    cache = DNSCache(ttl=60, size=2)
+    assert cache.resolve('a.gov.au') == '10.0.0.1'
+    assert cache.resolve('a.gov.au') == '10.0.0.1'
+    # addresses aren't looked up
+    assert cache.resolve('192.168.0.1') == '192.168.0.1'
+    assert cache.resolve('::1') == '::1'
+    assert (cache.lookups, cache.hits) == (2, 1)
+    clock.now += 60
+    assert cache.resolve('a.gov.au') == '10.0.0.2'
+    # full cache is cleared
+    cache.resolve('b.gov.au')
+    cache.resolve('c.gov.au')
+    assert list(cache.cache) == ['c.gov.au']
+    assert lookups == ['a.gov.au', 'a.gov.au', 'b.gov.au', 'c.gov.au']
+
+
+def test_connections_are_reused(server, engine):
+    for _ in range(3):
+        resp, body = engine.request(server + '/page')
+        assert (resp.status, resp.aborted, body) == (200, None, PAGE)
+        assert resp['content-type'] == 'text/html; charset=utf-8'
+    stats = engine.get_stats()
+    assert (stats['requests'], stats['connections'], stats['connections_reused']) == (3, 1, 2)
+    # new connections only resolve the host
+    assert (stats['dns_lookups'], stats['dns_hits']) == (1, 0)
+    assert stats['bytes_read'] == 3 * len(PAGE)
+
+
+def test_redirects(server, engine):
+    resp, body = engine.request(server + '/redirect')
+    assert (resp.status, resp.url, body) == (200, server + '/page', PAGE)
+    assert engine.get_stats()['connections_reused'] == 1
+
+
+@pytest.mark.parametrize('path, reason, saved', [
+    ('/image', 'content-type', 4000),
+    ('/big', 'content-length', 5000),
+    ('/chunked', 'max-bytes', 0),
+])
+def test_unwanted_bodies_are_aborted(server, engine, path, reason, saved):
+    resp, body = engine.request(server + path)
+    assert (resp.status, resp.aborted, body) == (200, reason, b'')
+    stats = engine.get_stats()
+    assert (stats['aborted'], stats['bytes_saved']) == (1, saved)
+    # the rest of the body is dropped with the connection
+    resp, body = engine.request(server + '/page')
+    assert body == PAGE
+    stats = engine.get_stats()
+    assert (stats['connections'], stats['connections_reused']) == (2, 0)
+
+
+def test_stats_are_exported_to_metrics(server, engine):
+    engine.request(server + '/page')
+    engine.request(server + '/image')
+    engine.request(server + '/page')
+    counters = {name: value for (name, labels), value in my_fetch.metrics.counters.items()}
+    assert counters['fetch_requests_total'] == 3
+    assert counters['fetch_connections_total'] == 2
+    assert counters['fetch_connections_reused_total'] == 1
+    assert counters['fetch_aborted_total'] == 1
+    assert counters['fetch_bytes_saved_total'] == 4000
+    assert counters['fetch_bytes_read_total'] == 2 * len(PAGE)
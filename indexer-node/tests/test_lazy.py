@@ -0,0 +1,113 @@
+import builtins
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import pytest
+
+import my_lazy
+from my_lazy import Lazy, startup_report, timed, track_imports, warm_up
+
+
+class Resource(object):
+    def __init__(self):
+        self.name = 'resource'
+
+    def get(self):
+        return 42
+
+
+@pytest.fixture(autouse=True)
+def timings(monkeypatch):
+    timings = OrderedDict()
+    monkeypatch.setattr(my_lazy, 'timings', timings)
+    return timings
+
+
+def test_created_on_first_use(timings):
+    created = []
+
+    def factory():
+        created.append(True)
+        return Resource()
+
+    resource = Lazy('resource', factory)
+    assert not resource.resolved
+    assert repr(resource) == '<Lazy resource not created>'
+    assert created == [] and timings == {}
+    assert resource.get() == 42
+    assert resource.name == 'resource'
+    assert resource.resolved
+    assert repr(resource) == '<Lazy resource ready>'
+    assert created == [True]
+    assert list(timings) == ['resource']
+    with pytest.raises(AttributeError):
+        resource.missing
+
+
+def test_created_once_by_concurrent_threads():
+    created = []
+
+    def factory():
+        created.append(True)
+        time.sleep(0.05)
+        return Resource()
+
+    resource = Lazy('resource', factory)
+    threads = [threading.Thread(target=resource.get) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert created == [True]
+
+
+def test_failed_factory_is_tried_again():
+    results = [IOError('no network'), Resource()]
+
+    def factory():
+        result = results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    resource = Lazy('resource', factory)
+    with pytest.raises(IOError):
+        resource.get()
+    assert not resource.resolved
+    assert resource.get() == 42
+
+
+def test_warm_up(timings):
+    def fail():
+        raise IOError('no network')
+
+    ok = Lazy('ok', Resource)
+    failed = Lazy('failed', fail)
+    warm_up(ok, failed)
+    assert ok.resolved and not failed.resolved
+    assert list(timings) == ['ok', 'failed (failed: OSError)']
+
+
+def test_startup_report(timings):
+    timings['import boto3'] = 0.25
+    with timed('s3_client'):
+        pass
+    with timed('s3_client'):
+        pass
+    lines = startup_report().splitlines()
+    assert lines[0] == '    250.0 ms  import boto3'
+    assert lines[1].endswith(' ms  s3_client')
+    assert lines[2].endswith(' ms  total')
+    assert float(lines[2].split()[0]) >= 250
+
+
+def test_track_imports(monkeypatch, timings):
+    monkeypatch.setattr(builtins, '__import__', builtins.__import__)
+    monkeypatch.delitem(sys.modules, 'colorsys', raising=False)
+    track_imports()
+    import colorsys  # NOQA
+    # already imported, not counted
+    import json  # NOQA
+    assert list(timings) == ['import colorsys']
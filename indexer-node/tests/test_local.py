@@ -0,0 +1,189 @@
+import json
+import os
+import sys
+
+import pytest
+from botocore.exceptions import ClientError
+
+import my_local
+from conftest import SRC_DIR
+from my_local import LocalIndex, LocalQueues, LocalRedis, LocalS3
+
+sys.path.insert(0, os.path.join(SRC_DIR, '..', '..'))
+import run_local  # NOQA
+
+
+class Clock(object):
+    """Stands for the time module in my_local"""
+
+    def __init__(self, now=1000000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(my_local, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def data_dir(tmpdir):
+    return str(tmpdir)
+
+
+def test_queue(clock, data_dir):
+    queue = LocalQueues(data_dir, visibility_timeout=30).get_queue_by_name('requests')
+    assert queue.last_activity() is None
+    queue.send_messages(Entries=[{'Id': '0', 'MessageBody': 'a.gov.au'}, {'Id': '1', 'MessageBody': 'b.gov.au'}])
+    clock.now += 1
+    queue.send_message(MessageBody='c.gov.au')
+    assert queue.count() == 3
+    assert queue.last_activity() == clock.now
+
+    messages = queue.receive_messages(MaxNumberOfMessages=2)
+    assert [msg.body for msg in messages] == ['a.gov.au', 'b.gov.au']
+    # received messages are hidden, but still in the queue
+    assert [msg.body for msg in queue.receive_messages(MaxNumberOfMessages=10)] == ['c.gov.au']
+    assert queue.receive_messages(MaxNumberOfMessages=10) == []
+    assert queue.count() == 3
+
+    messages[0].delete()
+    messages[1].change_visibility(VisibilityTimeout=60)
+    clock.now += 30
+    # not deleted, it's received again
+    messages = queue.receive_messages(MaxNumberOfMessages=10)
+    assert [msg.body for msg in messages] == ['c.gov.au']
+    messages[0].delete()
+    clock.now += 30
+    assert [msg.body for msg in queue.receive_messages(MaxNumberOfMessages=10)] == ['b.gov.au']
+    assert queue.count() == 1
+
+    # long polling waits for the messages to appear
+    started_at = clock.now
+    assert queue.receive_messages(WaitTimeSeconds=5) == []
+    assert clock.now >= started_at + 5
+
+
+def test_queues_are_shared(data_dir):
+    LocalQueues(data_dir).get_queue_by_name('requests').send_message(MessageBody='a.gov.au')
+    other = LocalQueues(data_dir).get_queue_by_name('requests')
+    assert [msg.body for msg in other.receive_messages()] == ['a.gov.au']
+    assert LocalQueues(data_dir).get_queue_by_name('results').count() == 0
+
+
+def test_s3(data_dir):
+    s3 = LocalS3(data_dir)
+    s3.put_object(Bucket='bucket', Key='pages/abc', Body='<html></html>')
+    assert s3.head_object(Bucket='bucket', Key='pages/abc') == {'ContentLength': 13}
+    assert s3.get_object(Bucket='bucket', Key='pages/abc')['Body'].read() == b'<html></html>'
+    assert s3.get_object(Bucket='bucket', Key='pages/abc', Range='bytes=1-4')['Body'].read() == b'html'
+    with pytest.raises(ClientError):
+        s3.head_object(Bucket='bucket', Key='pages/missing')
+    with pytest.raises(ClientError):
+        s3.get_object(Bucket='bucket', Key='pages/missing')
+    with pytest.raises(ValueError):
+        s3.put_object(Bucket='bucket', Key='../other/abc', Body=b'')
+    s3.delete_object(Bucket='bucket', Key='pages/abc')
+    s3.delete_object(Bucket='bucket', Key='pages/abc')
+    assert os.listdir(os.path.join(data_dir, 's3', 'bucket', 'pages')) == []
+
+
+def test_redis(clock, data_dir):
+    redis_db = LocalRedis(data_dir)
+    assert redis_db.get('a') is None
+    assert redis_db.set('a', 'one', nx=True) is True
+    assert redis_db.set('a', 'two', nx=True) is None
+    assert redis_db.get('a') == b'one'
+    assert redis_db.exists('a') == 1
+    redis_db.set('counter', 10)
+    assert redis_db.get('counter') == b'10'
+    assert redis_db.delete('a', 'b') == 1
+    assert redis_db.exists('a') == 0
+
+    redis_db.set('temporary', 'one', ex=10)
+    clock.now += 10
+    assert redis_db.get('temporary') is None
+    # expired keys can be set again
+    assert redis_db.set('temporary', 'two', ex=10, nx=True) is True
+    assert redis_db.get('temporary') == b'two'
+
+
+def test_redis_sorted_sets(data_dir):
+    redis_db = LocalRedis(data_dir)
+    assert redis_db.zadd('due', {'a': 3, 'b': 1, 'c': 2}) == 3
+    assert redis_db.zadd('due', {'a': 0}, nx=True) == 0
+    assert redis_db.zadd('due', {'c': 5, 'd': 4}) == 1
+    assert redis_db.zcard('due') == 4
+    assert redis_db.zrangebyscore('due', '-inf', 4) == [b'b', b'a', b'd']
+    assert redis_db.zrangebyscore('due', '-inf', '+inf', start=1, num=2) == [b'a', b'd']
+    assert redis_db.zrem('due', 'a', 'x') == 1
+    assert redis_db.zrangebyscore('due', 2, 10) == [b'd', b'c']
+
+
+def test_redis_pipeline(data_dir):
+    redis_db = LocalRedis(data_dir)
+    pipe = redis_db.pipeline(transaction=False)
+    pipe.set('a', 'one', nx=True)
+    pipe.set('a', 'two', nx=True)
+    pipe.get('a')
+    assert pipe.execute() == [True, None, b'one']
+    assert pipe.execute() == []
+
+
+def test_index(data_dir):
+    index = LocalIndex(data_dir)
+    body = index.transport.serializer.dumps({'index': {'_index': 'records', '_id': '1'}}) + '\n'
+    body += json.dumps({'identifier': 'http://example.gov.au/'}) + '\n'
+    body += json.dumps({'update': {'_index': 'records', '_id': '2'}}) + '\n'
+    body += json.dumps({'doc': {'unchanged': True}}) + '\n'
+    result = index.bulk(body)
+    assert result['errors'] is False
+    assert [list(item) for item in result['items']] == [['index'], ['update']]
+    with open(os.path.join(data_dir, 'index', 'records.jsonl')) as f:
+        lines = [json.loads(line) for line in f]
+    assert lines == [
+        {'_op': 'index', '_id': '1', 'doc': {'identifier': 'http://example.gov.au/'}},
+        {'_op': 'update', '_id': '2', 'doc': {'unchanged': True}},
+    ]
+
+
+def test_read_domains(tmpdir):
+    path = tmpdir.join('domains.txt')
+    path.write('# seeds\na.gov.au\n\n  b.gov.au\n')
+    assert run_local.read_domains([str(path), 'c.gov.au']) == ['a.gov.au', 'b.gov.au', 'c.gov.au']
+
+
+def test_env(data_dir):
+    args = run_local.get_parser().parse_args(['--data-dir', data_dir, '--follow', 'a.gov.au'])
+    env = run_local.get_env(args)
+    assert env['LOCAL_DATA_DIR'] == os.path.abspath(data_dir)
+    assert env['SUBTASKS_ENABLED'] == '1'
+    assert env['REDIS_CONNECTION'] == ''
+    assert 'LOCAL_ES_ENABLED' not in env
+    args = run_local.get_parser().parse_args(['--es', 'localhost:9200'])
+    env = run_local.get_env(args)
+    assert env['SUBTASKS_ENABLED'] == '0'
+    assert (env['LOCAL_ES_ENABLED'], env['ANALYTICS_ES_ENDPOINT']) == ('1', 'localhost:9200')
+
+
+def test_is_idle(clock, data_dir, monkeypatch):
+    monkeypatch.setattr(run_local, 'time', clock)
+    queues = LocalQueues(data_dir)
+    requests_queue = queues.get_queue_by_name('requests')
+    results_queue = queues.get_queue_by_name('results')
+    assert run_local.is_idle([requests_queue, results_queue], 60)
+    requests_queue.send_message(MessageBody='a.gov.au')
+    assert not run_local.is_idle([requests_queue, results_queue], 60)
+    requests_queue.receive_messages()[0].delete()
+    # empty, but something was going on recently
+    clock.now += 59
+    assert not run_local.is_idle([requests_queue, results_queue], 60)
+    clock.now += 1
+    assert run_local.is_idle([requests_queue, results_queue], 60)
@@ -0,0 +1,115 @@
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from my_metrics import NULL_TIMER, Histogram, Metrics, format_labels
+
+
+@pytest.fixture
+def metrics():
+    metrics = Metrics(namespace='test')
+    metrics.enable()
+    return metrics
+
+
+def test_disabled_metrics_do_nothing():
+    metrics = Metrics()
+    metrics.inc('pages_total')
+    metrics.set('queue_size', 1)
+    metrics.add('in_flight', 1)
+    metrics.observe('fetch_seconds', 0.1)
+    assert metrics.timer('fetch_seconds') is NULL_TIMER
+    assert (metrics.counters, metrics.gauges, metrics.histograms) == ({}, {}, {})
+    assert metrics.render() == '\n'
+
+
+def test_counters_and_gauges(metrics):
+    metrics.inc('pages_total', status=200)
+    metrics.inc('pages_total', 2, status=200)
+    metrics.inc('pages_total', status=404)
+    metrics.set('queue_size', 5)
+    metrics.add('in_flight', 1, host='a.gov.au')
+    metrics.add('in_flight', 1, host='a.gov.au')
+    metrics.add('in_flight', -1, host='a.gov.au')
+    assert metrics.render().splitlines() == [
+        '# TYPE test_pages_total counter',
+        'test_pages_total{status="200"} 3',
+        'test_pages_total{status="404"} 1',
+        '# TYPE test_in_flight gauge',
+        'test_in_flight{host="a.gov.au"} 1',
+        '# TYPE test_queue_size gauge',
+        'test_queue_size 5',
+    ]
+    metrics.remove('in_flight', host='a.gov.au')
+    metrics.remove('in_flight', host='b.gov.au')
+    assert 'in_flight' not in metrics.render()
+
+
+def test_labels():
+    assert format_labels([]) == ''
+    assert format_labels([('unchanged', True), ('path', 'a"b\\c')]) == '{unchanged="true",path="a\\"b\\\\c"}'
+    assert format_labels([('op', 'get')], [('le', 0.5)]) == '{op="get",le="0.5"}'
+
+
+def test_histograms(metrics):
+    for value in (0.001, 0.02, 0.02, 100):
+        metrics.observe('fetch_seconds', value)
+    with metrics.timer('fetch_seconds'):
+        pass
+    lines = metrics.render().splitlines()
+    assert lines[0] == '# TYPE test_fetch_seconds histogram'
+    assert 'test_fetch_seconds_bucket{le="0.005"} 2' in lines
+    assert 'test_fetch_seconds_bucket{le="0.025"} 4' in lines
+    assert 'test_fetch_seconds_bucket{le="30"} 4' in lines
+    assert 'test_fetch_seconds_bucket{le="+Inf"} 5' in lines
+    assert 'test_fetch_seconds_count 5' in lines
+    histogram = Histogram(buckets=(1, 2))
+    histogram.observe(1)
+    histogram.observe(1.5)
+    assert (histogram.counts, histogram.count, histogram.sum) == ([1, 1], 2, 2.5)
+
+
+def test_summary(metrics):
+    metrics.inc('pages_total', 3)
+    metrics.set('queue_size', 5)
+    metrics.observe('fetch_seconds', 0.1)
+    metrics.observe('fetch_seconds', 0.3)
+    assert metrics.summary() == {'pages_total': 3, 'queue_size': 5, 'fetch_seconds': '2x200.0ms'}
+    # counters and histograms since the previous summary
+    metrics.inc('pages_total')
+    assert metrics.summary() == {'pages_total': 1, 'queue_size': 5}
+
+
+def test_concurrent_updates(metrics):
+    def work():
+        for _ in range(10000):
+            metrics.inc('pages_total')
+            metrics.add('in_flight', 1)
+            metrics.observe('fetch_seconds', 0.1)
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert metrics.counters[('pages_total', ())] == 40000
+    assert metrics.gauges[('in_flight', ())] == 40000
+    assert metrics.histograms[('fetch_seconds', ())].count == 40000
+
+
+def test_endpoint(metrics):
+    metrics.inc('pages_total')
+    server = metrics.serve(0, host='127.0.0.1')
+    url = 'http://127.0.0.1:{}'.format(server.server_port)
+    try:
+        resp = urllib.request.urlopen(url + '/metrics', timeout=10)
+        assert resp.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+        assert resp.read().decode('utf-8') == metrics.render()
+        with pytest.raises(urllib.error.HTTPError) as e:
+            urllib.request.urlopen(url + '/other', timeout=10)
+        assert e.value.code == 404
+    finally:
+        server.shutdown()
+        server.server_close()
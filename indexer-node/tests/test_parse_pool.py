@@ -0,0 +1,35 @@
+import subprocess
+import sys
+
+from conftest import SRC_DIR
+
+# the pool is used from a monkey-patched process, so it's tested in one
+SCRIPT = '''
+from gevent import monkey
+monkey.patch_all()
+import gevent
+from my_parse_pool import ParsePool
+
+links = ''.join('<a href="/page/{0}">link number {0}</a>\\n'.format(i) for i in range(6000))
+body = ('<html><body>' + links + '</body></html>').encode()
+ticks = []
+ticker = gevent.spawn(lambda: [ticks.append(gevent.sleep(0.01)) for _ in range(1000)])
+parse_pool = ParsePool(processes=2)
+calls = [
+    gevent.spawn(parse_pool.analyse, 'http://example.gov.au/', body, {'content-type': 'text/html'})
+    for _ in range(8)
+]
+gevent.joinall(calls, raise_error=True)
+ticker.kill()
+parse_pool.shutdown()
+assert [len(call.value['links']) for call in calls] == [6000] * 8
+assert parse_pool.stats['inline'] == 0, parse_pool.stats
+# the loop kept running while the pages were parsed
+assert ticks, ticks
+print('ok')
+'''
+
+
+def test_link_heavy_pages_in_patched_process():
+    output = subprocess.check_output([sys.executable, '-c', SCRIPT], cwd=SRC_DIR, timeout=60)
+    assert output.strip().endswith(b'ok')
@@ -0,0 +1,134 @@
+import pytest
+
+from my_politeness import ConcurrencyWindow, HostBuckets, HostWindows, TokenBucket
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=0.5)
+    now = bucket.updated
+    assert bucket.wait(now) == 0
+    bucket.take(now)
+    assert bucket.wait(now) == 2
+    assert bucket.wait(now + 1.5) == 0.5
+    assert bucket.wait(now + 2) == 0
+
+
+def test_token_bucket_waiting_doesnt_take_tokens():
+    bucket = TokenBucket(rate=1)
+    now = bucket.updated
+    bucket.take(now)
+    for _ in range(3):
+        assert bucket.wait(now + 0.5) == 0.5
+    # a job which waited for something else still gets a single token
+    assert bucket.wait(now + 5) == 0
+    bucket.take(now + 5)
+    assert bucket.wait(now + 5) == 1
+
+
+def test_token_bucket_burst():
+    bucket = TokenBucket(rate=1, capacity=3)
+    now = bucket.updated
+    for _ in range(3):
+        assert bucket.wait(now) == 0
+        bucket.take(now)
+    assert bucket.wait(now) == 1
+    # idle time doesn't add tokens above the capacity
+    bucket.wait(now + 100)
+    assert bucket.tokens == 3
+
+
+def test_host_buckets():
+    buckets = HostBuckets(lambda host: 10 if host == 'slow.gov.au' else 1)
+    now = max(buckets.get('slow.gov.au').updated, buckets.get('fast.gov.au').updated)
+    buckets.take('http://slow.gov.au/a', now)
+    buckets.take('http://fast.gov.au/a', now)
+    assert buckets.wait('http://slow.gov.au/b', now) == pytest.approx(10)
+    assert buckets.wait('http://fast.gov.au/b', now) == pytest.approx(1)
+    assert buckets.wait('http://other.gov.au/', now) == 0
+
+
+def test_window_grows_on_fast_responses():
+    window = ConcurrencyWindow(initial=2, ceiling=4, latency_target=1.0)
+    for _ in range(2):
+        window.acquire()
+        window.release(latency=0.1)
+    assert window.size == 3
+    for _ in range(20):
+        window.acquire()
+        window.release(latency=0.1)
+    assert window.size == 4
+    # slow responses don't grow it
+    window = ConcurrencyWindow(initial=2, ceiling=4, latency_target=1.0)
+    for _ in range(10):
+        window.acquire()
+        window.release(latency=5)
+    assert window.size == 2
+
+
+def test_window_shrinks_once_per_cooldown():
+    window = ConcurrencyWindow(initial=8, ceiling=8, latency_target=1.0)
+    for _ in range(4):
+        window.acquire()
+    for _ in range(4):
+        window.release(failed=True, now=100)
+    assert window.size == 4
+    assert window.failures == 4
+    window.acquire()
+    window.release(failed=True, now=101)
+    assert window.size == 2
+    for i in range(5):
+        window.acquire()
+        window.release(failed=True, now=102 + i)
+    assert window.size == 1
+    window.acquire()
+    window.release(latency=0.1)
+    assert window.failures == 0
+
+
+def test_window_available():
+    window = ConcurrencyWindow(initial=2, ceiling=4)
+    window.acquire()
+    assert window.available()
+    window.acquire()
+    assert not window.available()
+    window.release(latency=0.1)
+    assert window.available()
+
+
+def crawl(latency, seconds=120, delay=2.0, failed=False):
+    """Requests sent to a host in `seconds`, scheduled like the crawler does it"""
+    windows = HostWindows(initial=2, ceiling=4, latency_target=2.0)
+    buckets = HostBuckets(lambda host: delay / windows.scale(host))
+    url = 'http://example.gov.au/'
+    now = buckets.get('example.gov.au', 0).updated
+    end = now + seconds
+    in_flight = []
+    sent = 0
+    while now < end:
+        for done in [done for done in in_flight if done <= now]:
+            in_flight.remove(done)
+            windows.release(url, latency=latency, failed=failed)
+        wait = buckets.wait(url, now)
+        if not wait and windows.available(url):
+            buckets.take(url, now)
+            windows.acquire(url)
+            in_flight.append(now + latency)
+            sent += 1
+            continue
+        events = list(in_flight)
+        if wait:
+            events.append(now + wait)
+        # rounding errors of the token count can leave a tiny wait
+        now = max(min(events), now + 1e-6)
+    return sent
+
+
+def test_fast_hosts_get_more_throughput():
+    fast = crawl(latency=0.1)
+    slow = crawl(latency=3.0)
+    failing = crawl(latency=0.1, failed=True)
+    # the window grows to the ceiling: twice the base rate of one request per 2 seconds
+    assert fast >= 110
+    assert slow <= 62
+    assert failing <= 32
+    assert fast > slow > failing
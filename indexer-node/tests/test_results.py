@@ -0,0 +1,156 @@
+import base64
+import os
+
+from my_envelope import decode_envelope, get_pointer, make_pointer
+from my_results import SQS_BATCH_SIZE, SQS_MAX_BYTES, ResultBatcher, ResultStream
+
+
+class FakeQueue(object):
+    def __init__(self, fail_batches=0, failed_ids=(), fail_single=0):
+        self.fail_batches = fail_batches
+        self.failed_ids = failed_ids
+        self.fail_single = fail_single
+        self.requests = []
+        self.messages = []
+
+    def send_messages(self, Entries):
+        self.requests.append(Entries)
+        if self.fail_batches:
+            self.fail_batches -= 1
+            raise IOError('SQS is down')
+        failed = [entry for entry in Entries if entry['Id'] in self.failed_ids]
+        self.messages.extend(entry['MessageBody'] for entry in Entries if entry not in failed)
+        return {'Failed': [{'Id': entry['Id']} for entry in failed]}
+
+    def send_message(self, MessageBody):
+        if self.fail_single:
+            self.fail_single -= 1
+            raise IOError('SQS is down')
+        self.messages.append(MessageBody)
+
+
+def make_record(i, text_bytes=200):
+    # random text doesn't compress, so the sizes are predictable
+    return {'identifier': 'http://example.gov.au/{}'.format(i),
+            'text': base64.b64encode(os.urandom(text_bytes)).decode('ascii')}
+
+
+def decode_all(messages, objects=None):
+    records = []
+    for body in messages:
+        records.extend(decode_envelope(body, lambda bucket, key: objects[key]))
+    return records
+
+
+def test_records_are_packed_up_to_the_message_size():
+    queue = FakeQueue()
+    batcher = ResultBatcher(queue, max_message_bytes=10000)
+    records = [make_record(i) for i in range(300)]
+    for record in records:
+        batcher.add(record)
+    batcher.flush()
+    assert decode_all(queue.messages) == records
+    assert all(len(body) <= 10000 for body in queue.messages)
+    # every message but the last one is filled up to the limit
+    assert len(queue.messages) < 20
+    assert all(len(body) > 9000 for body in queue.messages[:-1])
+    assert batcher.stats['records'] == 300
+    assert batcher.stats['messages'] == len(queue.messages)
+
+
+def test_batches_respect_sqs_limits():
+    queue = FakeQueue()
+    batcher = ResultBatcher(queue, max_message_bytes=100000)
+    for i in range(4000):
+        batcher.add(make_record(i))
+    batcher.flush()
+    for entries in queue.requests:
+        assert len(entries) <= SQS_BATCH_SIZE
+        assert sum(len(entry['MessageBody']) for entry in entries) <= SQS_MAX_BYTES
+    assert len(decode_all(queue.messages)) == 4000
+
+
+def test_huge_envelopes_are_spilled():
+    queue = FakeQueue()
+    objects = {}
+
+    def spill(compressed):
+        key = 'results/{}'.format(len(objects))
+        objects[key] = compressed
+        return make_pointer('bucket', key)
+
+    batcher = ResultBatcher(queue, spill=spill, max_message_bytes=10000)
+    records = [make_record(0), make_record(1, text_bytes=20000), make_record(2)]
+    for record in records:
+        batcher.add(record)
+    batcher.flush()
+    assert batcher.stats['spilled'] == 1
+    assert len([body for body in queue.messages if get_pointer(body)]) == 1
+    assert decode_all(queue.messages, objects) == records
+
+
+def test_huge_envelopes_without_spill_are_dropped():
+    queue = FakeQueue()
+    batcher = ResultBatcher(queue, max_message_bytes=10000)
+    batcher.add(make_record(0, text_bytes=20000))
+    batcher.flush()
+    assert queue.messages == []
+    assert batcher.stats['failed'] == 1
+
+
+def test_failed_sends_are_retried_one_by_one():
+    queue = FakeQueue(fail_batches=1)
+    batcher = ResultBatcher(queue, max_message_bytes=2000)
+    records = [make_record(i, text_bytes=1000) for i in range(5)]
+    for record in records:
+        batcher.add(record)
+    batcher.flush()
+    assert sorted(decode_all(queue.messages), key=lambda r: r['identifier']) == records
+    assert batcher.stats['messages'] == 5
+
+    queue = FakeQueue(failed_ids=('1',), fail_single=1)
+    batcher = ResultBatcher(queue, max_message_bytes=2000)
+    for record in records:
+        batcher.add(record)
+    batcher.flush()
+    # the failed entry had one more chance and failed again
+    assert len(queue.messages) == 4
+    assert batcher.stats['messages'] == 4
+    assert batcher.stats['failed'] == 1
+
+
+def test_empty_flush_sends_nothing():
+    queue = FakeQueue()
+    ResultBatcher(queue).flush()
+    assert queue.requests == []
+
+
+def test_stream_flushes_by_records_and_bytes():
+    queue = FakeQueue()
+    stream = ResultStream(ResultBatcher(queue), max_records=3, max_bytes=10 ** 6)
+    for i in range(7):
+        stream.add(make_record(i))
+    assert len(decode_all(queue.messages)) == 6
+    # the rest is sent by the final flush
+    stream.flush()
+    assert len(decode_all(queue.messages)) == 7
+
+    queue = FakeQueue()
+    stream = ResultStream(ResultBatcher(queue), max_records=100, max_bytes=1000)
+    for i in range(4):
+        stream.add(make_record(i, text_bytes=300))
+    assert len(decode_all(queue.messages)) == 4 - stream.records
+
+
+def test_stream_flush_if_due():
+    queue = FakeQueue()
+    calls = []
+    stream = ResultStream(ResultBatcher(queue), max_seconds=0, before_flush=lambda: calls.append(1))
+    stream.flush_if_due()
+    assert calls == []
+    stream.add(make_record(0))
+    stream.flush_if_due()
+    assert calls == [1]
+    assert len(decode_all(queue.messages)) == 1
+    stream.flush()
+    assert calls == [1]
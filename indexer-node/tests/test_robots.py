@@ -0,0 +1,162 @@
+import gevent
+import pytest
+
+import my_robots
+from my_local import LocalRedis
+from my_robots import RobotsCache, RobotsRules
+
+ROBOTS = """
+User-agent: slowbot
+Crawl-delay: 5
+
+User-agent: *
+Disallow: /private/
+Request-rate: 1/4
+"""
+
+
+class Clock(object):
+    """Stands for the time module in my_robots"""
+
+    def __init__(self, now=1000000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+class FakeFetch(object):
+    """RobotsCache.fetch returning the given rules, slowly"""
+
+    def __init__(self, rules):
+        self.rules = rules
+        self.domains = []
+
+    def __call__(self, domain):
+        self.domains.append(domain)
+        gevent.sleep(0.01)
+        if isinstance(self.rules, Exception):
+            raise self.rules
+        return self.rules
+
+
+class Response(object):
+    def __init__(self, status):
+        self.status = status
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(my_robots, 'time', clock)
+    return clock
+
+
+def make_cache(rules, **kwargs):
+    cache = RobotsCache(**kwargs)
+    cache.fetch = FakeFetch(rules)
+    return cache
+
+
+def test_rules():
+    rules = RobotsRules('ok', ROBOTS)
+    assert rules.can_fetch('*', 'http://example.gov.au/about')
+    assert not rules.can_fetch('*', 'http://example.gov.au/private/page')
+    assert RobotsRules('allow_all').can_fetch('*', 'http://example.gov.au/private/page')
+    assert not RobotsRules('disallow_all').can_fetch('*', 'http://example.gov.au/')
+    assert not RobotsRules('unreachable').can_fetch('*', 'http://example.gov.au/')
+    loaded = RobotsRules.loads(rules.dumps())
+    assert (loaded.status, loaded.body) == ('ok', ROBOTS)
+    assert not loaded.can_fetch('*', 'http://example.gov.au/private/page')
+
+
+def test_delay():
+    rules = RobotsRules('ok', ROBOTS)
+    # Crawl-delay
+    assert rules.delay('slowbot') == 5.0
+    # Request-rate, 1 request per 4 seconds
+    assert rules.delay() == 4.0
+    assert RobotsRules('ok', 'User-agent: *\nDisallow: /x\n').delay() is None
+    assert RobotsRules('allow_all').delay() is None
+
+
+def test_concurrent_lookups_share_one_fetch(clock):
+    cache = make_cache(RobotsRules('ok', ROBOTS))
+    lookups = [gevent.spawn(cache.get, 'example.gov.au') for _ in range(5)]
+    gevent.joinall(lookups, raise_error=True)
+    assert cache.fetch.domains == ['example.gov.au']
+    assert len(set(id(lookup.value) for lookup in lookups)) == 1
+    assert cache.inflight == {}
+
+
+def test_failed_fetch_is_raised_to_every_waiter(clock):
+    cache = make_cache(ValueError('broken'))
+    lookups = [gevent.spawn(cache.get, 'example.gov.au') for _ in range(3)]
+    gevent.joinall(lookups)
+    assert all(isinstance(lookup.exception, ValueError) for lookup in lookups)
+    assert cache.fetch.domains == ['example.gov.au']
+    # nothing is cached, the next lookup tries again
+    assert cache.inflight == {}
+    with pytest.raises(ValueError):
+        cache.get('example.gov.au')
+    assert len(cache.fetch.domains) == 2
+
+
+@pytest.mark.parametrize('status, ttl', [('ok', 100), ('allow_all', 100), ('unreachable', 10)])
+def test_cached_for_the_ttl(clock, status, ttl):
+    cache = make_cache(RobotsRules(status), ttl=100, negative_ttl=10)
+    cache.get('example.gov.au')
+    clock.now += ttl - 1
+    cache.get('example.gov.au')
+    assert len(cache.fetch.domains) == 1
+    clock.now += 1
+    cache.get('example.gov.au')
+    assert len(cache.fetch.domains) == 2
+
+
+def test_shared_cache(clock, tmpdir):
+    redis_db = LocalRedis(str(tmpdir))
+    cache = make_cache(RobotsRules('ok', ROBOTS), redis_db=redis_db, ttl=100)
+    cache.get('example.gov.au')
+    # another worker gets it from Redis
+    other = make_cache(RobotsRules('allow_all'), redis_db=redis_db)
+    rules = other.get('example.gov.au')
+    assert other.fetch.domains == []
+    assert not rules.can_fetch('*', 'http://example.gov.au/private/page')
+
+
+def test_local_cache_size(clock):
+    cache = make_cache(RobotsRules('allow_all'), size=2)
+    for domain in ('a.gov.au', 'b.gov.au', 'c.gov.au', 'a.gov.au'):
+        cache.get(domain)
+    assert cache.fetch.domains == ['a.gov.au', 'b.gov.au', 'c.gov.au', 'a.gov.au']
+    assert list(cache.local) == ['c.gov.au', 'a.gov.au']
+
+
+@pytest.mark.parametrize('status, expected', [
+    (200, 'ok'), (404, 'allow_all'), (403, 'disallow_all'), (401, 'disallow_all'), (503, 'unreachable'),
+])
+def test_fetch_statuses(monkeypatch, status, expected):
+    class Http(object):
+        def __init__(self, timeout=None):
+            pass
+
+        def request(self, url, headers=None):
+            assert url == 'http://example.gov.au/robots.txt'
+            assert headers == {'User-Agent': 'bot'}
+            return Response(status), ROBOTS.encode('utf-8')
+
+    monkeypatch.setattr(my_robots.httplib2, 'Http', Http)
+    assert RobotsCache(user_agent='bot').fetch('example.gov.au').status == expected
+
+
+def test_fetch_errors(monkeypatch):
+    class Http(object):
+        def __init__(self, timeout=None):
+            pass
+
+        def request(self, url, headers=None):
+            raise OSError('Name or service not known')
+
+    monkeypatch.setattr(my_robots.httplib2, 'Http', Http)
+    assert RobotsCache().fetch('example.gov.au').status == 'unreachable'
@@ -0,0 +1,45 @@
+import random
+
+from my_seen import BloomFilter, ScalableBloomFilter, SeenUrls
+
+
+def test_slices_split_the_error_rate():
+    bloom = ScalableBloomFilter(initial_capacity=100, error_rate=0.01)
+    for fp in range(5000):
+        bloom.add(fp * 0x9e3779b97f4a7c15 & 0xffffffffffffffff)
+    assert len(bloom.filters) > 3
+    assert [f.capacity for f in bloom.filters[:3]] == [100, 200, 400]
+    # slice rates are a geometric series, their sum stays under error_rate
+    assert sum(f.error_rate for f in bloom.filters) <= 0.01
+    rates = [f.error_rate for f in bloom.filters]
+    assert rates == sorted(rates, reverse=True)
+
+
+def test_false_positive_rate_after_growth():
+    rng = random.Random(1)
+    bloom = ScalableBloomFilter(initial_capacity=1000, error_rate=0.01)
+    added = set(rng.getrandbits(64) for _ in range(20000))
+    for fp in added:
+        bloom.add(fp)
+    assert all(fp in bloom for fp in added)
+    others = [fp for fp in (rng.getrandbits(64) for _ in range(20000)) if fp not in added]
+    false_positives = sum(1 for fp in others if fp in bloom)
+    assert false_positives <= 0.01 * len(others)
+
+
+def test_bloom_filter_add():
+    bloom = BloomFilter(capacity=10, error_rate=0.01)
+    assert bloom.add(42)
+    assert not bloom.add(42)
+    assert 42 in bloom
+    assert bloom.count == 1
+
+
+def test_seen_urls():
+    seen = SeenUrls(initial_capacity=10)
+    assert seen.add('http://example.gov.au/a')
+    assert not seen.add('http://EXAMPLE.gov.au/a/')
+    assert 'http://example.gov.au:80/a' in seen
+    assert 'http://example.gov.au/b' not in seen
+    assert len(seen) == 1
+    assert seen.stats()['hits'] == 2
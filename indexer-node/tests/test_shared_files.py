@@ -0,0 +1,15 @@
+import os
+import subprocess
+import sys
+
+from conftest import SRC_DIR
+
+BASE_DIR = os.path.join(SRC_DIR, '..', '..')
+
+
+def test_shared_files_are_the_same_in_all_nodes():
+    # modules like my_metrics.py are copied to every node's src/
+    result = subprocess.run(
+        [sys.executable, 'shared_files.py'], cwd=BASE_DIR, stdout=subprocess.PIPE, timeout=60,
+    )
+    assert result.returncode == 0, result.stdout.decode()
@@ -0,0 +1,59 @@
+import random
+
+from my_simhash import SimHashIndex, get_features, hamming_distance, simhash
+
+TEXT = ' '.join('word{}'.format(i) for i in range(200))
+
+
+def flip(fp, bits):
+    for bit in bits:
+        fp ^= 1 << bit
+    return fp
+
+
+def test_bands_cover_all_bits():
+    for max_distance in range(1, 8):
+        index = SimHashIndex(max_distance=max_distance)
+        assert len(index.bands) == max_distance + 1
+        covered = 0
+        for shift, mask in index.bands:
+            assert not covered & (mask << shift)
+            covered |= mask << shift
+        assert covered == (1 << 64) - 1
+
+
+def test_finds_fingerprints_within_max_distance():
+    rng = random.Random(1)
+    index = SimHashIndex(max_distance=3)
+    fps = [rng.getrandbits(64) for _ in range(200)]
+    for i, fp in enumerate(fps):
+        index.add(fp, i)
+    for i, fp in enumerate(fps):
+        for distance in range(4):
+            # spread over any bands, including the last, wider one
+            near = flip(fp, rng.sample(range(64), distance))
+            assert index.find(near) == i
+
+
+def test_ignores_fingerprints_further_away():
+    index = SimHashIndex(max_distance=3)
+    fp = 0x0123456789abcdef
+    index.add(fp, 'page')
+    # one flipped bit in each band: no band matches exactly
+    assert index.find(flip(fp, [0, 16, 32, 48])) is None
+    # four bits in one band: the other bands match but the distance is too big
+    far = flip(fp, [0, 1, 2, 3])
+    assert hamming_distance(fp, far) == 4
+    assert index.find(far) is None
+
+
+def test_similar_texts_are_close():
+    fp = simhash(get_features(TEXT))
+    edited = simhash(get_features(TEXT.replace('word100', 'changed')))
+    other = simhash(get_features(' '.join('other{}'.format(i) for i in range(200))))
+    assert hamming_distance(fp, edited) <= 3
+    assert hamming_distance(fp, other) > 3
+
+
+def test_short_texts_have_no_features():
+    assert get_features('too short to compare') == []
@@ -0,0 +1,80 @@
+import gevent
+from botocore.exceptions import ClientError
+
+from my_storage import KeyCache, S3Uploader
+
+
+class FakeS3(object):
+    def __init__(self, fail=0):
+        self.objects = {}
+        self.fail = fail
+        self.puts = 0
+
+    def head_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise ClientError({'Error': {'Code': '404'}}, 'HeadObject')
+
+    def put_object(self, Key, Body, **kwargs):
+        gevent.sleep(0.01)
+        self.puts += 1
+        if self.fail:
+            self.fail -= 1
+            raise IOError('S3 is down')
+        self.objects[Key] = Body
+
+
+def test_same_key_is_uploaded_once():
+    s3 = FakeS3()
+    uploader = S3Uploader(s3, 'bucket', concurrency=2)
+    first = uploader.upload(b'key1', b'body')
+    second = uploader.upload('key1', b'body')
+    assert second is first
+    uploader.join()
+    assert first.value is True
+    assert s3.puts == 1
+    # known keys are skipped without a request
+    assert uploader.upload('key1', b'body') is None
+    assert uploader.stats == {'uploaded': 1, 'exists': 0, 'coalesced': 2, 'failed': 0}
+
+
+def test_existing_key_is_not_uploaded_again():
+    s3 = FakeS3()
+    s3.objects['key1'] = b'body'
+    uploader = S3Uploader(s3, 'bucket', key_cache=KeyCache())
+    upload = uploader.upload('key1', b'body')
+    uploader.join()
+    assert upload.value is True
+    assert s3.puts == 0
+    assert uploader.stats['exists'] == 1
+
+
+def test_uploads_are_retried(monkeypatch):
+    monkeypatch.setattr('gevent.sleep', lambda seconds: None)
+    s3 = FakeS3(fail=2)
+    uploader = S3Uploader(s3, 'bucket', retries=3)
+    upload = uploader.upload('key1', b'body')
+    uploader.join()
+    assert upload.value is True
+    assert s3.objects == {'key1': b'body'}
+
+
+def test_failed_upload_is_reported(monkeypatch):
+    monkeypatch.setattr('gevent.sleep', lambda seconds: None)
+    s3 = FakeS3(fail=3)
+    uploader = S3Uploader(s3, 'bucket', retries=3)
+    upload = uploader.upload('key1', b'body')
+    uploader.join()
+    assert upload.value is False
+    assert uploader.stats['failed'] == 1
+    # it's not remembered as uploaded, so the next page tries again
+    assert uploader.upload('key1', b'body') is not None
+
+
+def test_key_cache_is_lru():
+    cache = KeyCache(size=2)
+    cache.add('a')
+    cache.add('b')
+    assert 'a' in cache
+    cache.add('c')
+    assert 'a' in cache
+    assert 'b' not in cache
@@ -0,0 +1,71 @@
+import pytest
+
+from my_urls import canonicalize, compile_params, url_fingerprint, url_key
+
+
+@pytest.mark.parametrize('url, expected', [
+    ('HTTP://Example.COM/', 'http://example.com/'),
+    ('http://example.com', 'http://example.com/'),
+    ('http://example.com:80/a', 'http://example.com/a'),
+    ('https://example.com:443/a', 'https://example.com/a'),
+    ('http://example.com:8080/a', 'http://example.com:8080/a'),
+    ('http://example.com./a', 'http://example.com/a'),
+    ('http://example.com/a/./b/../c', 'http://example.com/a/c'),
+    ('http://example.com/../a', 'http://example.com/a'),
+    ('http://example.com/a/..', 'http://example.com/'),
+    ('http://example.com/%7euser/%2fx%2F', 'http://example.com/~user/%2Fx%2F'),
+    ('http://example.com/a b', 'http://example.com/a%20b'),
+    ('http://example.com/?b=2&a=1', 'http://example.com/?a=1&b=2'),
+    # repeated parameters keep their order
+    ('http://example.com/?b=1&a=2&a=1&b=0', 'http://example.com/?a=2&a=1&b=1&b=0'),
+    ('http://example.com/a#top', 'http://example.com/a'),
+    ('http://bücher.de/', 'http://xn--bcher-kva.de/'),
+    ('http://[::1]:8080/', 'http://[::1]:8080/'),
+    ('  http://example.com/a  ', 'http://example.com/a'),
+])
+def test_canonicalize(url, expected):
+    assert canonicalize(url) == expected
+
+
+@pytest.mark.parametrize('url', [
+    'mailto:someone@example.com',
+    'javascript:void(0)',
+    'ftp://example.com/file',
+    'http:///path',
+    'http://example.com:99999/',
+])
+def test_not_crawlable(url):
+    assert canonicalize(url) is None
+
+
+def test_relative_links_and_stripped_params():
+    strip = compile_params('utm_*,gclid')
+    url = canonicalize('../b/?utm_source=x&z=1&a=2&GCLID=3#top', base='http://Example.com:80/a/c',
+                       strip_params=strip)
+    assert url == 'http://example.com/b/?a=2&z=1'
+
+
+def test_compile_params():
+    strip = compile_params(' utm_* , gclid,,')
+    assert strip('utm_medium')
+    assert strip('UTM_SOURCE')
+    assert strip('gclid')
+    assert not strip('gclid2')
+    assert not strip('page')
+    assert not compile_params('')('page')
+
+
+def test_url_key_and_fingerprint():
+    assert url_key('http://Example.com/about/') == '//example.com/about'
+    assert url_key('http://example.com/') == '//example.com/'
+    assert url_fingerprint('http://example.com/about') == url_fingerprint('HTTP://example.com:80/about/')
+    assert url_fingerprint('http://example.com/about') != url_fingerprint('http://example.com/contact')
+    assert 0 <= url_fingerprint('http://example.com/') < 2 ** 64
+
+
+def test_http_and_https_are_the_same_page():
+    assert url_fingerprint('http://example.com/a') == url_fingerprint('https://example.com/a')
+    assert url_fingerprint('http://example.com/a') == url_fingerprint('https://example.com:443/a/')
+    assert url_fingerprint('http://example.com:8443/a') != url_fingerprint('https://example.com/a')
+    # only the key ignores the scheme, the url is fetched as it is
+    assert canonicalize('https://example.com/a') == 'https://example.com/a'
@@ -0,0 +1,71 @@
+import pytest
+
+import my_validators
+from my_local import LocalRedis
+from my_validators import RedisValidatorStore, SqliteValidatorStore, get_key
+
+
+class Clock(object):
+    def __init__(self, now=1000000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+class BrokenRedis(object):
+    def get(self, key):
+        raise IOError('Redis is down')
+
+    def set(self, key, value, ex=None):
+        raise IOError('Redis is down')
+
+
+@pytest.fixture(params=['sqlite', 'redis'])
+def store(request, tmpdir):
+    if request.param == 'sqlite':
+        return SqliteValidatorStore(str(tmpdir.join('validators.sqlite')))
+    return RedisValidatorStore(LocalRedis(str(tmpdir)))
+
+
+def test_key_is_the_canonical_url():
+    assert get_key('http://example.gov.au/a?y=2&x=1') == get_key('http://Example.gov.au/a?x=1&y=2')
+    assert get_key('http://example.gov.au/a') != get_key('http://example.gov.au/b')
+    assert len(get_key('http://example.gov.au/')) == 16
+
+
+def test_set_and_get(store):
+    assert store.get('http://example.gov.au/') is None
+    store.set('http://example.gov.au/', etag='"abc"', links=['http://example.gov.au/about'])
+    assert store.get('http://example.gov.au/') == {
+        'etag': '"abc"', 'last_modified': None, 'links': ['http://example.gov.au/about'],
+    }
+    # replaced by the next visit
+    store.set('http://example.gov.au/', last_modified='Wed, 21 Oct 2015 07:28:00 GMT')
+    assert store.get('http://example.gov.au/') == {
+        'etag': None, 'last_modified': 'Wed, 21 Oct 2015 07:28:00 GMT', 'links': [],
+    }
+
+
+def test_sqlite_ttl(monkeypatch, tmpdir):
+    clock = Clock()
+    monkeypatch.setattr(my_validators, 'time', clock)
+    store = SqliteValidatorStore(str(tmpdir.join('validators.sqlite')), ttl=60)
+    store.set('http://example.gov.au/', etag='"abc"')
+    clock.now += 60
+    assert store.get('http://example.gov.au/')['etag'] == '"abc"'
+    clock.now += 1
+    assert store.get('http://example.gov.au/') is None
+
+
+def test_redis_ttl(tmpdir):
+    redis_db = LocalRedis(str(tmpdir))
+    RedisValidatorStore(redis_db, ttl=60).set('http://example.gov.au/', etag='"abc"')
+    expires_at, = redis_db.db.execute('SELECT expires_at FROM kv').fetchone()
+    assert expires_at is not None
+
+
+def test_redis_is_optional():
+    store = RedisValidatorStore(BrokenRedis())
+    store.set('http://example.gov.au/', etag='"abc"')
+    assert store.get('http://example.gov.au/') is None
@@ -0,0 +1,250 @@
+import subprocess
+import sys
+
+from conftest import SRC_DIR
+
+# worker.py patches the process on import, so it's tested in a separate one
+PRELUDE = '''
+import gevent
+import worker
+
+sleep = gevent.sleep
+# no backoff
+worker.gevent.sleep = lambda seconds=0: sleep(0)
+'''
+
+RECEIVE = PRELUDE + '''
+class Message(object):
+    def __init__(self, body, fail_delete=False):
+        self.body = body
+        self.fail_delete = fail_delete
+        self.deleted = False
+
+    def delete(self):
+        if self.fail_delete:
+            raise IOError('SQS is down')
+        self.deleted = True
+
+
+class Queue(object):
+    def __init__(self, batches):
+        self.batches = batches
+
+    def receive_messages(self, **kwargs):
+        batch = self.batches.pop(0)
+        if isinstance(batch, Exception):
+            raise batch
+        return batch
+
+
+messages = [Message('a.gov.au'), Message('b.gov.au', fail_delete=True), Message('c.gov.au')]
+requests = worker.DomainRequests(Queue([IOError('throttled'), messages[:2], [], IOError('down'), messages[2:]]))
+domains = gevent.queue.Queue(1)
+receiver = gevent.spawn(requests.receive, domains, 3)
+received = list(domains)
+receiver.get(timeout=5)
+assert received == messages, received
+
+# the message is done even if the crawl fails or deleting it does
+def crawl_domain(domain):
+    raise ValueError(domain)
+worker.crawl_domain = crawl_domain
+for msg in messages:
+    try:
+        worker.crawl_request(requests, msg)
+    except ValueError:
+        pass
+assert [msg.deleted for msg in messages] == [True, False, True]
+assert not requests.messages
+
+# StopIteration is put even when receiving is stopped
+domains = gevent.queue.Queue()
+receiver = gevent.spawn(requests.receive, domains, 10)
+requests.queue.batches = [IOError('down')] * 1000
+gevent.sleep(0)
+receiver.kill()
+assert list(domains) == []
+print('ok')
+'''
+
+RELEASE = PRELUDE + '''
+spider = worker.MySpider.__new__(worker.MySpider)
+spider.uploads = []
+spider.results = []
+spider.results_count = 0
+spider.result_stream = None
+
+
+def upload(ok, delay):
+    sleep(delay)
+    return ok
+
+
+spider.add_result({'identifier': 'fast'}, gevent.spawn(upload, True, 0))
+spider.add_result({'identifier': 'failed'}, gevent.spawn(upload, False, 0))
+spider.add_result({'identifier': 'slow'}, gevent.spawn(upload, True, 0.2))
+spider.add_result({'identifier': 'known'})
+sleep(0.05)
+spider.release_results()
+assert [r['identifier'] for r in spider.results] == ['known', 'fast'], spider.results
+assert len(spider.uploads) == 1
+
+
+def add_later():
+    sleep(0.1)
+    spider.add_result({'identifier': 'late'}, gevent.spawn(upload, True, 0.2))
+
+
+# uploads added while the final flush waits are waited for too
+gevent.spawn(add_later)
+spider.release_results(wait=True)
+assert [r['identifier'] for r in spider.results] == ['known', 'fast', 'slow', 'late'], spider.results
+assert spider.uploads == []
+assert spider.results_count == 4
+print('ok')
+'''
+
+ARCHIVE = PRELUDE + '''
+import tempfile
+from my_archive import SegmentWriter
+
+
+class S3(object):
+    def __init__(self, fail):
+        self.fail = fail
+        self.objects = {}
+
+    def put_object(self, Key, Body, **kwargs):
+        if self.fail:
+            raise IOError('S3 is down')
+        self.objects[Key] = Body
+
+
+class Response(dict):
+    status = 200
+
+
+for fail in (False, True):
+    s3 = S3(fail)
+    worker.archive = SegmentWriter(s3, 'bucket', tempfile.mkdtemp(), max_seconds=3600, retries=1)
+    spider = worker.MySpider.__new__(worker.MySpider)
+    spider.uploads = []
+    spider.results = []
+    spider.results_count = 0
+    spider.result_stream = None
+    pointer, upload = worker.archive.append('http://example.gov.au/', Response(), b'<html></html>')
+    spider.add_result({'identifier': 'http://example.gov.au/', 'archive': pointer}, upload=upload)
+    # periodic flushes report only what's uploaded
+    spider.flush_results()
+    assert spider.results == [] and worker.archive.segment is not None
+    # the final one doesn't wait for the segment to fill up
+    with gevent.Timeout(10):
+        spider.flush_results(final=True)
+    assert worker.archive.segment is None
+    assert len(spider.results) == (0 if fail else 1), spider.results
+    assert len(s3.objects) == (0 if fail else 1)
+print('ok')
+'''
+
+VALIDATORS = PRELUDE + '''
+job = worker.Job('http://example.gov.au/')
+job.add_validators(None)
+assert 'If-None-Match' not in job.headers and job.validators is None
+validators = {'etag': '"abc"', 'last_modified': None, 'links': ['http://example.gov.au/about']}
+job.add_validators(validators)
+assert job.headers['If-None-Match'] == '"abc"'
+assert 'If-Modified-Since' not in job.headers
+assert not job.not_modified
+
+
+class Response(dict):
+    status = 304
+
+
+# not modified: the links of the previous visit are followed, the body isn't processed
+job.response = Response()
+job.data = b''
+assert job.not_modified
+spider = worker.MySpider.__new__(worker.MySpider)
+spider.uploads = []
+spider.results = []
+spider.results_count = 0
+spider.result_stream = None
+followed = []
+spider.crawl_sublink = followed.append
+spider.postprocess(job)
+assert followed == ['http://example.gov.au/about'], followed
+assert spider.results == [worker.get_unchanged_result('http://example.gov.au/')], spider.results
+print('ok')
+'''
+
+LAZY = PRELUDE + '''
+# parse worker processes are forked when they are needed
+assert not worker.parse_pool.resolved
+assert not worker.parse_pool.enabled
+assert worker.parse_pool.resolved
+worker.parse_pool.shutdown()
+print('ok')
+'''
+
+SUBLINKS = PRELUDE + '''
+from my_seen import SeenUrls
+
+
+class Crawler(object):
+    def __init__(self):
+        self.seen_jobs = SeenUrls()
+        self.jobs = []
+
+    def put_job(self, job):
+        self.jobs.append(job.url)
+
+
+spider = worker.MySpider.__new__(worker.MySpider)
+spider.first_url = 'http://example.gov.au/'
+spider.crawler = Crawler()
+checked = []
+spider.can_crawl = lambda url, count: checked.append((url, count)) or 'denied' not in url
+assert spider.crawl_sublink('/a')
+assert not spider.crawl_sublink('http://example.gov.au/a')
+# rejected urls are remembered and not checked again
+assert spider.crawl_sublink('/denied')
+assert not spider.crawl_sublink('/denied')
+assert spider.crawl_sublink('/b')
+assert spider.crawler.jobs == ['http://example.gov.au/a', 'http://example.gov.au/b']
+assert checked == [
+    ('http://example.gov.au/a', 0), ('http://example.gov.au/denied', 1), ('http://example.gov.au/b', 2),
+], checked
+# one lookup per link
+assert spider.crawler.seen_jobs.lookups == 5
+print('ok')
+'''
+
+
+def run(script):
+    output = subprocess.check_output([sys.executable, '-c', script], cwd=SRC_DIR, timeout=60)
+    assert output.strip().endswith(b'ok')
+
+
+def test_domain_requests():
+    run(RECEIVE)
+
+
+def test_records_wait_for_their_uploads():
+    run(RELEASE)
+
+
+def test_archive_records_wait_for_their_segment():
+    run(ARCHIVE)
+
+
+def test_conditional_requests():
+    run(VALIDATORS)
+
+
+def test_parse_pool_is_lazy():
+    run(LAZY)
+
+
+def test_sublinks_are_looked_up_once():
+    run(SUBLINKS)
@@ -1,63 +1,221 @@
 #!/usr/bin/env python
-import datetime
-import json
 import time  # NOQA
 import pprint  # NOQA
 import sys
 
+from my_lazy import Lazy, startup_report, track_imports, warm_up
+if '--startup-time' in sys.argv:
+    track_imports()
+
 import boto3
 import redis
 
+from my_envelope import FetchError, decode_envelope, get_pointer
+from my_local import LocalQueues, LocalRedis, LocalS3
 from my_logging import logger  # NOQA
+from my_metrics import metrics
 from my_settings import SYS_SETTINGS
-from my_processors import ResultProcessor
+from my_processors import BulkIndexer, ResultProcessor, es
+from my_recrawl import DAY, RecrawlScheduler, read_seeds
+from my_rules import CrawlRules
+from my_subtasks import SubtaskDispatcher
 
-s3_client = boto3.client('s3', region_name=SYS_SETTINGS.AWS_REGION)
-sqs_resource = boto3.resource('sqs', region_name=SYS_SETTINGS.AWS_REGION)
 
-requests_queue = sqs_resource.get_queue_by_name(
-    QueueName=SYS_SETTINGS.QUEUE_REQUESTS.split(':')[-1],
-    QueueOwnerAWSAccountId=SYS_SETTINGS.QUEUE_REQUESTS.split(':')[-2]
-)
-results_queue = sqs_resource.get_queue_by_name(
-    QueueName=SYS_SETTINGS.QUEUE_RESULTS.split(':')[-1],
-    QueueOwnerAWSAccountId=SYS_SETTINGS.QUEUE_RESULTS.split(':')[-2]
+
+def get_s3_client():
+    if SYS_SETTINGS.LOCAL_DATA_DIR:
+        return LocalS3(SYS_SETTINGS.LOCAL_DATA_DIR)
+    return boto3.client('s3', region_name=SYS_SETTINGS.AWS_REGION)
+
+
+def get_sqs_resource():
+    if SYS_SETTINGS.LOCAL_DATA_DIR:
+        return LocalQueues(SYS_SETTINGS.LOCAL_DATA_DIR)
+    return boto3.resource('sqs', region_name=SYS_SETTINGS.AWS_REGION)
+
+
+def get_queue(arn):
+    return sqs_resource.get_queue_by_name(
+        QueueName=arn.split(':')[-1],
+        QueueOwnerAWSAccountId=arn.split(':')[-2]
+    )
+
+
+# created when they are used first time
+s3_client = Lazy('s3_client', get_s3_client)
+sqs_resource = Lazy('sqs_resource', get_sqs_resource)
+requests_queue = Lazy('requests_queue', lambda: get_queue(SYS_SETTINGS.QUEUE_REQUESTS))
+results_queue = Lazy('results_queue', lambda: get_queue(SYS_SETTINGS.QUEUE_RESULTS))
+
+if SYS_SETTINGS.LOCAL_DATA_DIR:
+    redis_db = LocalRedis(SYS_SETTINGS.LOCAL_DATA_DIR)
+else:
+    redis_db = redis.StrictRedis.from_url(
+        SYS_SETTINGS.REDIS_CONNECTION
+    )
+
+
+subtask_dispatcher = SubtaskDispatcher(
+    redis_db,
+    requests_queue,
+    lru_size=SYS_SETTINGS.SUBTASKS_LRU_SIZE,
+    rules=CrawlRules.from_file(SYS_SETTINGS.CRAWL_RULES),
 )
 
-redis_db = redis.StrictRedis.from_url(
-    SYS_SETTINGS.REDIS_CONNECTION
+if SYS_SETTINGS.RECRAWL_ENABLED:
+    recrawl_scheduler = RecrawlScheduler(
+        redis_db,
+        subtask_dispatcher,
+        initial_interval=SYS_SETTINGS.RECRAWL_INITIAL_DAYS * DAY,
+        min_interval=SYS_SETTINGS.RECRAWL_MIN_DAYS * DAY,
+        max_interval=SYS_SETTINGS.RECRAWL_MAX_DAYS * DAY,
+        target_change=SYS_SETTINGS.RECRAWL_TARGET_CHANGE,
+        batch_size=SYS_SETTINGS.RECRAWL_BATCH_SIZE,
+        check_seconds=SYS_SETTINGS.RECRAWL_CHECK_SECONDS,
+    )
+else:
+    recrawl_scheduler = None
+
+
+def fetch_s3_object(bucket, key):
+    with metrics.timer('s3_seconds', op='get'):
+        return s3_client.get_object(Bucket=bucket, Key=key)['Body'].read()
+
+
+def delete_spilled_object(msg):
+    """Records which didn't fit into the message are in S3, not needed anymore"""
+    pointer = get_pointer(msg.body)
+    if pointer is None:
+        return
+    try:
+        with metrics.timer('s3_seconds', op='delete'):
+            s3_client.delete_object(Bucket=pointer['bucket'], Key=pointer['key'])
+    except Exception as e:
+        logger.warning("Can't delete %s: %s", pointer['key'], e)
+
+
+def get_records(data):
+    # crawler-node sends a single record per message, indexer-node sends lists
+    if isinstance(data, list):
+        return data
+    return [data]
+
+
+def on_message_indexed(msg, ok):
+    if msg is None:
+        return
+    metrics.inc('messages_indexed_total', ok=ok)
+    if ok:
+        try:
+            with metrics.timer('sqs_delete_seconds'):
+                msg.delete()
+        except Exception as e:
+            # indexed, it will be indexed once more after the visibility timeout
+            metrics.inc('sqs_delete_errors_total')
+            logger.error("Can't delete message %s: %s", msg.message_id, e)
+        else:
+            delete_spilled_object(msg)
+    else:
+        # it will be received again after the visibility timeout
+        logger.error("Message %s is not indexed completely, keeping it", msg.message_id)
+
+
+bulk_indexer = BulkIndexer(
+    es,
+    on_done=on_message_indexed,
+    max_docs=SYS_SETTINGS.ES_BULK_MAX_DOCS,
+    max_bytes=SYS_SETTINGS.ES_BULK_MAX_BYTES,
+    max_seconds=SYS_SETTINGS.ES_BULK_MAX_SECONDS,
 )
 
 
-def process_result(data):
-    pr = ResultProcessor(data)
-    # if we have some external domains - crawl them here
-    subtasks = pr.get_subtasks()
-    for subtask in subtasks:
-        subtask_already_sent = bool(redis_db.get(subtask))
-        if not subtask_already_sent:
-            # TODO: deduplicate using Redis or Postgres, not global variable
-            redis_db.set(subtask, datetime.datetime.utcnow().isoformat())
-            logger.info("Sending subtask %s...", subtask)
-            requests_queue.send_message(
-                MessageBody=subtask
-            )
+def process_results(batch):
+    """
+    Process list of (msg, data) pairs, each msg is deleted
+    once all records from its data are indexed
+    """
+    subtasks = []
+    records = []
+    for msg, data in batch:
+        bulk_indexer.open(msg)
+        try:
+            for record in get_records(data):
+                metrics.inc('records_total')
+                try:
+                    pr = ResultProcessor(record, bulk_indexer=bulk_indexer, ticket=msg)
+                except Exception as e:
+                    # the message is kept, the rest of its records are indexed anyway
+                    metrics.inc('records_failed_total')
+                    logger.exception("Can't process record %s: %s", record.get('identifier'), e)
+                    bulk_indexer.fail(msg)
+                    continue
+                records.append(record)
+                # if we have some external domains - crawl them here
+                if SYS_SETTINGS.SUBTASKS_ENABLED:
+                    subtasks.extend(pr.get_subtasks())
+        except Exception as e:
+            # not a list of records
+            logger.exception(e)
+            bulk_indexer.fail(msg)
+        finally:
+            bulk_indexer.close(msg)
+    with metrics.timer('dispatch_seconds'):
+        sent = subtask_dispatcher.dispatch(subtasks)
+    if recrawl_scheduler is not None:
+        recrawl_scheduler.observe(records)
+        recrawl_scheduler.add(sent)
     return
 
 
+def process_result(data):
+    process_results([(None, data)])
+    bulk_indexer.flush()
+
+
+if '--startup-time' in sys.argv:
+    # import and initialization cost of every component, then exit
+    warm_up(s3_client, sqs_resource, requests_queue, results_queue, es)
+    print(startup_report())
+    sys.exit(0)
+
+if SYS_SETTINGS.METRICS_ENABLED:
+    metrics.enable(port=SYS_SETTINGS.METRICS_PORT, log_seconds=SYS_SETTINGS.METRICS_LOG_SECONDS)
+
 if len(sys.argv) == 2:
     # ./worker.py jsonfile.json usage
-    demo_data = json.loads(open(sys.argv[1]).read())
+    demo_data = decode_envelope(open(sys.argv[1]).read(), fetch_object=fetch_s3_object)
     process_result(demo_data)
 else:
     # daemon usage
+    if recrawl_scheduler is not None:
+        try:
+            recrawl_scheduler.seed(read_seeds(SYS_SETTINGS.RECRAWL_SEEDS))
+        except IOError as e:
+            logger.warning("No recrawl seeds: %s", e)
     while True:
-        # get up to 5 messages from the queue
-        for msg in results_queue.receive_messages(MaxNumberOfMessages=10, WaitTimeSeconds=5):
+        if recrawl_scheduler is not None:
+            recrawl_scheduler.release()
+        # get up to 10 messages from the queue and process them together
+        batch = []
+        with metrics.timer('sqs_receive_seconds'):
+            messages = results_queue.receive_messages(MaxNumberOfMessages=10, WaitTimeSeconds=5)
+        for msg in messages:
+            metrics.inc('messages_total')
             try:
-                data = json.loads(msg.body)
+                data = decode_envelope(msg.body, fetch_object=fetch_s3_object)
+            except FetchError as e:
+                # S3 is unavailable, the message is received again after the visibility timeout
+                metrics.inc('messages_retried_total')
+                logger.warning("Message %s is kept: %s", msg.message_id, e)
             except Exception as e:
+                metrics.inc('messages_dropped_total')
                 logger.error("Wrong message received and dropped: %s", msg.body)
+                try:
+                    msg.delete()
+                except Exception as e:
+                    logger.error("Can't delete message %s: %s", msg.message_id, e)
             else:
-                msg.delete()
-                process_result(data)
+                batch.append((msg, data))
+        if batch:
+            process_results(batch)
+        bulk_indexer.flush_if_due()
@@ -1,13 +1,130 @@
 import datetime
+import time
 
 from elasticsearch import Elasticsearch
 
+from my_lazy import Lazy
+from my_local import LocalIndex
 from my_settings import SYS_SETTINGS
 from my_logging import logger  # NOQA
+from my_metrics import metrics
 
-es = Elasticsearch(
-    hosts=[SYS_SETTINGS.ANALYTICS_ES_ENDPOINT]
-)
+
+
+def get_es():
+    if SYS_SETTINGS.LOCAL_DATA_DIR and not SYS_SETTINGS.LOCAL_ES_ENABLED:
+        return LocalIndex(SYS_SETTINGS.LOCAL_DATA_DIR)
+    return Elasticsearch(
+        hosts=[SYS_SETTINGS.ANALYTICS_ES_ENDPOINT]
+    )
+
+
+es = Lazy('es', get_es)
+
+
+class BulkIndexer(object):
+    """
+    Collect documents and index them through the ES bulk API.
+
+    Buffer is flushed when it reaches `max_docs` documents, `max_bytes`
+    of encoded request body or is older than `max_seconds` (the last one
+    is checked by `flush_if_due`, which should be called periodically).
+
+    Documents are grouped by ticket (usually the SQS message they came
+    from). When all documents of a closed ticket are flushed `on_done` is
+    called with the ticket and a flag telling if all of them were indexed.
+    """
+
+    def __init__(self, es, on_done=None, max_docs=500, max_bytes=5 * 1024 * 1024, max_seconds=5):
+        self.es = es
+        self.on_done = on_done
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.lines = []
+        self.items = []  # ticket for every buffered document
+        self.size = 0
+        self.started_at = None
+        # ticket: [documents not yet flushed, all flushed ok, is closed]
+        self.tickets = {}
+
+    def open(self, ticket):
+        self.tickets[ticket] = [0, True, False]
+
+    def close(self, ticket):
+        """No more documents for this ticket are expected"""
+        self.tickets[ticket][2] = True
+        self._check_done(ticket)
+
+    def fail(self, ticket):
+        """Some documents of the ticket couldn't be even added"""
+        if ticket not in self.tickets:
+            self.open(ticket)
+        self.tickets[ticket][1] = False
+
+    def add(self, index, doc_type, id, body, ticket=None, op_type='index'):
+        """Buffer the document, op_type 'update' means body is a partial document"""
+        if ticket not in self.tickets:
+            self.open(ticket)
+        serializer = self.es.transport.serializer
+        action = serializer.dumps({op_type: {'_index': index, '_type': doc_type, '_id': id}})
+        source = serializer.dumps(body if op_type != 'update' else {'doc': body})
+        self.lines.append(action)
+        self.lines.append(source)
+        self.items.append(ticket)
+        self.size += len(action) + len(source) + 2
+        self.tickets[ticket][0] += 1
+        if self.started_at is None:
+            self.started_at = time.time()
+        if len(self.items) >= self.max_docs or self.size >= self.max_bytes:
+            self.flush()
+
+    def flush_if_due(self):
+        if self.started_at is not None and time.time() - self.started_at >= self.max_seconds:
+            self.flush()
+
+    def flush(self):
+        if not self.items:
+            return
+        body = '\n'.join(self.lines) + '\n'
+        items = self.items
+        self.lines = []
+        self.items = []
+        self.size = 0
+        self.started_at = None
+
+        try:
+            with metrics.timer('es_bulk_seconds'):
+                resp = self.es.bulk(body=body)
+            results = [list(x.items())[0] for x in resp['items']]
+        except Exception as e:
+            logger.exception(e)
+            results = [('index', {'error': str(e)})] * len(items)
+
+        failed = 0
+        for ticket, (op_type, result) in zip(items, results):
+            state = self.tickets[ticket]
+            state[0] -= 1
+            if op_type == 'update' and result.get('status') == 404:
+                # update of the document which isn't in the index (yet), nothing to refresh
+                logger.warning("Nothing to update for %s", result.get('_id'))
+            elif result.get('error') or result.get('status', 200) >= 300:
+                failed += 1
+                state[1] = False
+                logger.error("Failed to index %s: %s", result.get('_id'), result.get('error'))
+        logger.info("Bulk indexed %s documents, %s failed", len(items), failed)
+        metrics.inc('es_documents_total', len(items) - failed, result='ok')
+        metrics.inc('es_documents_total', failed, result='failed')
+
+        for ticket in set(items):
+            self._check_done(ticket)
+
+    def _check_done(self, ticket):
+        pending, ok, closed = self.tickets[ticket]
+        if closed and not pending:
+            del self.tickets[ticket]
+            if self.on_done:
+                self.on_done(ticket, ok)
 
 
 class ResultProcessor(object):
@@ -16,17 +133,39 @@ class ResultProcessor(object):
     * save them to ES
     * save them to RDS
     * return the list of further domains do crawl
+
+    If bulk_indexer is given ES documents are buffered there (under the
+    ticket) instead of being indexed right away.
     """
 
-    def __init__(self, data):
+    def __init__(self, data, bulk_indexer=None, ticket=None):
         self.data = data
-        self.process_es()
+        self.bulk_indexer = bulk_indexer
+        self.ticket = ticket
+        with metrics.timer('process_es_seconds'):
+            self.process_es()
         self.process_rds()
 
     def prepare_data(self):
         self.data['indexed_at'] = datetime.datetime.utcnow()
+        if self.is_duplicate():
+            # near duplicate of another page, mark the document if it's indexed already
+            return {'indexed_at': self.data['indexed_at'], 'duplicate_of': self.data['duplicate_of']}
+        if self.is_unchanged():
+            # page is not modified since the last crawl, only refresh the date
+            return {'indexed_at': self.data['indexed_at']}
         return self.data
 
+    def is_unchanged(self):
+        return bool(self.data.get('unchanged'))
+
+    def is_duplicate(self):
+        return bool(self.data.get('duplicate_of'))
+
+    def is_update(self):
+        """The record only updates the document, it doesn't have the page content"""
+        return self.is_unchanged() or self.is_duplicate()
+
     def process_es(self):
         tld = self.data['owner']
         if tld.endswith('.'):
@@ -35,6 +174,25 @@ class ResultProcessor(object):
         local_index_name = "{}-{}".format(SYS_SETTINGS.ANALYTICS_ES_INDEX_NAME, tld)
         # uncomment it if elastic doesn't support automatic index creation
         # es.indices.create(index=local_index_name, ignore=400)
+        if self.bulk_indexer is not None:
+            self.bulk_indexer.add(
+                index=local_index_name,
+                doc_type="recordversion",
+                id=self.data['identifier'],
+                body=self.prepare_data(),
+                ticket=self.ticket,
+                op_type='update' if self.is_update() else 'index'
+            )
+            return
+        if self.is_update():
+            es.update(
+                index=local_index_name,
+                doc_type="recordversion",
+                id=self.data['identifier'],
+                body={'doc': self.prepare_data()},
+                ignore=404
+            )
+            return
         es.index(
             index=local_index_name,
             doc_type="recordversion",
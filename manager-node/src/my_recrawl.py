@@ -0,0 +1,230 @@
+import datetime
+import json
+import time
+
+from my_logging import logger  # NOQA
+from my_metrics import metrics
+
+DAY = 24 * 60 * 60
+
+
+def read_seeds(path):
+    """Domain names from the file, one per line, comments and blanks skipped"""
+    with open(path) as f:
+        return [
+            line.strip().lower() for line in f
+            if line.strip() and not line.strip().startswith('#')
+        ]
+
+
+class DomainStats(object):
+    """
+    What we know about a domain, kept in Redis as JSON under
+    recrawl:domain:<name>. Counters are for the current crawl, they are
+    turned into `change_rate` and the next `interval` when the domain is
+    released again.
+    """
+    fields = ('last_crawl', 'interval', 'pages', 'compared', 'changed', 'change_rate', 'crawls')
+
+    def __init__(self, interval, **kwargs):
+        self.last_crawl = None
+        self.interval = interval
+        self.pages = 0
+        self.compared = 0
+        self.changed = 0
+        self.change_rate = None
+        self.crawls = 0
+        for name in self.fields:
+            if name in kwargs:
+                setattr(self, name, kwargs[name])
+
+    @classmethod
+    def loads(cls, value, interval):
+        if not value:
+            return cls(interval)
+        if isinstance(value, bytes):
+            value = value.decode('utf-8')
+        data = json.loads(value)
+        data.setdefault('interval', interval)
+        return cls(**data)
+
+    def dumps(self):
+        return json.dumps({name: getattr(self, name) for name in self.fields})
+
+
+class RecrawlScheduler(object):
+    """
+    Revisit known domains as often as their content changes.
+
+    Every domain has a due time in the recrawl:due sorted set, it's the
+    time-ordered queue: `release()` takes the domains which are due,
+    sends them to the crawlers and schedules them again `interval` seconds
+    later. The interval adapts to the fraction of pages found changed by
+    the previous crawl (their `Hash` differs from the one seen before):
+    it's scaled by `target_change / changed_fraction`, at most halved or
+    doubled per crawl (when nothing changed) and kept between
+    `min_interval` and `max_interval`. So stable sites are crawled rarely
+    and busy ones often.
+
+    Domains are claimed with ZREM, so several managers may share the queue.
+    """
+    due_key = 'recrawl:due'
+    domain_prefix = 'recrawl:domain:'
+    hash_prefix = 'recrawl:hash:'
+
+    def __init__(self, redis_db, dispatcher, initial_interval=7 * DAY, min_interval=DAY,
+                 max_interval=90 * DAY, target_change=0.1, batch_size=100, check_seconds=60):
+        self.redis_db = redis_db
+        self.dispatcher = dispatcher
+        self.initial_interval = initial_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.target_change = target_change
+        self.batch_size = batch_size
+        self.check_seconds = check_seconds
+        self.last_check = 0
+
+    def seed(self, domains):
+        """Schedule the domains right away, unless they are scheduled already"""
+        now = time.time()
+        pipe = self.redis_db.pipeline(transaction=False)
+        for domain in domains:
+            pipe.zadd(self.due_key, {domain: now}, nx=True)
+        added = sum(1 for result in pipe.execute() if result)
+        logger.info("Recrawl seeds: %s domains, %s new", len(domains), added)
+        return added
+
+    def add(self, domains):
+        """Domains just sent by the dispatcher, revisit them after the initial interval"""
+        if not domains:
+            return
+        now = time.time()
+        stats = DomainStats(self.initial_interval, last_crawl=now, crawls=1).dumps()
+        pipe = self.redis_db.pipeline(transaction=False)
+        for domain in domains:
+            pipe.zadd(self.due_key, {domain: now + self.initial_interval}, nx=True)
+            pipe.set(self.domain_prefix + domain, stats, nx=True)
+        pipe.execute()
+
+    def observe(self, records):
+        """
+        Count pages and changed pages of the records per domain. Page
+        content hashes are remembered for the next crawl to compare with.
+        Domains which were never released (or added) aren't tracked.
+        """
+        records = [r for r in records if r.get('owner') and r.get('identifier')]
+        if not records:
+            return
+        domains = sorted(set(r['owner'] for r in records))
+        pipe = self.redis_db.pipeline(transaction=False)
+        for domain in domains:
+            pipe.get(self.domain_prefix + domain)
+        for record in records:
+            pipe.get(self.hash_prefix + record['identifier'])
+        values = pipe.execute()
+        stats = {
+            domain: DomainStats.loads(value, self.initial_interval)
+            for domain, value in zip(domains, values) if value is not None
+        }
+
+        pipe = self.redis_db.pipeline(transaction=False)
+        for record, old_hash in zip(records, values[len(domains):]):
+            domain_stats = stats.get(record['owner'])
+            if domain_stats is None:
+                continue
+            domain_stats.pages += 1
+            if record.get('unchanged'):
+                # not modified since the last crawl (HTTP 304)
+                domain_stats.compared += 1
+                continue
+            new_hash = record.get('Hash')
+            if not new_hash:
+                continue
+            if old_hash is not None:
+                domain_stats.compared += 1
+                if old_hash.decode('utf-8') != new_hash:
+                    domain_stats.changed += 1
+            pipe.set(self.hash_prefix + record['identifier'], new_hash, ex=int(self.max_interval * 2))
+        for domain, domain_stats in stats.items():
+            pipe.set(self.domain_prefix + domain, domain_stats.dumps())
+        with metrics.timer('redis_seconds', op='recrawl_observe'):
+            pipe.execute()
+
+    def next_interval(self, stats):
+        if not stats.compared:
+            # first crawl or nothing to compare, no reason to change it
+            interval = stats.interval
+        else:
+            changed_fraction = stats.changed / stats.compared
+            if changed_fraction:
+                factor = self.target_change / changed_fraction
+            else:
+                factor = 2
+            interval = stats.interval * min(2, max(0.5, factor))
+        return min(self.max_interval, max(self.min_interval, interval))
+
+    def reschedule(self, stats, now):
+        """Close the previous crawl of the domain, start the new one"""
+        if stats.compared:
+            changed_fraction = stats.changed / stats.compared
+            if stats.change_rate is None:
+                stats.change_rate = changed_fraction
+            else:
+                stats.change_rate = round(0.5 * stats.change_rate + 0.5 * changed_fraction, 4)
+        stats.interval = int(self.next_interval(stats))
+        stats.last_crawl = now
+        stats.crawls += 1
+        stats.pages = stats.compared = stats.changed = 0
+        return stats
+
+    def due(self, now, count):
+        """Claim up to `count` domains which are due"""
+        domains = [
+            domain.decode('utf-8') if isinstance(domain, bytes) else domain
+            for domain in self.redis_db.zrangebyscore(self.due_key, '-inf', now, start=0, num=count)
+        ]
+        if not domains:
+            return []
+        pipe = self.redis_db.pipeline(transaction=False)
+        for domain in domains:
+            pipe.zrem(self.due_key, domain)
+        # another manager could take some of them meanwhile
+        return [domain for domain, removed in zip(domains, pipe.execute()) if removed]
+
+    def release(self, force=False):
+        """Send due domains to the crawlers, called from the manager loop"""
+        now = time.time()
+        if not force and now - self.last_check < self.check_seconds:
+            return []
+        self.last_check = now
+        with metrics.timer('redis_seconds', op='recrawl_due'):
+            domains = self.due(now, self.batch_size)
+        if not domains:
+            return []
+
+        pipe = self.redis_db.pipeline(transaction=False)
+        for domain in domains:
+            pipe.get(self.domain_prefix + domain)
+        stats = [DomainStats.loads(value, self.initial_interval) for value in pipe.execute()]
+
+        failed = set(self.dispatcher.send(domains))
+        pipe = self.redis_db.pipeline(transaction=False)
+        for domain, domain_stats in zip(domains, stats):
+            if domain in failed:
+                # back to the queue as it was, next check retries it
+                pipe.zadd(self.due_key, {domain: now})
+                continue
+            previous = (domain_stats.pages, domain_stats.changed, domain_stats.compared)
+            domain_stats = self.reschedule(domain_stats, now)
+            logger.info(
+                "Recrawl %s: %s pages, %s of %s changed last time, next in %s days",
+                domain, previous[0], previous[1], previous[2], round(domain_stats.interval / DAY, 1)
+            )
+            pipe.set(self.domain_prefix + domain, domain_stats.dumps())
+            pipe.zadd(self.due_key, {domain: now + domain_stats.interval})
+            # the dispatcher won't send it again as a new external domain
+            pipe.set(domain, datetime.datetime.utcnow().isoformat())
+        pipe.execute()
+        released = [domain for domain in domains if domain not in failed]
+        metrics.inc('recrawl_domains_total', len(released))
+        return released
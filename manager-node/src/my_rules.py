@@ -0,0 +1,137 @@
+"""
+Crawl rules compiled for fast checks, the same file is used by
+indexer-node and manager-node.
+
+Rules file, one rule per line, # comments:
+
+    follow gov.au                # external domains under gov.au are crawled
+    nofollow vic.gov.au nsw.gov.au
+    max-pages . 500              # "." is the root, i.e. any domain
+    max-pages gov.au 3000
+    deny-domain ^trove\\.nla\\.gov\\.au$     # regex, matched against the host
+    deny-url ^http://example\\.gov\\.au/search\\.asp
+    deny-extension gif jpeg png
+
+Suffix rules go to a trie of reversed domain labels (au -> gov -> vic), a
+host lookup is a walk of its labels where the deepest (longest suffix)
+setting wins. Domain and URL regexes are joined into one regex each,
+extensions are a part of the URL one.
+"""
+import re
+
+DEFAULT_MAX_PAGES = 500
+
+
+def normalize_host(host):
+    """Lowercase host name without port and trailing dot"""
+    host = host.strip().lower()
+    if host.startswith('['):
+        # IPv6 literal
+        return host.split(']')[0] + ']'
+    return host.split(':')[0].rstrip('.')
+
+
+def join_patterns(patterns):
+    if not patterns:
+        return None
+    return re.compile('|'.join('(?:{})'.format(pattern) for pattern in patterns))
+
+
+class DomainTrie(object):
+    """Settings of domain suffixes, keyed by reversed labels"""
+
+    def __init__(self):
+        self.root = {}
+        # node: {label: child node}, settings of a node are under None key
+
+    def set(self, suffix, name, value):
+        node = self.root
+        if suffix not in ('.', ''):
+            for label in reversed(normalize_host(suffix).split('.')):
+                node = node.setdefault(label, {})
+        node.setdefault(None, {})[name] = value
+
+    def lookup(self, host):
+        """Settings of the host, deeper suffixes override the shorter ones"""
+        node = self.root
+        settings = dict(node.get(None, {}))
+        for label in reversed(host.split('.')):
+            node = node.get(label)
+            if node is None:
+                break
+            settings.update(node.get(None, {}))
+        return settings
+
+
+class CrawlRules(object):
+    def __init__(self, default_max_pages=DEFAULT_MAX_PAGES):
+        self.trie = DomainTrie()
+        self.trie.set('.', 'follow', True)
+        self.trie.set('.', 'max_pages', default_max_pages)
+        self.domain_patterns = []
+        self.url_patterns = []
+        self.extensions = []
+        self.domain_regex = None
+        self.url_regex = None
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        rules = cls(**kwargs)
+        with open(path) as f:
+            rules.parse(f.read().splitlines())
+        return rules
+
+    def parse(self, lines):
+        for number, line in enumerate(lines, 1):
+            line = line.split(' #')[0].strip()
+            if not line or line.startswith('#'):
+                continue
+            action, _, argument = line.partition(' ')
+            args = argument.split()
+            if not args:
+                raise ValueError("Rule without arguments, line {}: {}".format(number, line))
+            if action == 'follow':
+                for suffix in args:
+                    self.trie.set(suffix, 'follow', True)
+            elif action == 'nofollow':
+                for suffix in args:
+                    self.trie.set(suffix, 'follow', False)
+            elif action == 'max-pages':
+                self.trie.set(args[0], 'max_pages', int(args[1]))
+            elif action == 'deny-domain':
+                self.domain_patterns.append(argument.strip())
+            elif action == 'deny-url':
+                self.url_patterns.append(argument.strip())
+            elif action == 'deny-extension':
+                self.extensions.extend(ext.lstrip('.').lower() for ext in args)
+            else:
+                raise ValueError("Unknown rule, line {}: {}".format(number, line))
+        self.compile()
+        return self
+
+    def compile(self):
+        self.domain_regex = join_patterns(self.domain_patterns)
+        url_patterns = list(self.url_patterns)
+        if self.extensions:
+            # extension of the path, query and fragment don't matter
+            url_patterns.append(r'(?i:\.(?:{})(?:[?#]|$))'.format(
+                '|'.join(re.escape(ext) for ext in sorted(set(self.extensions)))
+            ))
+        self.url_regex = join_patterns(url_patterns)
+
+    def is_excluded_domain(self, host):
+        """The domain is never crawled"""
+        return bool(self.domain_regex and self.domain_regex.search(normalize_host(host)))
+
+    def should_follow(self, host):
+        """External domain found on a page is worth crawling"""
+        host = normalize_host(host)
+        if not host or (self.domain_regex and self.domain_regex.search(host)):
+            return False
+        return self.trie.lookup(host).get('follow', False)
+
+    def max_pages(self, host):
+        return self.trie.lookup(normalize_host(host)).get('max_pages')
+
+    def can_queue(self, url):
+        return not (self.url_regex and self.url_regex.search(url))
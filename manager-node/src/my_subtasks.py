@@ -0,0 +1,121 @@
+import datetime
+from collections import OrderedDict
+
+from my_logging import logger  # NOQA
+from my_metrics import metrics
+
+# SQS doesn't accept more than 10 entries in a single batch request
+SQS_BATCH_SIZE = 10
+
+
+class LRUCache(object):
+    """
+    Tiny in-process LRU set of recently seen keys
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.items = OrderedDict()
+
+    def __contains__(self, key):
+        if key in self.items:
+            self.items.move_to_end(key)
+            return True
+        return False
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(self, key):
+        self.items[key] = True
+        self.items.move_to_end(key)
+        while len(self.items) > self.size:
+            self.items.popitem(last=False)
+
+    def discard(self, key):
+        self.items.pop(key, None)
+
+
+class SubtaskDispatcher(object):
+    """
+    Send new domains to the crawlers, each domain only once.
+
+    Domains the crawl rules don't follow are dropped right away, the rest
+    are claimed in Redis with a single pipelined SET NX round trip for the
+    whole batch, recently seen domains don't even reach Redis. Only the
+    claimed domains are sent, 10 per SQS batch request.
+    """
+
+    def __init__(self, redis_db, requests_queue, lru_size=10000, rules=None):
+        self.redis_db = redis_db
+        self.requests_queue = requests_queue
+        self.recent = LRUCache(lru_size)
+        self.rules = rules
+
+    def claim(self, subtasks):
+        """Return the subtasks which were never sent before, marking them sent"""
+        candidates = []
+        rejected = 0
+        for subtask in subtasks:
+            if not subtask or subtask in self.recent:
+                continue
+            if self.rules is not None and not self.rules.should_follow(subtask):
+                rejected += 1
+                continue
+            # mark it recent right away, this also drops duplicates in the batch
+            self.recent.add(subtask)
+            candidates.append(subtask)
+        metrics.inc('subtasks_total', len(subtasks))
+        metrics.inc('subtasks_rejected_total', rejected)
+        if not candidates:
+            return []
+
+        now = datetime.datetime.utcnow().isoformat()
+        pipe = self.redis_db.pipeline(transaction=False)
+        for subtask in candidates:
+            pipe.set(subtask, now, nx=True)
+        with metrics.timer('redis_seconds', op='claim'):
+            is_new_flags = pipe.execute()
+        claimed = []
+        for subtask, is_new in zip(candidates, is_new_flags):
+            if is_new:
+                claimed.append(subtask)
+        return claimed
+
+    def send(self, subtasks):
+        """Send subtasks to the requests queue, return the list of failed ones"""
+        failed = []
+        for start in range(0, len(subtasks), SQS_BATCH_SIZE):
+            chunk = subtasks[start:start + SQS_BATCH_SIZE]
+            logger.info("Sending subtasks %s...", ', '.join(chunk))
+            try:
+                with metrics.timer('sqs_send_seconds', queue='requests'):
+                    resp = self.requests_queue.send_messages(Entries=[
+                        {'Id': str(i), 'MessageBody': subtask}
+                        for i, subtask in enumerate(chunk)
+                    ])
+            except Exception as e:
+                logger.exception(e)
+                failed.extend(chunk)
+                continue
+            for entry in resp.get('Failed', []):
+                logger.error("Failed to send subtask: %s", entry)
+                failed.append(chunk[int(entry['Id'])])
+        return failed
+
+    def release(self, subtasks):
+        """Forget about subtasks, so they can be claimed again"""
+        if not subtasks:
+            return
+        with metrics.timer('redis_seconds', op='release'):
+            self.redis_db.delete(*subtasks)
+        for subtask in subtasks:
+            self.recent.discard(subtask)
+
+    def dispatch(self, subtasks):
+        claimed = self.claim(subtasks)
+        metrics.inc('subtasks_claimed_total', len(claimed))
+        failed = self.send(claimed)
+        # don't lose the domains we couldn't send, they will be retried
+        self.release(failed)
+        return [subtask for subtask in claimed if subtask not in failed]
@@ -0,0 +1,134 @@
+import json
+
+from my_processors import BulkIndexer
+
+
+class Serializer(object):
+    def dumps(self, data):
+        return json.dumps(data)
+
+
+class Transport(object):
+    serializer = Serializer()
+
+
+class FakeES(object):
+    """Bulk API answering with the given statuses by document id"""
+
+    transport = Transport()
+
+    def __init__(self, statuses=None, error=None):
+        self.statuses = statuses or {}
+        self.error = error
+        self.requests = []
+
+    def bulk(self, body):
+        if self.error:
+            raise self.error
+        lines = body.splitlines()
+        self.requests.append(lines)
+        items = []
+        for line in lines[::2]:
+            (op_type, action), = json.loads(line).items()
+            items.append({op_type: {'_id': action['_id'], 'status': self.statuses.get(action['_id'], 201)}})
+        return {'items': items}
+
+
+def make_indexer(es, **kwargs):
+    done = []
+    indexer = BulkIndexer(es, on_done=lambda ticket, ok: done.append((ticket, ok)), **kwargs)
+    return indexer, done
+
+
+def test_ticket_is_done_when_closed_and_flushed():
+    es = FakeES()
+    indexer, done = make_indexer(es)
+    indexer.open('msg1')
+    indexer.add('index', 'doc', 'a', {'title': 'a'}, ticket='msg1')
+    indexer.add('index', 'doc', 'b', {'title': 'b'}, ticket='msg1')
+    indexer.flush()
+    # more documents may come
+    assert done == []
+    indexer.close('msg1')
+    assert done == [('msg1', True)]
+    assert indexer.tickets == {}
+    assert len(es.requests[0]) == 4
+
+
+def test_ticket_without_documents():
+    indexer, done = make_indexer(FakeES())
+    indexer.open('msg1')
+    indexer.close('msg1')
+    assert done == [('msg1', True)]
+
+
+def test_closed_ticket_waits_for_the_flush():
+    indexer, done = make_indexer(FakeES())
+    indexer.add('index', 'doc', 'a', {}, ticket='msg1')
+    indexer.close('msg1')
+    assert done == []
+    indexer.flush()
+    assert done == [('msg1', True)]
+
+
+def test_failed_documents_fail_only_their_ticket():
+    indexer, done = make_indexer(FakeES({'b': 500}))
+    for ticket, id in [('msg1', 'a'), ('msg2', 'b'), ('msg2', 'c')]:
+        indexer.add('index', 'doc', id, {}, ticket=ticket)
+    indexer.close('msg1')
+    indexer.close('msg2')
+    indexer.flush()
+    assert sorted(done) == [('msg1', True), ('msg2', False)]
+
+
+def test_es_errors_fail_all_tickets():
+    indexer, done = make_indexer(FakeES(error=IOError('ES is down')))
+    indexer.add('index', 'doc', 'a', {}, ticket='msg1')
+    indexer.add('index', 'doc', 'b', {}, ticket='msg2')
+    indexer.close('msg1')
+    indexer.close('msg2')
+    indexer.flush()
+    assert sorted(done) == [('msg1', False), ('msg2', False)]
+    assert indexer.tickets == {}
+
+
+def test_missing_document_of_update_is_not_a_failure():
+    es = FakeES({'a': 404})
+    indexer, done = make_indexer(es)
+    indexer.add('index', 'doc', 'a', {'title': 'a'}, ticket='msg1', op_type='update')
+    indexer.close('msg1')
+    indexer.flush()
+    assert done == [('msg1', True)]
+    assert json.loads(es.requests[0][1]) == {'doc': {'title': 'a'}}
+
+
+def test_fail_marks_the_ticket():
+    indexer, done = make_indexer(FakeES())
+    indexer.fail('msg1')
+    indexer.add('index', 'doc', 'a', {}, ticket='msg1')
+    indexer.close('msg1')
+    indexer.flush()
+    assert done == [('msg1', False)]
+
+
+def test_flush_by_size():
+    es = FakeES()
+    indexer, done = make_indexer(es, max_docs=2)
+    for id in 'abcde':
+        indexer.add('index', 'doc', id, {}, ticket='msg1')
+    assert len(es.requests) == 2
+    indexer.close('msg1')
+    assert done == []
+    indexer.flush()
+    assert done == [('msg1', True)]
+    assert [len(lines) for lines in es.requests] == [4, 4, 2]
+
+
+def test_flush_if_due():
+    es = FakeES()
+    indexer, done = make_indexer(es, max_seconds=0)
+    indexer.flush_if_due()
+    assert es.requests == []
+    indexer.add('index', 'doc', 'a', {}, ticket='msg1')
+    indexer.flush_if_due()
+    assert len(es.requests) == 1
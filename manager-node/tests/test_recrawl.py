@@ -0,0 +1,176 @@
+import json
+
+import pytest
+
+import my_recrawl
+from my_local import LocalRedis
+from my_recrawl import DAY, DomainStats, RecrawlScheduler, read_seeds
+
+
+class Clock(object):
+    """Stands for the time module in my_recrawl"""
+
+    def __init__(self, now=1000000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+class FakeDispatcher(object):
+    def __init__(self, failed=()):
+        self.failed = failed
+        self.sent = []
+
+    def send(self, subtasks):
+        self.sent.append(list(subtasks))
+        return [subtask for subtask in subtasks if subtask in self.failed]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(my_recrawl, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def redis_db(tmpdir):
+    return LocalRedis(str(tmpdir))
+
+
+def make_scheduler(redis_db, dispatcher=None, **kwargs):
+    return RecrawlScheduler(redis_db, dispatcher or FakeDispatcher(), check_seconds=0, **kwargs)
+
+
+def crawl(scheduler, domain, hashes):
+    """Records of a crawl of the domain, page path: content hash"""
+    scheduler.observe([
+        {'owner': domain, 'identifier': 'http://{}/{}'.format(domain, path), 'Hash': value}
+        for path, value in sorted(hashes.items())
+    ])
+
+
+def get_stats(redis_db, domain):
+    return json.loads(redis_db.get(RecrawlScheduler.domain_prefix + domain).decode('utf-8'))
+
+
+def test_read_seeds(tmpdir):
+    path = tmpdir.join('seeds.txt')
+    path.write('# seeds\n\nA.gov.au\n  b.gov.au  \n')
+    assert read_seeds(str(path)) == ['a.gov.au', 'b.gov.au']
+
+
+def test_domain_stats_round_trip():
+    stats = DomainStats.loads(DomainStats(DAY, pages=3, crawls=2).dumps().encode('utf-8'), 7 * DAY)
+    assert (stats.interval, stats.pages, stats.crawls, stats.change_rate) == (DAY, 3, 2, None)
+    assert DomainStats.loads(None, 7 * DAY).interval == 7 * DAY
+
+
+def test_seeds_are_released_once(clock, redis_db):
+    dispatcher = FakeDispatcher()
+    scheduler = make_scheduler(redis_db, dispatcher)
+    assert scheduler.seed(['a.gov.au', 'b.gov.au']) == 2
+    assert scheduler.release() == ['a.gov.au', 'b.gov.au']
+    # scheduled already, seeding doesn't make them due again
+    assert scheduler.seed(['a.gov.au', 'c.gov.au']) == 1
+    assert scheduler.release() == ['c.gov.au']
+    assert scheduler.release() == []
+    assert dispatcher.sent == [['a.gov.au', 'b.gov.au'], ['c.gov.au']]
+    # marked sent for the dispatcher of new domains
+    assert redis_db.get('a.gov.au') is not None
+
+    clock.now += 7 * DAY
+    assert scheduler.release() == ['a.gov.au', 'b.gov.au', 'c.gov.au']
+
+
+def test_release_is_throttled(clock, redis_db):
+    scheduler = RecrawlScheduler(redis_db, FakeDispatcher(), check_seconds=60)
+    scheduler.seed(['a.gov.au'])
+    scheduler.last_check = clock.now
+    assert scheduler.release() == []
+    assert scheduler.release(force=True) == ['a.gov.au']
+
+
+def test_failed_domains_stay_due(clock, redis_db):
+    dispatcher = FakeDispatcher(failed=('b.gov.au',))
+    scheduler = make_scheduler(redis_db, dispatcher)
+    scheduler.seed(['a.gov.au', 'b.gov.au'])
+    assert scheduler.release() == ['a.gov.au']
+    dispatcher.failed = ()
+    assert scheduler.release() == ['b.gov.au']
+
+
+def test_sent_domains_are_revisited(clock, redis_db):
+    scheduler = make_scheduler(redis_db)
+    scheduler.add(['a.gov.au'])
+    assert scheduler.release() == []
+    assert get_stats(redis_db, 'a.gov.au')['crawls'] == 1
+    clock.now += 7 * DAY
+    assert scheduler.release() == ['a.gov.au']
+
+
+@pytest.mark.parametrize('changed, interval', [
+    # nothing changed: doubled
+    (0, 14 * DAY),
+    # 10% changed, as targeted: kept
+    (1, 7 * DAY),
+    # 20% changed: halved
+    (2, 3.5 * DAY),
+    # everything changed: halved at most
+    (10, 3.5 * DAY),
+])
+def test_interval_follows_the_changes(clock, redis_db, changed, interval):
+    scheduler = make_scheduler(redis_db)
+    scheduler.seed(['a.gov.au'])
+    scheduler.release()
+    hashes = {str(i): 'old' for i in range(10)}
+    crawl(scheduler, 'a.gov.au', hashes)
+    assert scheduler.release() == []
+
+    clock.now += 7 * DAY
+    scheduler.release()
+    hashes.update({str(i): 'new' for i in range(changed)})
+    crawl(scheduler, 'a.gov.au', hashes)
+    stats = get_stats(redis_db, 'a.gov.au')
+    assert (stats['pages'], stats['compared'], stats['changed']) == (10, 10, changed)
+
+    clock.now += 7 * DAY
+    assert scheduler.release() == ['a.gov.au']
+    stats = get_stats(redis_db, 'a.gov.au')
+    assert stats['interval'] == int(interval)
+    assert stats['change_rate'] == changed / 10
+    assert stats['pages'] == 0
+    clock.now += interval - 1
+    assert scheduler.release() == []
+    clock.now += 1
+    assert scheduler.release() == ['a.gov.au']
+
+
+def test_interval_bounds(redis_db):
+    scheduler = make_scheduler(redis_db, min_interval=DAY, max_interval=10 * DAY)
+    assert scheduler.next_interval(DomainStats(8 * DAY, compared=5, changed=0)) == 10 * DAY
+    assert scheduler.next_interval(DomainStats(1.5 * DAY, compared=5, changed=5)) == DAY
+    assert scheduler.next_interval(DomainStats(3 * DAY)) == 3 * DAY
+
+
+def test_change_rate_is_smoothed(redis_db):
+    scheduler = make_scheduler(redis_db)
+    stats = scheduler.reschedule(DomainStats(DAY, compared=10, changed=4), 0)
+    assert stats.change_rate == 0.4
+    stats.compared, stats.changed = 10, 0
+    assert scheduler.reschedule(stats, 0).change_rate == 0.2
+
+
+def test_unknown_domains_arent_tracked(clock, redis_db):
+    scheduler = make_scheduler(redis_db)
+    crawl(scheduler, 'a.gov.au', {'': 'hash'})
+    assert redis_db.get(RecrawlScheduler.domain_prefix + 'a.gov.au') is None
+
+
+def test_not_modified_pages_count_as_unchanged(clock, redis_db):
+    scheduler = make_scheduler(redis_db)
+    scheduler.add(['a.gov.au'])
+    scheduler.observe([{'owner': 'a.gov.au', 'identifier': 'http://a.gov.au/', 'unchanged': True}])
+    stats = get_stats(redis_db, 'a.gov.au')
+    assert (stats['pages'], stats['compared'], stats['changed']) == (1, 1, 0)
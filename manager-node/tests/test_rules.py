@@ -0,0 +1,97 @@
+import os
+
+import pytest
+
+from conftest import SRC_DIR
+from my_rules import DEFAULT_MAX_PAGES, CrawlRules, DomainTrie, normalize_host
+
+
+def make_rules(*lines):
+    return CrawlRules().parse(lines)
+
+
+def test_normalize_host():
+    assert normalize_host(' Example.GOV.au.:8080 ') == 'example.gov.au'
+    assert normalize_host('[::1]:8080') == '[::1]'
+
+
+def test_deeper_suffix_wins():
+    trie = DomainTrie()
+    trie.set('.', 'follow', False)
+    trie.set('gov.au', 'follow', True)
+    trie.set('vic.gov.au', 'follow', False)
+    assert trie.lookup('health.gov.au') == {'follow': True}
+    assert trie.lookup('health.vic.gov.au') == {'follow': False}
+    assert trie.lookup('example.com') == {'follow': False}
+    # a suffix is matched by whole labels only
+    assert trie.lookup('gov.au.example.com') == {'follow': False}
+    assert trie.lookup('agov.au') == {'follow': False}
+
+
+def test_parse():
+    rules = make_rules(
+        '# comment',
+        '',
+        'nofollow .',
+        'follow gov.au  # Commonwealth',
+        'nofollow vic.gov.au nsw.gov.au',
+        'max-pages gov.au 3000',
+        'deny-domain ^trove\\.nla\\.gov\\.au$',
+        'deny-url ^http://example\\.gov\\.au/search\\.asp',
+        'deny-extension .GIF png',
+    )
+    assert rules.domain_patterns == ['^trove\\.nla\\.gov\\.au$']
+    assert rules.url_patterns == ['^http://example\\.gov\\.au/search\\.asp']
+    assert rules.extensions == ['gif', 'png']
+    assert rules.max_pages('health.gov.au') == 3000
+    assert rules.max_pages('example.com') == DEFAULT_MAX_PAGES
+
+
+@pytest.mark.parametrize('line', ['follow', 'block gov.au'])
+def test_parse_errors(line):
+    with pytest.raises(ValueError, match='line 2'):
+        make_rules('follow gov.au', line)
+
+
+def test_follow_precedence():
+    rules = make_rules('nofollow .', 'follow gov.au', 'nofollow vic.gov.au')
+    assert rules.should_follow('www.health.gov.au')
+    assert rules.should_follow('WWW.Health.gov.au:443')
+    assert not rules.should_follow('www.education.vic.gov.au')
+    assert not rules.should_follow('example.com')
+    assert not rules.should_follow('')
+    # without any rule everything is followed
+    assert make_rules().should_follow('example.com')
+
+
+def test_denied_domains_are_never_followed():
+    rules = make_rules('follow gov.au', 'deny-domain ^trove\\.nla\\.gov\\.au$ ')
+    assert rules.is_excluded_domain('Trove.nla.gov.au')
+    assert not rules.should_follow('trove.nla.gov.au')
+    assert not rules.is_excluded_domain('www.nla.gov.au')
+    assert rules.should_follow('www.nla.gov.au')
+
+
+def test_can_queue():
+    rules = make_rules('deny-url ^http://example\\.gov\\.au/search', 'deny-extension gif zip')
+    assert not rules.can_queue('http://example.gov.au/search?q=1')
+    assert rules.can_queue('https://example.gov.au/search')
+    assert not rules.can_queue('http://example.gov.au/logo.GIF')
+    assert not rules.can_queue('http://example.gov.au/files.zip?download=1')
+    assert not rules.can_queue('http://example.gov.au/files.zip#top')
+    assert rules.can_queue('http://example.gov.au/zip/page')
+    assert rules.can_queue('http://example.gov.au/gif.html')
+    assert make_rules().can_queue('http://example.gov.au/logo.gif')
+
+
+def test_crawl_rules_file():
+    rules = CrawlRules.from_file(os.path.join(SRC_DIR, 'crawl_rules.txt'))
+    assert rules.should_follow('www.health.gov.au')
+    assert not rules.should_follow('www.vic.gov.au')
+    assert not rules.should_follow('www.example.com')
+    assert not rules.should_follow('trove.nla.gov.au')
+    assert rules.is_excluded_domain('pandora.nla.gov.au')
+    assert rules.max_pages('www.health.gov.au') == 3000
+    assert rules.max_pages('www.example.com') == 500
+    assert not rules.can_queue('http://www.health.gov.au/logo.png')
+    assert rules.can_queue('http://www.health.gov.au/about')
@@ -0,0 +1,95 @@
+import pytest
+
+from my_local import LocalRedis
+from my_rules import CrawlRules
+from my_subtasks import LRUCache, SubtaskDispatcher
+
+
+class FakeQueue(object):
+    def __init__(self, error=None, failed=()):
+        self.error = error
+        self.failed = failed
+        self.requests = []
+
+    def send_messages(self, Entries):
+        self.requests.append([entry['MessageBody'] for entry in Entries])
+        if self.error:
+            raise self.error
+        return {'Failed': [
+            {'Id': entry['Id'], 'Code': 'InternalError'}
+            for entry in Entries if entry['MessageBody'] in self.failed
+        ]}
+
+    @property
+    def sent(self):
+        return [body for request in self.requests for body in request if body not in self.failed]
+
+
+@pytest.fixture
+def redis_db(tmpdir):
+    return LocalRedis(str(tmpdir))
+
+
+def test_lru_cache():
+    cache = LRUCache(2)
+    cache.add('a')
+    cache.add('b')
+    assert 'a' in cache
+    # "a" was used, "b" is the least recent one
+    cache.add('c')
+    assert 'b' not in cache
+    assert 'a' in cache and 'c' in cache
+    assert len(cache) == 2
+    cache.discard('a')
+    cache.discard('x')
+    assert len(cache) == 1
+
+
+def test_domains_are_sent_once(redis_db):
+    queue = FakeQueue()
+    dispatcher = SubtaskDispatcher(redis_db, queue)
+    assert dispatcher.dispatch(['a.gov.au', 'b.gov.au', 'a.gov.au', '']) == ['a.gov.au', 'b.gov.au']
+    assert dispatcher.dispatch(['a.gov.au', 'c.gov.au']) == ['c.gov.au']
+    # another manager shares Redis, not the recent domains
+    other = SubtaskDispatcher(redis_db, queue)
+    assert other.dispatch(['a.gov.au', 'b.gov.au', 'd.gov.au']) == ['d.gov.au']
+    assert queue.sent == ['a.gov.au', 'b.gov.au', 'c.gov.au', 'd.gov.au']
+
+
+def test_recent_domains_dont_reach_redis(redis_db):
+    dispatcher = SubtaskDispatcher(redis_db, FakeQueue())
+    dispatcher.dispatch(['a.gov.au'])
+    redis_db.delete('a.gov.au')
+    assert dispatcher.dispatch(['a.gov.au']) == []
+    assert redis_db.get('a.gov.au') is None
+
+
+def test_batches_of_ten(redis_db):
+    queue = FakeQueue()
+    subtasks = ['{}.gov.au'.format(i) for i in range(25)]
+    assert SubtaskDispatcher(redis_db, queue).dispatch(subtasks) == subtasks
+    assert [len(request) for request in queue.requests] == [10, 10, 5]
+
+
+def test_rules_drop_domains(redis_db):
+    queue = FakeQueue()
+    rules = CrawlRules().parse(['nofollow .', 'follow gov.au', 'nofollow vic.gov.au'])
+    dispatcher = SubtaskDispatcher(redis_db, queue, rules=rules)
+    assert dispatcher.dispatch(['a.gov.au', 'example.com', 'b.vic.gov.au']) == ['a.gov.au']
+    assert redis_db.get('example.com') is None
+    assert queue.sent == ['a.gov.au']
+
+
+def test_failed_domains_are_released(redis_db):
+    queue = FakeQueue(failed=('b.gov.au',))
+    dispatcher = SubtaskDispatcher(redis_db, queue)
+    assert dispatcher.dispatch(['a.gov.au', 'b.gov.au']) == ['a.gov.au']
+    assert redis_db.get('b.gov.au') is None
+    queue.failed = ()
+    assert dispatcher.dispatch(['a.gov.au', 'b.gov.au']) == ['b.gov.au']
+
+    queue = FakeQueue(error=IOError('SQS is down'))
+    dispatcher = SubtaskDispatcher(redis_db, queue)
+    assert dispatcher.dispatch(['c.gov.au']) == []
+    queue.error = None
+    assert dispatcher.dispatch(['c.gov.au']) == ['c.gov.au']
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+"""
+Crawl a list of domains on this host, without AWS, Redis or Elasticsearch.
+
+Starts indexer-node workers and a manager-node in local mode
+(LOCAL_DATA_DIR): they are connected by queues in a SQLite file, page
+bodies are saved to <data-dir>/s3/ and indexed documents are written to
+<data-dir>/index/<index>.jsonl (or to Elasticsearch with --es).
+
+    ./run_local.py --indexers 4 --idle-exit 300 domains.txt
+    ./run_local.py data.gov.au www.naa.gov.au
+
+Domains found on the crawled pages are crawled too only with --follow.
+Stop it with Ctrl-C, or let --idle-exit stop it when the queues have
+been empty and quiet for that many seconds.
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+INDEXER_DIR = os.path.join(BASE_DIR, 'indexer-node', 'src')
+MANAGER_DIR = os.path.join(BASE_DIR, 'manager-node', 'src')
+sys.path.insert(0, INDEXER_DIR)
+
+from my_local import LocalQueues  # NOQA
+
+QUEUE_REQUESTS = 'local:requests'
+QUEUE_RESULTS = 'local:results'
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('domains', nargs='*', help="domain names or files with one domain per line")
+    parser.add_argument('--data-dir', default=os.path.join(BASE_DIR, 'local-data'))
+    parser.add_argument('--indexers', type=int, default=2, help="indexer processes")
+    parser.add_argument('--follow', action='store_true', help="crawl external domains too")
+    parser.add_argument('--es', metavar='HOST:PORT', help="index to this Elasticsearch")
+    parser.add_argument('--idle-exit', type=int, default=0, metavar='SECONDS',
+                        help="stop when nothing was queued for that long (0 - never)")
+    return parser
+
+
+def read_domains(values):
+    domains = []
+    for value in values:
+        if os.path.isfile(value):
+            with open(value) as f:
+                domains.extend(line.strip() for line in f if line.strip() and not line.startswith('#'))
+        else:
+            domains.append(value)
+    return domains
+
+
+def get_env(args):
+    env = dict(os.environ)
+    env.update({
+        'LOCAL_DATA_DIR': os.path.abspath(args.data_dir),
+        'QUEUE_REQUESTS': QUEUE_REQUESTS,
+        'QUEUE_RESULTS': QUEUE_RESULTS,
+        'REDIS_CONNECTION': '',
+        'VALIDATORS_DB': os.path.join(os.path.abspath(args.data_dir), 'validators.sqlite'),
+        'SUBTASKS_ENABLED': '1' if args.follow else '0',
+    })
+    if args.es:
+        env.update({'LOCAL_ES_ENABLED': '1', 'ANALYTICS_ES_ENDPOINT': args.es})
+    return env
+
+
+class Node(object):
+    """Node process, restarted when it exits (like daemon.sh does)"""
+
+    def __init__(self, name, command, cwd, env):
+        self.name = name
+        self.command = command
+        self.cwd = cwd
+        self.env = env
+        self.proc = None
+
+    def check(self):
+        if self.proc is not None and self.proc.poll() is None:
+            return
+        if self.proc is not None:
+            print("{} exited with code {}, restarting".format(self.name, self.proc.returncode))
+        self.proc = subprocess.Popen(self.command, cwd=self.cwd, env=self.env)
+
+    def stop(self):
+        if self.proc is not None and self.proc.poll() is None:
+            self.proc.terminate()
+            try:
+                self.proc.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+
+
+def is_idle(queues, idle_seconds):
+    now = time.time()
+    for queue in queues:
+        last_activity = queue.last_activity()
+        if queue.count() or (last_activity and now - last_activity < idle_seconds):
+            return False
+    return True
+
+
+def main():
+    args = get_parser().parse_args()
+    env = get_env(args)
+    queues = LocalQueues(env['LOCAL_DATA_DIR'])
+    requests_queue = queues.get_queue_by_name(QUEUE_REQUESTS.split(':')[-1])
+    results_queue = queues.get_queue_by_name(QUEUE_RESULTS.split(':')[-1])
+
+    domains = read_domains(args.domains)
+    for start in range(0, len(domains), 10):
+        requests_queue.send_messages(Entries=[
+            {'Id': str(i), 'MessageBody': domain}
+            for i, domain in enumerate(domains[start:start + 10])
+        ])
+    print("{} domains queued, {} in the queue".format(len(domains), requests_queue.count()))
+
+    nodes = [Node('manager', [sys.executable, 'manager.py'], MANAGER_DIR, env)]
+    for i in range(args.indexers):
+        nodes.append(Node('indexer-{}'.format(i), [sys.executable, 'worker.py'], INDEXER_DIR, env))
+
+    def stop(*_):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        while True:
+            for node in nodes:
+                node.check()
+            time.sleep(1)
+            if args.idle_exit and is_idle([requests_queue, results_queue], args.idle_exit):
+                print("Queues are idle for {} seconds, stopping".format(args.idle_exit))
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for node in nodes:
+            node.stop()
+
+
+if __name__ == '__main__':
+    main()
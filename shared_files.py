@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""
+Check that the files shared by the nodes are the same in all of them.
+
+Every node is built and deployed from its own src/ directory, so the
+shared modules are copied there. Change one copy and sync it to the rest:
+
+    ./shared_files.py                      # prints the differences, exits with 1
+    ./shared_files.py --sync indexer-node  # copies indexer-node's files to the other nodes
+"""
+import argparse
+import difflib
+import os
+import shutil
+import sys
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# file in src/: nodes which have a copy
+SHARED_FILES = {
+    'my_metrics.py': ('indexer-node', 'manager-node', 'crawler-node'),
+    'my_lazy.py': ('indexer-node', 'manager-node', 'crawler-node'),
+    'my_local.py': ('indexer-node', 'manager-node'),
+    'my_rules.py': ('indexer-node', 'manager-node'),
+    'my_envelope.py': ('indexer-node', 'manager-node'),
+    'crawl_rules.txt': ('indexer-node', 'manager-node'),
+}
+
+
+def get_path(node, name):
+    return os.path.join(BASE_DIR, node, 'src', name)
+
+
+def read(node, name):
+    with open(get_path(node, name)) as f:
+        return f.read()
+
+
+def get_differences():
+    """Unified diffs of the copies which differ from the first node's one"""
+    differences = []
+    for name, nodes in sorted(SHARED_FILES.items()):
+        base = nodes[0]
+        expected = read(base, name)
+        for node in nodes:
+            actual = read(node, name)
+            if actual != expected:
+                differences.append(''.join(difflib.unified_diff(
+                    expected.splitlines(True), actual.splitlines(True),
+                    '{}/src/{}'.format(base, name), '{}/src/{}'.format(node, name),
+                )))
+    return differences
+
+
+def sync(source):
+    for name, nodes in sorted(SHARED_FILES.items()):
+        if source not in nodes:
+            continue
+        for node in nodes:
+            if node != source and read(node, name) != read(source, name):
+                shutil.copyfile(get_path(source, name), get_path(node, name))
+                print("{}/src/{} updated".format(node, name))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sync', metavar='NODE', choices=sorted(set(sum(SHARED_FILES.values(), ()))),
+                        help="copy the shared files of this node to the others")
+    args = parser.parse_args()
+    if args.sync:
+        sync(args.sync)
+        return
+    differences = get_differences()
+    for diff in differences:
+        sys.stdout.write(diff)
+    if differences:
+        print("Shared files differ, sync them with --sync NODE")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()